@@ -0,0 +1,312 @@
+"""
+网关压测。
+
+在本机启动替身服务（Consul、权限服务、user_management、回显后端，见 stubs.py）和网关进程，
+用异步负载生成器按不同并发数压测，输出 RPS、延迟分位数以及网关各阶段的平均耗时
+（route=服务发现，authn=token刷新，authz=权限校验，forward=转发），结果保存为 JSON 便于前后对比。
+不依赖外部服务，可离线运行。
+
+    cd microservices/api-gateway
+    python bench/gateway_bench.py --concurrency 1,16,64,256 --duration 10
+    python bench/gateway_bench.py --remote-auth --latency-ms 20 --compare latest
+    python bench/gateway_bench.py --env LOAD_BALANCER_STRATEGY=least_request --env ADMISSION_CONTROL=false
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+GATEWAY_SRC = BENCH_DIR.parent / "src"
+DEFAULT_KEYS = BENCH_DIR.parent.parent / "user_management" / "src"
+RESULTS_DIR = BENCH_DIR / "results"
+sys.path.insert(0, str(BENCH_DIR))
+
+from stubs import ECHO_SERVICE, HOST, issue_token, run_stubs  # noqa: E402
+
+# 报告中的阶段名称
+STAGE_LABELS = {"route": "discovery", "authn": "refresh", "authz": "permission", "forward": "forward"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def run_gateway(port: int, env: Dict[str, str]):
+    """
+    网关进程入口。使用网关的 main.app（中间件和组件与线上一致），
+    但替换 lifespan：只启动服务发现并从替身服务同步公钥和权限表，不注册到 Consul、不连接 RabbitMQ。
+    """
+    os.environ.update(env)
+    os.chdir(GATEWAY_SRC)
+    sys.path.insert(0, str(GATEWAY_SRC))
+    import uvicorn
+    import main
+    from core import authorizer, registry, upstream
+
+    @asynccontextmanager
+    async def bench_lifespan(app):
+        registry.start()
+        if main.settings.local_auth:
+            await authorizer.sync(registry, upstream)
+        yield
+        registry.stop()
+        await upstream.close()
+
+    main.app.router.lifespan_context = bench_lifespan
+    uvicorn.run(main.app, host=HOST, port=port, log_level="warning", access_log=False)
+
+
+async def _load(url: str, tokens: List[str], concurrency: int, duration: float) -> dict:
+    """闭环负载：concurrency 个协程各自连续发送请求，直到 duration 秒结束"""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                headers = {"Authorization": f"Bearer {random.choice(tokens)}"} if tokens else {}
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url, headers=headers)
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"latencies": latencies, "statuses": statuses, "errors": errors}
+
+
+def load_process(url: str, tokens: List[str], concurrency: int, duration: float) -> dict:
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    return asyncio.run(_load(url, tokens, concurrency, duration))
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def stage_totals(gateway: str) -> Dict[str, List[float]]:
+    """读取网关的阶段耗时统计，返回 阶段名 -> [次数, 总耗时毫秒]"""
+    stats = httpx.get(f"{gateway}/_internal/stages", timeout=10).json()
+    return {name: [item["count"], item["avg_ms"] * item["count"]] for name, item in stats.items()}
+
+
+def stage_delta(before: Dict[str, List[float]], after: Dict[str, List[float]]) -> Dict[str, float]:
+    """两次统计之间各阶段的平均耗时（毫秒）"""
+    result = {}
+    for name, (count, total) in after.items():
+        prev_count, prev_total = before.get(name, [0, 0.0])
+        if count > prev_count:
+            result[STAGE_LABELS.get(name, name)] = round((total - prev_total) / (count - prev_count), 3)
+    return result
+
+
+def run_level(pool: ProcessPoolExecutor, gateway: str, url: str, tokens: List[str], concurrency: int,
+              processes: int, duration: float, warmup: float) -> dict:
+    per_process = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+    per_process = [c for c in per_process if c > 0]
+    if warmup > 0:
+        list(pool.map(load_process, *zip(*[(url, tokens, c, warmup) for c in per_process])))
+    before = stage_totals(gateway)
+    results = list(pool.map(load_process, *zip(*[(url, tokens, c, duration) for c in per_process])))
+    after = stage_totals(gateway)
+
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    statuses: Dict[str, int] = {}
+    for result in results:
+        for status, count in result["statuses"].items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(result["errors"] for result in results),
+        "statuses": statuses,
+        "rps": round(len(latencies) / duration, 1),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p90": round(percentile(latencies, 0.90) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0
+        },
+        "stages_ms": stage_delta(before, after)
+    }
+
+
+def wait_ready(gateway: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = httpx.get(f"{gateway}/_internal/services", params={"service_name": ECHO_SERVICE}, timeout=2)
+            if response.status_code == 200 and response.json().get("services"):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Gateway did not become ready")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result: dict, baseline: Optional[dict] = None):
+    base_levels = {level["concurrency"]: level for level in (baseline or {}).get("levels", [])}
+    stage_names = list(dict.fromkeys(name for level in result["levels"] for name in level["stages_ms"]))
+    header = f"{'conc':>6} {'rps':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} " + \
+        " ".join(f"{name + ' ms':>14}" for name in stage_names)
+    print(header)
+    for level in result["levels"]:
+        line = f"{level['concurrency']:>6} {level['rps']:>10} {level['latency_ms']['p50']:>9} " \
+               f"{level['latency_ms']['p99']:>9} {level['errors'] + sum(v for k, v in level['statuses'].items() if k != '200'):>7} " + \
+               " ".join(f"{level['stages_ms'].get(name, '-'):>14}" for name in stage_names)
+        print(line)
+        base = base_levels.get(level["concurrency"])
+        if base:
+            def change(new, old):
+                return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{'vs':>6} {change(level['rps'], base['rps']):>10} "
+                  f"{change(level['latency_ms']['p50'], base['latency_ms']['p50']):>9} "
+                  f"{change(level['latency_ms']['p99'], base['latency_ms']['p99']):>9}")
+
+
+def load_baseline(compare: Optional[str], exclude: Path) -> Optional[dict]:
+    if not compare:
+        return None
+    if compare == "latest":
+        candidates = sorted(path for path in RESULTS_DIR.glob("*.json") if path != exclude)
+        if not candidates:
+            return None
+        path = candidates[-1]
+    else:
+        path = Path(compare)
+    print(f"Comparing with {path}")
+    return json.loads(path.read_text())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API gateway load benchmark with local stub upstreams")
+    parser.add_argument("--concurrency", default="1,16,64,256", help="comma separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=2, help="warmup seconds per level")
+    parser.add_argument("--processes", type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                        help="load generator processes")
+    parser.add_argument("--backends", type=int, default=2, help="number of echo backend instances")
+    parser.add_argument("--latency-ms", type=float, default=5, help="echo backend latency")
+    parser.add_argument("--jitter-ms", type=float, default=1, help="echo backend latency jitter")
+    parser.add_argument("--body-bytes", type=int, default=1024, help="echo response size")
+    parser.add_argument("--path", default="/echo/1", help="path on the echo service")
+    parser.add_argument("--users", type=int, default=100, help="distinct tokens")
+    parser.add_argument("--refresh-ratio", type=float, default=0.0,
+                        help="fraction of tokens close to expiry, exercising the token refresh stage")
+    parser.add_argument("--anonymous", action="store_true", help="send requests without a token")
+    parser.add_argument("--remote-auth", action="store_true", help="disable local auth and call the permission stub")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra gateway settings")
+    parser.add_argument("--keys", default=str(DEFAULT_KEYS), help="directory with private_key.pem and public_key.pem")
+    parser.add_argument("--compare", help="baseline result file, or 'latest'")
+    parser.add_argument("--tag", default="", help="label stored with the results")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    private_key = (Path(args.keys) / "private_key.pem").read_text()
+    public_key = (Path(args.keys) / "public_key.pem").read_text()
+    consul_port, permission_port, user_port, gateway_port = (free_port() for _ in range(4))
+    echo_ports = [free_port() for _ in range(args.backends)]
+    gateway_env = {
+        "HEALTH_CHECK_INTERVAL": "10",
+        "SERVICE_TIMEOUT": "30",
+        "PORT": str(gateway_port),
+        "CONSUL_HOST": HOST,
+        "CONSUL_PORT": str(consul_port),
+        "CONSUL_WATCH_WAIT": "5s",
+        "LOCAL_AUTH": "false" if args.remote_auth else "true",
+        "GATEWAY_WORKERS": "1",
+        "DEBUG": "false",
+    }
+    gateway_env.update(item.split("=", 1) for item in args.env)
+
+    tokens = []
+    if not args.anonymous:
+        refreshing = int(args.users * args.refresh_ratio)
+        tokens = [
+            # 剩余有效期小于网关的 token_refresh_window 时会触发刷新
+            issue_token(private_key, f"bench{i}", ["user"], 120 if i < refreshing else 3600)
+            for i in range(args.users)
+        ]
+
+    context = multiprocessing.get_context("spawn")
+    stubs = context.Process(target=run_stubs, daemon=True, args=(
+        consul_port, permission_port, user_port, echo_ports, private_key, public_key,
+        args.latency_ms, args.jitter_ms, args.body_bytes
+    ))
+    gateway_process = context.Process(target=run_gateway, daemon=True, args=(gateway_port, gateway_env))
+    stubs.start()
+    gateway_process.start()
+    gateway = f"http://{HOST}:{gateway_port}"
+    url = f"{gateway}/{ECHO_SERVICE}{args.path}"
+    levels = [int(level) for level in args.concurrency.split(",")]
+    try:
+        wait_ready(gateway)
+        result = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "tag": args.tag,
+            "host": {"cpus": os.cpu_count(), "python": sys.version.split()[0]},
+            "config": {key: value for key, value in vars(args).items() if key not in ("keys", "compare", "no_save")},
+            "gateway_env": gateway_env,
+            "levels": []
+        }
+        with ProcessPoolExecutor(args.processes, mp_context=context) as pool:
+            for concurrency in levels:
+                level = run_level(pool, gateway, url, tokens, concurrency, args.processes, args.duration, args.warmup)
+                result["levels"].append(level)
+                print(f"concurrency={concurrency} rps={level['rps']} p99={level['latency_ms']['p99']}ms", flush=True)
+    finally:
+        gateway_process.terminate()
+        stubs.terminate()
+        gateway_process.join()
+        stubs.join()
+
+    path = None
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        name = datetime.now().strftime("%Y%m%d-%H%M%S") + (f"-{args.tag}" if args.tag else "")
+        path = RESULTS_DIR / f"{name}.json"
+        path.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+        print(f"Results saved to {path}")
+    print_report(result, load_baseline(args.compare, path))
+
+
+if __name__ == "__main__":
+    main()
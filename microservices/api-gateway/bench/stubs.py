@@ -0,0 +1,168 @@
+"""
+压测用的本地替身服务，全部运行在同一个进程中，各自监听一个本地端口：
+- Consul：只实现网关用到的 /v1/catalog/services 和 /v1/health/service/<name>（支持阻塞查询）
+- 权限服务：/permissions/list、/verify-permission
+- user_management：/public-key、/refresh-token
+- 回显后端：任意路径，按配置的延迟和响应体大小返回
+"""
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+import uvicorn
+from fastapi import FastAPI, Header, Request, Response
+from fastapi.responses import JSONResponse
+from jose import JWTError, jwt
+
+HOST = "127.0.0.1"
+# 压测使用的后端服务名及权限表
+ECHO_SERVICE = "echo"
+PERMISSIONS = [
+    {"service_name": ECHO_SERVICE, "path": "/echo", "required_permission": ["user", "admin"]},
+    {"service_name": ECHO_SERVICE, "path": "/echo/{item_id}", "required_permission": ["user", "admin"]},
+    {"service_name": ECHO_SERVICE, "path": "/public", "required_permission": ["public"]},
+]
+
+
+def _parse_wait(wait: Optional[str]) -> float:
+    """解析 Consul 的 wait 参数（如 30s、500ms、5m）"""
+    if not wait:
+        return 0
+    if wait.endswith("ms"):
+        return float(wait[:-2]) / 1000
+    if wait.endswith("m"):
+        return float(wait[:-1]) * 60
+    return float(wait.rstrip("s"))
+
+
+def create_consul(services: Dict[str, List[Tuple[str, int]]]) -> FastAPI:
+    """服务目录固定不变，阻塞查询等到 wait 超时后返回相同的 index"""
+    app = FastAPI()
+    index = "1"
+
+    async def blocking(request: Request):
+        if request.query_params.get("index") == index:
+            await asyncio.sleep(_parse_wait(request.query_params.get("wait")))
+
+    @app.get("/v1/catalog/services")
+    async def catalog(request: Request):
+        await blocking(request)
+        return JSONResponse({name: [] for name in services}, headers={"X-Consul-Index": index})
+
+    @app.get("/v1/health/service/{name}")
+    async def health(name: str, request: Request):
+        await blocking(request)
+        entries = [
+            {
+                "Node": {"Node": "bench", "Address": host},
+                "Service": {"ID": f"{name}-{i}", "Service": name, "Address": host, "Port": port, "Tags": [], "Meta": {}},
+                "Checks": [{"Status": "passing"}]
+            }
+            for i, (host, port) in enumerate(services.get(name, []))
+        ]
+        return JSONResponse(entries, headers={"X-Consul-Index": index})
+
+    return app
+
+
+def create_permission(public_key: str) -> FastAPI:
+    """与权限服务行为一致：公开路径直接放行，其余校验 JWT 和角色"""
+    app = FastAPI()
+
+    @app.get("/permissions/list")
+    async def list_permissions():
+        return PERMISSIONS
+
+    @app.post("/verify-permission")
+    async def verify_permission(request: Request, authorization: str = Header(None)):
+        body = await request.json()
+        required = next(
+            (p["required_permission"] for p in PERMISSIONS
+             if p["service_name"] == body["service_name"] and _match(p["path"], body["path"])),
+            None
+        )
+        if required and "public" in required:
+            return {"message": "Permission granted"}
+        if not authorization or "Bearer " not in authorization:
+            return JSONResponse(status_code=401, content={"message": "Missing or invalid Authorization header"})
+        try:
+            payload = jwt.decode(authorization.split("Bearer ")[-1], public_key, algorithms=["RS256"])
+        except JWTError:
+            return JSONResponse(status_code=401, content={"detail": "Token validation failed"})
+        if required is None:
+            return JSONResponse(status_code=404, content={"detail": "Path not found"})
+        if not set(payload.get("roles") or []) & set(required):
+            return JSONResponse(status_code=403, content={"detail": "Permission denied"})
+        return {
+            "message": "Permission granted",
+            "user_info": {"id": payload.get("sub"), "role": ",".join(payload.get("roles") or [])}
+        }
+
+    return app
+
+
+def _match(pattern: str, path: str) -> bool:
+    pattern_parts, path_parts = pattern.strip('/').split('/'), path.strip('/').split('/')
+    return len(pattern_parts) == len(path_parts) and all(
+        a == b or a.startswith('{') for a, b in zip(pattern_parts, path_parts)
+    )
+
+
+def create_user_management(private_key: str, public_key: str, token_ttl: float = 1800) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/public-key")
+    async def get_public_key():
+        return {"public_key": public_key}
+
+    @app.post("/refresh-token")
+    async def refresh_token(authorization: str = Header(None)):
+        payload = jwt.get_unverified_claims(authorization.split("Bearer ")[-1])
+        payload["exp"] = int(time.time() + token_ttl)
+        return {"refreshed": True, "new_token": jwt.encode(payload, private_key, algorithm="RS256")}
+
+    return app
+
+
+def create_echo(latency_ms: float, jitter_ms: float, body_bytes: int) -> FastAPI:
+    """回显后端：等待 latency_ms ± jitter_ms 后返回固定大小的响应体"""
+    app = FastAPI()
+    body = b'{"data":"' + b"x" * max(0, body_bytes - 11) + b'"}'
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+    async def echo(path: str):
+        delay = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        return Response(body, media_type="application/json", headers={"Cache-Control": "no-store"})
+
+    return app
+
+
+def issue_token(private_key: str, username: str, roles: List[str], ttl: float) -> str:
+    return jwt.encode({"sub": username, "roles": roles, "exp": int(time.time() + ttl)}, private_key, algorithm="RS256")
+
+
+async def serve(apps: List[Tuple[FastAPI, int]]):
+    """在当前事件循环中同时运行多个替身服务，直到进程被终止"""
+    servers = [
+        uvicorn.Server(uvicorn.Config(app, host=HOST, port=port, log_level="warning", access_log=False))
+        for app, port in apps
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def run_stubs(consul_port: int, permission_port: int, user_port: int, echo_ports: List[int],
+              private_key: str, public_key: str, latency_ms: float, jitter_ms: float, body_bytes: int):
+    """替身进程入口"""
+    services = {
+        "permission": [(HOST, permission_port)],
+        "user_management": [(HOST, user_port)],
+        ECHO_SERVICE: [(HOST, port) for port in echo_ports]
+    }
+    apps = [
+        (create_consul(services), consul_port),
+        (create_permission(public_key), permission_port),
+        (create_user_management(private_key, public_key), user_port),
+    ] + [(create_echo(latency_ms, jitter_ms, body_bytes), port) for port in echo_ports]
+    asyncio.run(serve(apps))
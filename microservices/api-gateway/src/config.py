@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 from pathlib import Path
 
@@ -13,6 +13,111 @@ class Settings(BaseSettings):
     service_check_interval: str = "10s"
     service_check_timeout: str = "1s"
     service_tags: List[str] = ["api-gateway"]
+    # Consul 阻塞查询的等待时间及失败重试间隔（秒）
+    consul_watch_wait: str = "30s"
+    consul_retry_interval: float = 5
+    # 上游连接池配置（每个上游服务单独计算）
+    upstream_max_connections: int = 100
+    upstream_max_keepalive_connections: int = 20
+    upstream_keepalive_expiry: float = 30.0
+    upstream_connect_timeout: float = 3.0
+    upstream_http2: bool = False
+    # 负载均衡策略：round_robin / least_request / peak_ewma
+    load_balancer_strategy: str = "peak_ewma"
+    lb_ewma_decay_time: float = 10
+    # 被动异常摘除：连续失败次数、摘除时长（秒，逐次翻倍）、恢复所需的探测成功次数
+    outlier_consecutive_failures: int = 5
+    outlier_base_ejection_time: float = 30
+    outlier_max_ejection_time: float = 300
+    outlier_probe_successes: int = 3
+    # 一致性哈希路由规则（为空则不启用），如 "query:/subject/{subject_id}"、"query:/cfc/predict?id"
+    consistent_hash_routes: List[str] = [
+        "query:/subject/{subject_id}",
+        "query:/subject/{subject_id}/data",
+        "query:/cfc/predict?id",
+        "query:/cfc/fit/{task_id}",
+        "query:/cfc/fit/{task_id}/events"
+    ]
+    consistent_hash_replicas: int = 160
+    consistent_hash_load_factor: float = 1.25
+    # 本地鉴权：使用公钥和权限表快照在网关内校验，未就绪时回退到权限服务
+    local_auth: bool = True
+    auth_sync_interval: float = 60
+    # token剩余有效期小于该值（秒）时才刷新，与user_management的刷新阈值一致
+    token_refresh_window: float = 300
+    token_refresh_cache_ttl: float = 60
+    # 网关 GET 响应缓存：缓存的路由、内存预算（字节）、单条上限及上游未给出 max-age 时的有效期（秒）
+    response_cache: bool = True
+    response_cache_routes: List[str] = [
+        "query:/subject/list",
+        "query:/subject/{subject_id}",
+        "query:/subject/{subject_id}/data",
+        "query:/keywords/categories/list",
+        "query:/layouts/list"
+    ]
+    response_cache_max_bytes: int = 64 * 1024 * 1024
+    response_cache_max_entry_bytes: int = 1024 * 1024
+    response_cache_ttl: float = 30
+    # 相同并发 GET 请求合并：同一时刻只向上游转发一次；Content-Length 超过上限的响应不缓冲，改为流式转发
+    request_coalescing: bool = True
+    coalesce_max_body_bytes: int = 1024 * 1024
+    coalesce_routes: List[str] = [
+        "query:/subject/list",
+        "query:/subject/{subject_id}",
+        "query:/subject/{subject_id}/data",
+        "query:/keywords/categories/list",
+        "query:/layouts/list",
+        "query:/interests/collections/stats"
+    ]
+    # 准入控制：按服务和按路由的并发上限（未列出的服务使用默认值）、等待队列长度及超时（秒）
+    # 路由规则为 "[METHOD ]service:/path"，带方法时只限制该方法的请求（如只限制创建任务，不限制查询列表）
+    admission_control: bool = True
+    service_concurrency_limits: Dict[str, int] = {}
+    default_concurrency_limit: int = 128
+    route_concurrency_limits: Dict[str, int] = {
+        "POST query:/cfc/train": 2,
+        "POST query:/cfc/fit": 4,
+        "POST collector:/tasks/historical": 8,
+        "POST collector:/tasks/scheduled": 8,
+        "POST collector:/trends/by-region": 4,
+        "POST collector:/trends/over-time": 4
+    }
+    admission_queue_size: int = 32
+    admission_queue_timeout: float = 2.0
+    # 自适应并发上限（AIMD）：延迟超过基线的倍数时下调
+    adaptive_concurrency: bool = False
+    adaptive_latency_tolerance: float = 2.0
+    # 按用户限流（每秒请求数，0 为不限制）及突发容量
+    user_rate_limit: float = 0
+    user_rate_burst: int = 20
+    # 响应压缩：小于 compression_min_size 字节的响应不压缩，每秒用于压缩的 CPU 时间不超过 compression_cpu_budget 秒
+    compression: bool = True
+    compression_min_size: int = 1024
+    compression_cpu_budget: float = 0.25
+    compression_gzip_level: int = 5
+    compression_brotli_level: int = 4
+    compression_zstd_level: int = 3
+    # 多 worker 模式：worker 数大于 1 时由一个 leader worker 访问 Consul 和消息队列，
+    # 通过共享目录（默认 /dev/shm/trends-gateway）向其他 worker 发布快照
+    gateway_workers: int = 1
+    shared_state_dir: str = ""
+    shared_state_interval: float = 1.0
+    shared_max_workers: int = 32
+    # 身份断言：与下游服务共享的 HMAC 密钥（为空则不签发）及断言有效期（秒）
+    identity_secret: str = ""
+    identity_ttl: float = 30
+    # 流式转发：SSE 两个事件之间、WebSocket 两条消息之间的最长空闲时间（秒），超过后断开
+    stream_idle_timeout: float = 300
+    # WebSocket 转发：是否启用、连接上游的握手超时及心跳间隔（秒，0 为不发送心跳）
+    websocket_proxy: bool = True
+    websocket_open_timeout: float = 10
+    websocket_ping_interval: float = 20
+    # 是否在响应中返回各阶段耗时（Server-Timing 头）
+    server_timing: bool = False
+    rabbitmq_host: str =  "localhost"
+    rabbitmq_port: int = 5672
+    rabbitmq_username: str = "admin"
+    rabbitmq_password: str = "admin"
    
     class Config:
         env_file = Path(__file__).parent.parent / ".env"
@@ -1,8 +1,97 @@
 from config import get_settings
-from utils.load_balancer import RoundRobinBalancer
+from utils.load_balancer import ConsistentHashBalancer, OutlierEjector, create_balancer
+from utils.route_rules import RouteKeyExtractor
+from utils.stages import StageStats
+from utils.compression import ResponseCompressor
+from utils.websocket_proxy import WebSocketProxy
 from services.registry import ConsulRegistry
+from services.http_client import UpstreamClientPool
+from services.authorizer import LocalAuthorizer
+from services.token_refresher import TokenRefresher
+from services.response_cache import ResponseCache
+from services.coalescer import RequestCoalescer
+from services.admission import AdmissionController
+from services.shared_state import SharedState
+from services.identity import IdentitySigner
 
 setting = get_settings()
 # 初始化核心组件
-registry = ConsulRegistry(host=setting.consul_host, port=setting.consul_port)
-balancer = RoundRobinBalancer()
+registry = ConsulRegistry(
+    host=setting.consul_host,
+    port=setting.consul_port,
+    watch_wait=setting.consul_watch_wait,
+    retry_interval=setting.consul_retry_interval
+)
+balancer = create_balancer(
+    setting.load_balancer_strategy,
+    OutlierEjector(
+        consecutive_failures=setting.outlier_consecutive_failures,
+        base_ejection_time=setting.outlier_base_ejection_time,
+        max_ejection_time=setting.outlier_max_ejection_time,
+        probe_successes=setting.outlier_probe_successes
+    ),
+    ewma_decay_time=setting.lb_ewma_decay_time
+)
+route_keys = RouteKeyExtractor(setting.consistent_hash_routes)
+if route_keys:
+    balancer = ConsistentHashBalancer(
+        balancer,
+        replicas=setting.consistent_hash_replicas,
+        load_factor=setting.consistent_hash_load_factor
+    )
+
+upstream = UpstreamClientPool(
+    max_connections=setting.upstream_max_connections,
+    max_keepalive_connections=setting.upstream_max_keepalive_connections,
+    keepalive_expiry=setting.upstream_keepalive_expiry,
+    connect_timeout=setting.upstream_connect_timeout,
+    read_timeout=setting.service_timeout,
+    http2=setting.upstream_http2
+)
+authorizer = LocalAuthorizer()
+identity_signer = IdentitySigner(setting.identity_secret, setting.identity_ttl) if setting.identity_secret else None
+token_refresher = TokenRefresher(
+    registry,
+    upstream,
+    refresh_window=setting.token_refresh_window,
+    cache_ttl=setting.token_refresh_cache_ttl
+)
+response_cache = ResponseCache(
+    setting.response_cache_routes,
+    max_bytes=setting.response_cache_max_bytes,
+    max_entry_bytes=setting.response_cache_max_entry_bytes,
+    default_ttl=setting.response_cache_ttl
+) if setting.response_cache else None
+coalescer = RequestCoalescer(
+    setting.coalesce_routes, max_body_bytes=setting.coalesce_max_body_bytes
+) if setting.request_coalescing else None
+admission = AdmissionController(
+    setting.service_concurrency_limits,
+    setting.route_concurrency_limits,
+    default_limit=setting.default_concurrency_limit,
+    queue_size=setting.admission_queue_size,
+    queue_timeout=setting.admission_queue_timeout,
+    adaptive=setting.adaptive_concurrency,
+    tolerance=setting.adaptive_latency_tolerance,
+    user_rate=setting.user_rate_limit,
+    user_burst=setting.user_rate_burst
+) if setting.admission_control else None
+compressor = ResponseCompressor(
+    min_size=setting.compression_min_size,
+    cpu_budget=setting.compression_cpu_budget,
+    gzip_level=setting.compression_gzip_level,
+    brotli_level=setting.compression_brotli_level,
+    zstd_level=setting.compression_zstd_level
+) if setting.compression else None
+websocket_proxy = WebSocketProxy(
+    registry,
+    balancer,
+    route_keys,
+    idle_timeout=setting.stream_idle_timeout,
+    open_timeout=setting.websocket_open_timeout,
+    ping_interval=setting.websocket_ping_interval
+) if setting.websocket_proxy else None
+# 多 worker 模式下的进程间共享状态（在各 worker 的 lifespan 中启动）
+shared_state = SharedState(setting.shared_state_dir, setting.shared_max_workers) if setting.gateway_workers > 1 else None
+# 网关各处理阶段的耗时统计
+stage_stats = StageStats()
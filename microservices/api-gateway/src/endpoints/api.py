@@ -1,7 +1,7 @@
 
 from fastapi import APIRouter
 
-from core import registry
+from core import registry, balancer, upstream, token_refresher, stage_stats, response_cache, coalescer, admission, compressor, shared_state, websocket_proxy
 router = APIRouter(prefix="/_internal")
 
 
@@ -11,3 +11,59 @@ def list_services(service_name: str):
     return {
         "services": registry.get_healthy_instances(service_name)
     }
+
+
+@router.get("/discovery")
+def discovery_stats():
+    """服务发现缓存状态"""
+    return registry.stats()
+
+@router.get("/pool")
+def pool_stats():
+    """上游连接池使用情况"""
+    return upstream.stats()
+
+@router.get("/token-refresh")
+def token_refresh_stats():
+    """本地token刷新缓存状态"""
+    return token_refresher.stats()
+
+@router.get("/balancer")
+def balancer_stats():
+    """负载均衡及异常摘除状态"""
+    return balancer.describe()
+
+@router.get("/stages")
+def stage_timing_stats():
+    """网关各处理阶段耗时"""
+    return stage_stats.stats()
+
+@router.get("/response-cache")
+def response_cache_stats():
+    """响应缓存状态"""
+    return response_cache.stats() if response_cache else {"enabled": False}
+
+@router.get("/coalescing")
+def coalescing_stats():
+    """请求合并统计"""
+    return coalescer.stats() if coalescer else {"enabled": False}
+
+@router.get("/limits")
+def admission_stats():
+    """准入控制状态：各服务、路由的并发上限和排队情况"""
+    return admission.stats() if admission else {"enabled": False}
+
+@router.get("/compression")
+def compression_stats():
+    """响应压缩统计"""
+    return compressor.stats() if compressor else {"enabled": False}
+
+@router.get("/websockets")
+def websocket_stats():
+    """WebSocket 转发统计"""
+    return websocket_proxy.stats() if websocket_proxy else {"enabled": False}
+
+@router.get("/worker")
+def worker_stats():
+    """当前 worker 的多进程状态"""
+    return shared_state.stats() if shared_state else {"workers": 1}
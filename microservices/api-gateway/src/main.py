@@ -1,15 +1,19 @@
 # app/main.py
+import asyncio
+import json
 import socket
+import aio_pika
 from fastapi import FastAPI, Request
 from contextlib import asynccontextmanager
 
 from fastapi.responses import JSONResponse
 import uvicorn
+from services.rabbitmq import RabbitMQClient
 from services.registry import ServiceInstance
 from utils.middleware import GatewayMiddleware
 from endpoints import api
 from config import get_settings
-from core import registry, balancer
+from core import registry, balancer, route_keys, upstream, authorizer, token_refresher, stage_stats, response_cache, coalescer, admission, compressor, shared_state, websocket_proxy, identity_signer
 from fastapi.middleware.cors import CORSMiddleware
 
 settings= get_settings()
@@ -23,14 +27,102 @@ instance = ServiceInstance(
         health_check_url=f"http://{socket.gethostbyname(hostname)}:{settings.port}/_internal/health"
     )
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-   
-    
+@RabbitMQClient.consumer(queue="public_key_queue", broadcast=True)
+async def on_public_key(message: aio_pika.IncomingMessage):
+    async with message.process():
+        aio_pika.logger.info("已收到公钥")
+        authorizer.public_key = message.body.decode()
+
+@RabbitMQClient.consumer(queue="permission_update_queue", broadcast=True)
+async def on_permission_update(message: aio_pika.IncomingMessage):
+    async with message.process():
+        # 权限服务在权限表变更后推送全量快照
+        authorizer.load_permissions(json.loads(message.body.decode()))
+
+@RabbitMQClient.consumer(queue="query_data_changed", broadcast=True)
+async def on_query_data_changed(message: aio_pika.IncomingMessage):
+    async with message.process():
+        # 查询服务数据变化（如写入新的兴趣数据）后失效对应的响应缓存
+        if response_cache:
+            change = json.loads(message.body.decode())
+            response_cache.invalidate(
+                change.get("service_name", "query"), change.get("prefixes"), record=shared_state is not None
+            )
+
+async def start_leader(app: FastAPI):
+    """启动服务注册、Consul watch、消息消费和权限同步（多 worker 模式下只在 leader 中运行）"""
     registry.register(instance)
-    yield
+    # 启动服务发现缓存的后台刷新
+    registry.start()
+    if settings.local_auth or response_cache:
+        await RabbitMQClient.start_consumers(app)
+    if settings.local_auth:
+        app.state.sync_task = asyncio.create_task(
+            authorizer.sync_periodically(registry, upstream, settings.auth_sync_interval)
+        )
+    app.state.leading = True
+
+async def stop_leader(app: FastAPI):
     # 注销服务
+    if settings.local_auth:
+        app.state.sync_task.cancel()
+    if settings.local_auth or response_cache:
+        await RabbitMQClient.close_consumers(app)
+    registry.stop()
     registry.deregister(instance.service_name, instance.instance_id)
+
+def load_shared_snapshot():
+    snapshot = shared_state.read_if_changed("gateway")
+    if snapshot:
+        registry.load_snapshot(snapshot["registry"])
+        authorizer.load_snapshot(snapshot["auth"])
+        if response_cache:
+            response_cache.apply_invalidations(snapshot["invalidations"])
+
+async def share_state(app: FastAPI):
+    """多 worker 模式：leader 发布快照，其他 worker 加载快照；leader 退出后由其他 worker 接管"""
+    published = None
+    while True:
+        try:
+            if shared_state.is_leader:
+                log = list(response_cache.invalidation_log) if response_cache else []
+                version = (registry.version, authorizer.version, log[-1][0] if log else 0)
+                if version != published:
+                    shared_state.publish("gateway", {
+                        "registry": registry.snapshot(),
+                        "auth": authorizer.snapshot(),
+                        "invalidations": log
+                    })
+                    published = version
+            else:
+                load_shared_snapshot()
+                if shared_state.try_lead():
+                    await start_leader(app)
+        except Exception as e:
+            aio_pika.logger.warning(f"Failed to share gateway state: {e}")
+        await asyncio.sleep(settings.shared_state_interval)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.leading = False
+    share_task = None
+    if shared_state is not None:
+        shared_state.start()
+        balancer.attach_shared(shared_state.counters, shared_state.worker_id)
+        if not shared_state.is_leader:
+            load_shared_snapshot()
+        share_task = asyncio.create_task(share_state(app))
+    if shared_state is None or shared_state.is_leader:
+        await start_leader(app)
+    yield
+    if share_task is not None:
+        share_task.cancel()
+    if app.state.leading:
+        await stop_leader(app)
+    if shared_state is not None:
+        shared_state.stop()
+    # 关闭上游连接池
+    await upstream.close()
     
 
 app = FastAPI(lifespan=lifespan)
@@ -38,7 +130,20 @@ app.include_router(api.router)
 app.add_middleware(
     GatewayMiddleware,
     registry=registry,
-    balancer=balancer
+    balancer=balancer,
+    route_keys=route_keys,
+    response_cache=response_cache,
+    coalescer=coalescer,
+    admission=admission,
+    compressor=compressor,
+    upstream=upstream,
+    token_refresher=token_refresher,
+    authorizer=authorizer if settings.local_auth else None,
+    stage_stats=stage_stats,
+    server_timing=settings.server_timing,
+    websocket_proxy=websocket_proxy,
+    stream_idle_timeout=settings.stream_idle_timeout,
+    identity_signer=identity_signer
 )
 origins = [
     "https://page.918113.top",  # 根据实际情况调整为您的前端应用的源
@@ -65,4 +170,8 @@ async def global_exception_handler(request: Request, exc: Exception):
             }
         )
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=settings.port)
+    if settings.gateway_workers > 1:
+        # 多 worker 模式需要以导入路径启动，每个 worker 进程各自导入应用
+        uvicorn.run("main:app", host="0.0.0.0", port=settings.port, loop="auto", http="auto", workers=settings.gateway_workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=settings.port, loop="auto", http="auto")
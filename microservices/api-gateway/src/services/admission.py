@@ -0,0 +1,208 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+from services.permission_matcher import PermissionMatcher
+
+
+class ConcurrencyLimiter:
+    """
+    并发限制。超过上限的请求进入有界等待队列，队列已满或等待超时则拒绝。
+    开启 adaptive 后按 AIMD 调整上限：延迟超过基线延迟 × tolerance 或上游失败时按比例下调，
+    其余情况每个请求缓慢上调；基线取观测到的最小延迟并缓慢回升。
+    """
+    def __init__(self, limit: int, queue_size: int = 32, queue_timeout: float = 2.0, adaptive: bool = False,
+                 min_limit: int = 1, max_limit: Optional[int] = None, tolerance: float = 2.0,
+                 backoff: float = 0.9, cooldown: float = 1.0):
+        self.limit = float(limit)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_limit = max_limit or limit * 2
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.inflight = 0
+        self.min_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    async def acquire(self) -> bool:
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            # 已被唤醒但请求随即被取消（如客户端断开），归还名额
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        # 名额在唤醒时已经转交给本请求
+        self.admitted += 1
+        return True
+
+    def release(self, latency: Optional[float] = None, success: bool = True):
+        """归还名额；latency 为 None 时不参与自适应调整（如请求未被转发）"""
+        self.inflight -= 1
+        if self.adaptive and latency is not None:
+            self._adjust(latency, success)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+
+    def _adjust(self, latency: float, success: bool):
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        else:
+            # 基线缓慢回升，避免一次偶然的低延迟长期压低上限
+            self.min_latency += (latency - self.min_latency) * 0.001
+        now = time.monotonic()
+        if not success or latency > self.min_latency * self.tolerance:
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "inflight": self.inflight,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "min_latency_ms": round(self.min_latency * 1000, 2) if self.min_latency is not None else None
+        }
+
+
+class TokenBuckets:
+    """按用户的令牌桶限流，只保留最近活跃的 max_users 个用户"""
+    def __init__(self, rate: float, burst: int, max_users: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.rejected = 0
+
+    def take(self, user: str) -> float:
+        """取一个令牌；成功返回 0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(user, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.rejected += 1
+        self._buckets[user] = (tokens, now)
+        self._buckets.move_to_end(user)
+        while len(self._buckets) > self.max_users:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "users": len(self._buckets), "rejected": self.rejected}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, message: str, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+def _route_key(route: str) -> Tuple[str, str]:
+    """路由规则 "[METHOD ]service:/path" 拆分为 (匹配器中的服务键, 路径)；带方法的规则以 "METHOD service" 为服务键"""
+    method, _, target = route.rpartition(' ')
+    service_name, _, path = target.partition(':')
+    return (f"{method.upper()} {service_name}" if method else service_name), path
+
+
+class AdmissionController:
+    """
+    网关准入控制：按用户令牌桶（429）、按路由和按服务的并发限制（503）。
+    路由规则可以带请求方法（如 "POST collector:/tasks/historical"），只限制该方法；不带方法时限制所有方法，
+    两者都匹配时带方法的规则优先。
+    admit 返回本次请求占用的限制器列表，请求结束后交给 release 归还。
+    """
+    def __init__(self, service_limits: Dict[str, int], route_limits: Dict[str, int], default_limit: int = 128,
+                 queue_size: int = 32, queue_timeout: float = 2.0, adaptive: bool = False,
+                 tolerance: float = 2.0, user_rate: float = 0, user_burst: int = 20):
+        self._options = dict(queue_size=queue_size, queue_timeout=queue_timeout, adaptive=adaptive, tolerance=tolerance)
+        self.default_limit = default_limit
+        self.services: Dict[str, ConcurrencyLimiter] = {
+            service_name: ConcurrencyLimiter(limit, **self._options) for service_name, limit in service_limits.items()
+        }
+        self.routes: Dict[str, ConcurrencyLimiter] = {
+            route: ConcurrencyLimiter(limit, **self._options) for route, limit in route_limits.items()
+        }
+        self.matcher = PermissionMatcher()
+        self.matcher.build((*_route_key(route), [route]) for route in route_limits)
+        self.users = TokenBuckets(user_rate, user_burst) if user_rate > 0 else None
+
+    def _service_limiter(self, service_name: str) -> ConcurrencyLimiter:
+        limiter = self.services.get(service_name)
+        if limiter is None:
+            limiter = self.services[service_name] = ConcurrencyLimiter(self.default_limit, **self._options)
+        return limiter
+
+    async def admit(self, service_name: str, path: str, user: Optional[str],
+                    method: str = "GET") -> List[ConcurrencyLimiter]:
+        if self.users is not None and user:
+            wait = self.users.take(user)
+            if wait:
+                raise AdmissionRejected(429, "Too many requests", wait)
+        limiters = []
+        matched = self.matcher.match(f"{method.upper()} {service_name}", path) or self.matcher.match(service_name, path)
+        if matched:
+            limiters.append(self.routes[matched[0]])
+        limiters.append(self._service_limiter(service_name))
+        acquired = []
+        try:
+            for limiter in limiters:
+                if not await limiter.acquire():
+                    raise AdmissionRejected(503, f"Service {service_name} is overloaded", limiter.queue_timeout)
+                acquired.append(limiter)
+        except BaseException:
+            # 被拒绝或请求被取消时归还已占用的名额
+            self.release(acquired)
+            raise
+        return acquired
+
+    @staticmethod
+    def release(limiters: List[ConcurrencyLimiter], latency: Optional[float] = None, success: bool = True):
+        for limiter in limiters:
+            limiter.release(latency, success)
+
+    def stats(self) -> dict:
+        return {
+            "services": {name: limiter.stats() for name, limiter in self.services.items()},
+            "routes": {route: limiter.stats() for route, limiter in self.routes.items()},
+            "users": self.users.stats() if self.users else None
+        }
@@ -0,0 +1,113 @@
+import asyncio
+from typing import List, Optional
+import httpx
+from fastapi.logger import logger
+from jose import JWTError, jwt
+from pydantic import BaseModel
+from services.permission_matcher import PermissionMatcher
+
+
+class AuthResult(BaseModel):
+    status_code: int
+    message: str
+    payload: Optional[dict] = None
+
+    @property
+    def user_info(self) -> Optional[dict]:
+        """转发给下游服务的用户信息"""
+        if not self.payload:
+            return None
+        return {"id": self.payload.get("sub"), "role": ",".join(self.payload.get("roles") or [])}
+
+
+class LocalAuthorizer:
+    """
+    网关本地鉴权。
+    使用 user_management 广播的公钥校验 JWT，并根据权限表快照在进程内判断是否放行，
+    判断规则与权限服务的 /verify-permission 保持一致。权限服务仍是权限数据的唯一来源。
+    """
+    def __init__(self):
+        self._public_key: Optional[str] = None
+        self.matcher = PermissionMatcher()
+        self.permissions: Optional[List[dict]] = None
+        # 公钥或权限表每次变化时递增，多 worker 模式下据此判断是否需要发布快照
+        self.version = 0
+
+    @property
+    def public_key(self) -> Optional[str]:
+        return self._public_key
+
+    @public_key.setter
+    def public_key(self, public_key: Optional[str]):
+        if public_key != self._public_key:
+            self._public_key = public_key
+            self.version += 1
+
+    @property
+    def ready(self) -> bool:
+        """公钥和权限表都已加载时才能在本地鉴权"""
+        return bool(self.public_key) and self.permissions is not None
+
+    def load_permissions(self, permissions: List[dict]):
+        """加载权限表快照（格式同权限服务 /permissions/list 的返回）"""
+        self.matcher.build(
+            (p["service_name"], p["path"], p["required_permission"]) for p in permissions
+        )
+        self.permissions = permissions
+        self.version += 1
+
+    def snapshot(self) -> dict:
+        return {"public_key": self.public_key, "permissions": self.permissions}
+
+    def load_snapshot(self, snapshot: dict):
+        """加载 leader worker 发布的公钥和权限表"""
+        if snapshot.get("public_key"):
+            self.public_key = snapshot["public_key"]
+        if snapshot.get("permissions") is not None:
+            self.load_permissions(snapshot["permissions"])
+
+    def authorize(self, service_name: str, path: str, authorization: Optional[str]) -> AuthResult:
+        required = self.matcher.match(service_name, path)
+        if required and "public" in required:
+            return AuthResult(status_code=200, message="Permission granted")
+
+        if not authorization or "Bearer " not in authorization:
+            return AuthResult(status_code=401, message="Missing or invalid Authorization header")
+        token = authorization.split("Bearer ")[-1]
+        try:
+            payload = jwt.decode(token, self.public_key, algorithms=["RS256"])
+        except JWTError:
+            return AuthResult(status_code=401, message="Token validation failed")
+        if not payload.get("sub"):
+            return AuthResult(status_code=401, message="Invalid token")
+
+        if required is None:
+            return AuthResult(status_code=404, message="Path not found")
+        if set(payload.get("roles") or []) & set(required):
+            return AuthResult(status_code=200, message="Permission granted", payload=payload)
+        return AuthResult(status_code=403, message="Permission denied")
+
+    async def sync(self, registry, upstream):
+        """从权限服务拉取权限表，公钥缺失时从 user_management 拉取"""
+        instances = registry.get_healthy_instances("permission")
+        if instances:
+            target = instances[0]
+            response = await upstream.get_client("permission").get(f"http://{target.host}:{target.port}/permissions/list")
+            response.raise_for_status()
+            self.load_permissions(response.json())
+        if not self.public_key:
+            instances = registry.get_healthy_instances("user_management")
+            if instances:
+                target = instances[0]
+                response = await upstream.get_client("user_management").get(f"http://{target.host}:{target.port}/public-key")
+                response.raise_for_status()
+                self.public_key = response.json().get("public_key")
+
+    async def sync_periodically(self, registry, upstream, interval: float):
+        """定期全量同步，作为消息推送之外的兜底"""
+        while True:
+            try:
+                await self.sync(registry, upstream)
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"Failed to sync auth state: {e}")
+            await asyncio.sleep(interval)
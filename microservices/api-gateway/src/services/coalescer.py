@@ -0,0 +1,46 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+from services.permission_matcher import PermissionMatcher
+from utils.singleflight import SingleFlight
+
+
+class RequestCoalescer:
+    """
+    相同并发 GET 请求合并。
+    只处理配置中列出的路由；同一时刻相同 key 的请求只有一个转发到上游，其余等待并共享结果，
+    按路由统计请求数和被合并的请求数。共享的响应需要完整缓冲，响应体超过 max_body_bytes 的不缓冲。
+    """
+    def __init__(self, routes: Iterable[str], max_body_bytes: int = 1024 * 1024):
+        self.max_body_bytes = max_body_bytes
+        self.matcher = PermissionMatcher()
+        # 匹配结果保存路由规则本身，用作统计的维度
+        self.matcher.build(
+            (route.partition(':')[0], route.partition(':')[2], [route]) for route in routes
+        )
+        self._flight = SingleFlight()
+        self._stats: Dict[str, List[int]] = {}  # 路由 -> [请求数, 被合并数]
+
+    def route_for(self, service_name: str, path: str) -> Optional[str]:
+        matched = self.matcher.match(service_name, path)
+        return matched[0] if matched else None
+
+    async def do(self, route: str, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        result, shared = await self._flight.do(key, func)
+        stats = self._stats.get(route)
+        if stats is None:
+            stats = self._stats[route] = [0, 0]
+        stats[0] += 1
+        stats[1] += shared
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self._flight.inflight(),
+            "routes": {
+                route: {
+                    "requests": requests,
+                    "collapsed": collapsed,
+                    "collapse_rate": round(collapsed / requests, 4) if requests else 0.0
+                }
+                for route, (requests, collapsed) in self._stats.items()
+            }
+        }
@@ -0,0 +1,119 @@
+from typing import Dict, Optional
+import httpx
+
+
+class _CountedStream(httpx.AsyncByteStream):
+    """响应体关闭时把请求从进行中计数里减去，只减一次"""
+    def __init__(self, stream: httpx.AsyncByteStream, transport: "_CountingTransport"):
+        self.stream = stream
+        self.transport = transport
+        self.closed = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            self.transport.active -= 1
+        await self.stream.aclose()
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """包装 httpx 的传输层，统计进行中的请求数（从发出请求到响应体读完或关闭）"""
+    def __init__(self, transport: httpx.AsyncHTTPTransport):
+        self.transport = transport
+        self.active = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.active += 1
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self.active -= 1
+            raise
+        response.stream = _CountedStream(response.stream, self)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    def connections(self) -> Optional[list]:
+        """底层 httpcore 连接池的连接列表；httpx 未公开该属性，取不到时返回 None"""
+        connections = getattr(getattr(self.transport, "_pool", None), "connections", None)
+        return list(connections) if connections is not None else None
+
+
+class UpstreamClientPool:
+    """
+    网关共享的上游HTTP连接池。
+    每个上游服务对应一个 httpx.AsyncClient，连接数限制按服务单独计算，
+    连接在请求之间保持复用（keep-alive），避免每次转发都重新建立TCP连接。
+    """
+    def __init__(self,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0,
+                 connect_timeout: float = 3.0,
+                 read_timeout: float = 5.0,
+                 http2: bool = False):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=connect_timeout)
+        self.http2 = http2
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, _CountingTransport] = {}
+        self._requests: Dict[str, int] = {}
+
+    def get_client(self, service_name: str) -> httpx.AsyncClient:
+        """获取指定上游服务的共享客户端，不存在时创建"""
+        client = self._clients.get(service_name)
+        if client is None or client.is_closed:
+            transport = _CountingTransport(httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2))
+            client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+            self._clients[service_name] = client
+            self._transports[service_name] = transport
+        self._requests[service_name] = self._requests.get(service_name, 0) + 1
+        return client
+
+    async def close(self):
+        """关闭所有上游连接（应用关闭时调用）"""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self._transports.clear()
+
+    def stats(self) -> dict:
+        """连接池使用情况统计"""
+        services = {}
+        for service_name in self._clients:
+            transport = self._transports.get(service_name)
+            if transport is None:
+                continue
+            # 进行中的请求数由网关自己统计；连接数只能从 httpcore 的连接池读取，取不到时为 None
+            active = transport.active
+            connections = transport.connections()
+            idle = sum(1 for conn in connections if conn.is_idle()) if connections is not None else None
+            services[service_name] = {
+                "connections": len(connections) if connections is not None else None,
+                "active": active,
+                "idle": idle,
+                # HTTP/1.1 每个连接同时只处理一个请求，超出已建立连接数的请求在等待连接；
+                # HTTP/2 一个连接上有多个流，无法据此推算，为 None
+                "queued": max(0, active - len(connections)) if connections is not None and not self.http2 else None,
+                "requests": self._requests.get(service_name, 0),
+                "utilization": round(min(active, self.limits.max_connections) / self.limits.max_connections, 4)
+            }
+        return {
+            "limits": {
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry,
+                "http2": self.http2
+            },
+            "services": services
+        }
@@ -0,0 +1,56 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class _Node:
+    __slots__ = ("children", "param", "required")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # {param} 占位分段共用一个子节点
+        self.param: Optional["_Node"] = None
+        self.required: Optional[List[str]] = None
+
+
+class PermissionMatcher:
+    """
+    路由权限匹配器。
+    每个服务的权限路径编译成一棵按 '/' 分段的前缀树，{param} 分段匹配任意值，
+    查找复杂度与路径长度成正比，不访问数据库。
+    权限表变更后调用 build 重新编译，新树构建完成后整体替换，查询方看到的总是完整的一份。
+    """
+    def __init__(self):
+        self._tries: Dict[str, _Node] = {}
+
+    def build(self, permissions: Iterable[Tuple[str, str, List[str]]]):
+        """根据 (service_name, path, required_permission) 列表重建所有服务的前缀树"""
+        tries: Dict[str, _Node] = {}
+        for service_name, path, required in permissions:
+            node = tries.setdefault(service_name, _Node())
+            for part in path.split('/'):
+                if part.startswith('{') and part.endswith('}'):
+                    if node.param is None:
+                        node.param = _Node()
+                    node = node.param
+                else:
+                    node = node.children.setdefault(part, _Node())
+            node.required = required
+        self._tries = tries
+
+    def match(self, service_name: str, path: str) -> Optional[List[str]]:
+        """返回路径所需的权限，未配置时返回 None；具体分段优先于 {param} 分段"""
+        root = self._tries.get(service_name)
+        if root is None:
+            return None
+        return self._match(root, path.split('/'), 0)
+
+    def _match(self, node: _Node, parts: List[str], i: int) -> Optional[List[str]]:
+        if i == len(parts):
+            return node.required
+        child = node.children.get(parts[i])
+        if child is not None:
+            required = self._match(child, parts, i + 1)
+            if required is not None:
+                return required
+        if node.param is not None:
+            return self._match(node.param, parts, i + 1)
+        return None
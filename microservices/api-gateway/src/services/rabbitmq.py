@@ -0,0 +1,118 @@
+import aio_pika
+from aio_pika import Message, ExchangeType, logger
+from typing import Dict, List, Optional, Callable, Tuple
+import asyncio
+
+from fastapi import FastAPI
+
+
+from config import get_settings
+
+settings = get_settings()
+OnMessageCallback = Callable[[aio_pika.IncomingMessage], None]
+
+class RabbitMQClient:
+    _consumers: Dict[Tuple[str, bool], List[Callable]] = {}
+    _publishers: Dict[Tuple[str, bool], "RabbitMQClient"] = {}
+    _publisher_lock: Optional[asyncio.Lock] = None
+    def __init__(self, queue, broadcast: bool = False):
+        """
+        broadcast 为 False 时使用默认交换机和同名持久队列，多个消费者竞争消费（每条消息只被一个消费者处理）；
+        为 True 时 queue 作为 fanout 交换机名，每个消费者实例声明自己的独占、自动删除队列并绑定到交换机，
+        所有实例都能收到每一条消息（用于公钥、权限快照、缓存失效等广播）。
+        """
+        self.connection = None
+        self.channel = None
+        self.exchange = None
+        self.queue = queue
+        self.broadcast = broadcast
+
+    async def connect(self):
+        self.connection = await aio_pika.connect_robust(
+            host=settings.rabbitmq_host,
+            port=settings.rabbitmq_port,
+            login=settings.rabbitmq_username,
+            password=settings.rabbitmq_password
+        )
+        self.channel = await self.connection.channel()
+        if self.broadcast:
+            self.exchange = await self.channel.declare_exchange(self.queue, ExchangeType.FANOUT, durable=True)
+        else:
+            self.exchange = self.channel.default_exchange
+            await self.channel.declare_queue(self.queue, durable=True)
+
+    async def publish(self, message: str, properties: Optional[dict] = None):
+        if not self.channel:
+            await self.connect()
+        await self.exchange.publish(
+            Message(body=message.encode(), **(properties or {})),
+            routing_key="" if self.broadcast else self.queue
+        )
+
+    async def consume(self, callback: OnMessageCallback):
+        if not self.channel:
+            await self.connect()
+        if self.broadcast:
+            queue = await self.channel.declare_queue(exclusive=True, auto_delete=True)
+            await queue.bind(self.exchange)
+        else:
+            queue = await self.channel.declare_queue(self.queue, durable=True)
+        await queue.consume(callback)
+
+    async def close(self):
+        if self.connection:
+            await self.connection.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+    @classmethod
+    async def publisher(cls, queue: str, broadcast: bool = False) -> "RabbitMQClient":
+        """获取长连接的发布者，同一队列（交换机）复用一个连接，connect_robust 断线后会自动重连"""
+        if cls._publisher_lock is None:
+            cls._publisher_lock = asyncio.Lock()
+        async with cls._publisher_lock:
+            client = cls._publishers.get((queue, broadcast))
+            if client is None:
+                client = RabbitMQClient(queue, broadcast)
+                await client.connect()
+                cls._publishers[(queue, broadcast)] = client
+        return client
+
+    @classmethod
+    async def close_publishers(cls):
+        for client in cls._publishers.values():
+            await client.close()
+        cls._publishers.clear()
+
+    @classmethod
+    def consumer(cls, queue: str, broadcast: bool = False):
+        def decorator(func: Callable):
+            cls._consumers.setdefault((queue, broadcast), []).append(func)
+            return func
+        return decorator
+    @classmethod
+    async def start_consumers(cls, app: FastAPI):
+        # 在 FastAPI 启动时初始化所有消费者
+        logger.info(cls._consumers.items())
+        for (queue, broadcast), callbacks in cls._consumers.items():
+           
+            client = RabbitMQClient(queue, broadcast)
+            await client.connect()
+            for callback in callbacks:
+                await client.consume(callback)
+            # 将连接保存在 app.state 中以便关闭
+            if not hasattr(app.state, "rabbitmq_clients"):
+                app.state.rabbitmq_clients = []
+            app.state.rabbitmq_clients.append(client)
+
+    @classmethod
+    async def close_consumers(cls, app: FastAPI):
+        # 在 FastAPI 关闭时关闭所有连接
+        for client in getattr(app.state, "rabbitmq_clients", []):
+            await client.close()
\ No newline at end of file
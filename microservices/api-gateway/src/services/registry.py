@@ -1,5 +1,8 @@
+import threading
+import time
 import consul
 from typing import Dict, List, Optional
+from fastapi.logger import logger
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -12,10 +15,29 @@ class ServiceInstance(BaseModel):
     last_health_check: datetime = None
     is_healthy: bool = False
     heartbeat_interval: int = 30  # 服务主动上报间隔
-    
+
 class ConsulRegistry:
-    def __init__(self, host: str = 'consul', port: int = 8500):
+    """
+    Consul 服务注册与发现。
+    健康实例列表保存在内存缓存中，由后台线程通过 Consul 阻塞查询（index watch）刷新，
+    请求路径上的查询只读缓存，不访问 Consul；Consul 不可用时继续使用最后一次的结果。
+    """
+    def __init__(self, host: str = 'consul', port: int = 8500, watch_wait: str = "30s", retry_interval: float = 5):
         self.client = consul.Consul(host=host, port=port)
+        self.watch_wait = watch_wait
+        self.retry_interval = retry_interval
+        self._instances: Dict[str, List[ServiceInstance]] = {}
+        # 服务名 -> 实例ID -> 实例，用于按 X-Service-ID 直接定位实例
+        self._by_id: Dict[str, Dict[str, ServiceInstance]] = {}
+        self._indexes: Dict[str, str] = {}
+        self._updated_at: Dict[str, datetime] = {}
+        self._errors: Dict[str, str] = {}
+        self._watchers: Dict[str, threading.Thread] = {}
+        self._services: set = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        # 缓存内容每次变化时递增，多 worker 模式下据此判断是否需要发布快照
+        self.version = 0
 
     def register(self, instance: ServiceInstance):
         service_id = f"{instance.service_name}-{instance.instance_id}"
@@ -34,8 +56,86 @@ class ConsulRegistry:
         service_id = f"{service_name}-{instance_id}"
         self.client.agent.service.deregister(service_id)
 
+    def start(self):
+        """同步一次服务目录并启动后台 watch 线程（应用启动时调用）"""
+        self._stopped.clear()
+        try:
+            index, services = self.client.catalog.services()
+            self._sync_services(services)
+        except Exception as e:
+            index = None
+            logger.warning(f"Initial consul catalog sync failed: {e}")
+        threading.Thread(target=self._watch_catalog, args=(index,), name="consul-catalog-watch", daemon=True).start()
+
+    def stop(self):
+        """停止所有 watch 线程（正在进行的阻塞查询返回后退出）"""
+        self._stopped.set()
+
     def get_healthy_instances(self, service_name: str) -> List[ServiceInstance]:
-        _, services = self.client.health.service(service_name)
+        """从缓存读取健康实例，O(1) 且不阻塞事件循环"""
+        return self._instances.get(service_name, [])
+
+    def get_instance(self, service_name: str, instance_id: str) -> Optional[ServiceInstance]:
+        """按实例ID获取健康实例，O(1)"""
+        return self._by_id.get(service_name, {}).get(instance_id)
+
+    def stats(self) -> dict:
+        """服务发现缓存状态"""
+        return {
+            service_name: {
+                "instances": len(self._instances.get(service_name, [])),
+                "index": self._indexes.get(service_name),
+                "updated_at": self._updated_at.get(service_name),
+                "stale": service_name in self._errors,
+                "error": self._errors.get(service_name)
+            }
+            for service_name in sorted(self._services)
+        }
+
+    def snapshot(self) -> dict:
+        """导出健康实例缓存，供多 worker 模式下的其他 worker 加载"""
+        return {
+            service_name: [instance.model_dump(mode="json", exclude_none=True) for instance in instances]
+            for service_name, instances in self._instances.items()
+        }
+
+    def load_snapshot(self, snapshot: Dict[str, list]):
+        """加载 leader worker 发布的快照（非 leader worker 不访问 Consul）"""
+        for service_name, items in snapshot.items():
+            instances = [ServiceInstance(**item) for item in items]
+            self._instances[service_name] = instances
+            self._by_id[service_name] = {instance.instance_id: instance for instance in instances}
+            self._updated_at[service_name] = datetime.now()
+        for service_name in set(self._instances) - set(snapshot):
+            self._instances.pop(service_name, None)
+            self._by_id.pop(service_name, None)
+        self._services = set(snapshot)
+
+    def _sync_services(self, services: Dict[str, list]):
+        """为服务目录中的新服务启动 watch 线程"""
+        with self._lock:
+            self._services = set(services.keys())
+            for service_name in self._services:
+                watcher = self._watchers.get(service_name)
+                if watcher is not None and watcher.is_alive():
+                    continue
+                # 先同步拉取一次，保证启动后缓存立即可用
+                index = self._refresh_service(service_name)
+                watcher = threading.Thread(
+                    target=self._watch_service, args=(service_name, index),
+                    name=f"consul-watch-{service_name}", daemon=True
+                )
+                self._watchers[service_name] = watcher
+                watcher.start()
+
+    def _refresh_service(self, service_name: str, index: Optional[str] = None) -> Optional[str]:
+        try:
+            index, services = self.client.health.service(service_name, index=index, wait=self.watch_wait)
+        except Exception as e:
+            # Consul 不可用时保留旧数据
+            self._errors[service_name] = str(e)
+            logger.warning(f"Consul watch for {service_name} failed, serving stale instances: {e}")
+            return None
         serviceInstances=[
             ServiceInstance(
                 service_name=service['Service']['Service'],
@@ -46,4 +146,36 @@ class ConsulRegistry:
             )
             for service in services
         ]
-        return [instance for instance in serviceInstances if instance.is_healthy]
+        # 整体替换列表，读取方无需加锁
+        healthy = [instance for instance in serviceInstances if instance.is_healthy]
+        # 阻塞查询超时返回时索引和实例都不变，不递增版本，避免多 worker 模式下重复发布快照
+        if index != self._indexes.get(service_name) or healthy != self._instances.get(service_name):
+            self._instances[service_name] = healthy
+            self._by_id[service_name] = {instance.instance_id: instance for instance in healthy}
+            self.version += 1
+        self._indexes[service_name] = index
+        self._updated_at[service_name] = datetime.now()
+        self._errors.pop(service_name, None)
+        return index
+
+    def _watch_service(self, service_name: str, index: Optional[str]):
+        while not self._stopped.is_set() and service_name in self._services:
+            new_index = self._refresh_service(service_name, index)
+            if new_index is None:
+                time.sleep(self.retry_interval)
+            index = new_index
+        # 服务已从目录中移除
+        if service_name not in self._services:
+            self._instances.pop(service_name, None)
+            self._by_id.pop(service_name, None)
+            self.version += 1
+
+    def _watch_catalog(self, index: Optional[str]):
+        while not self._stopped.is_set():
+            try:
+                index, services = self.client.catalog.services(index=index, wait=self.watch_wait)
+                self._sync_services(services)
+            except Exception as e:
+                logger.warning(f"Consul catalog watch failed: {e}")
+                index = None
+                time.sleep(self.retry_interval)
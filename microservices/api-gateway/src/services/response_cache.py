@@ -0,0 +1,151 @@
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+from services.permission_matcher import PermissionMatcher
+
+_MAX_AGE = re.compile(r"(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*(\d+)")
+
+
+class CachedResponse:
+    __slots__ = ("status_code", "headers", "body", "etag", "expires_at", "stored_at", "size")
+
+    def __init__(self, status_code: int, headers: List[Tuple[str, str]], body: bytes,
+                 etag: Optional[str], expires_at: float):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+        self.stored_at = time.time()
+        self.size = len(body) + sum(len(key) + len(value) for key, value in headers)
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at > time.time()
+
+
+class ResponseCache:
+    """
+    网关 GET 响应缓存。
+    只缓存配置中列出的路由，按 (服务, 路径, 查询串, 角色集合, Accept-Encoding) 存储；
+    遵循上游的 Cache-Control（no-store/private 不缓存，max-age 决定有效期），过期后带 If-None-Match 向上游重新验证。
+    按内存预算做 LRU 淘汰；上游数据变化时按路径前缀失效。
+    """
+    def __init__(self, routes: Iterable[str], max_bytes: int = 64 * 1024 * 1024,
+                 max_entry_bytes: int = 1024 * 1024, default_ttl: float = 30):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.default_ttl = default_ttl
+        self.matcher = PermissionMatcher()
+        self.matcher.build(self._parse_route(route) for route in routes)
+        self._entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.invalidations = 0
+        # 最近的失效记录 (序号, 服务名, 路径前缀)，多 worker 模式下由 leader 发布给其他 worker
+        self.invalidation_log: "deque[Tuple[int, str, List[str]]]" = deque(maxlen=256)
+        self._applied_seq = 0
+
+    @staticmethod
+    def _parse_route(route: str) -> Tuple[str, str, List[str]]:
+        service_name, _, path = route.partition(':')
+        return service_name, path, ["cache"]
+
+    def cacheable(self, service_name: str, path: str) -> bool:
+        return self.matcher.match(service_name, path) is not None
+
+    @staticmethod
+    def make_key(service_name: str, path: str, query: str, roles: str, accept_encoding: str) -> tuple:
+        return (
+            service_name,
+            path,
+            '&'.join(sorted(query.split('&'))) if query else '',
+            ','.join(sorted(filter(None, roles.split(',')))),
+            accept_encoding
+        )
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def ttl_for(self, cache_control: str) -> Optional[float]:
+        """根据上游 Cache-Control 计算有效期，返回 None 表示不可缓存"""
+        cache_control = cache_control.lower()
+        if "no-store" in cache_control or "private" in cache_control:
+            return None
+        if "no-cache" in cache_control:
+            # 可以存储，但每次都要向上游验证
+            return 0
+        match = _MAX_AGE.search(cache_control)
+        if match:
+            return float(match.group(1))
+        return self.default_ttl
+
+    def set(self, key: tuple, status_code: int, headers: List[Tuple[str, str]], body: bytes, ttl: float):
+        if len(body) > self.max_entry_bytes:
+            return
+        etag = next((value for name, value in headers if name.lower() == "etag"), None)
+        if ttl <= 0 and not etag:
+            return
+        self.pop(key)
+        entry = CachedResponse(status_code, headers, body, etag, time.time() + ttl)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def refresh(self, key: tuple, ttl: float):
+        """上游返回 304 后延长有效期"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires_at = time.time() + ttl
+            entry.stored_at = time.time()
+            self.revalidated += 1
+
+    def pop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate(self, service_name: str, prefixes: Optional[Iterable[str]] = None, record: bool = False):
+        """
+        失效某个服务下指定路径前缀的缓存；未指定前缀时失效该服务的全部缓存。
+        record 为 True 时写入失效记录，供其他 worker 同步。
+        """
+        prefixes = tuple(prefixes or ())
+        if record:
+            self.invalidation_log.append((time.time_ns(), service_name, list(prefixes)))
+        for key in [
+            key for key in self._entries
+            if key[0] == service_name and (not prefixes or key[1].startswith(prefixes))
+        ]:
+            self.pop(key)
+        self.invalidations += 1
+
+    def apply_invalidations(self, log: List):
+        """应用其他 worker 发布的失效记录，已处理过的序号跳过"""
+        for seq, service_name, prefixes in log:
+            if seq > self._applied_seq:
+                self.invalidate(service_name, prefixes)
+                self._applied_seq = seq
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
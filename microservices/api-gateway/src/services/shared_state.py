@@ -0,0 +1,141 @@
+import fcntl
+import json
+import mmap
+import os
+import tempfile
+import zlib
+from typing import Optional
+
+
+class SharedCounters:
+    """
+    跨 worker 共享的计数器（mmap 文件）。
+    每个 worker 独占一行，只写自己的行，读取时把所有行相加，因此不需要跨进程加锁。
+    计数器按实例ID哈希到固定数量的槽位。
+    """
+    def __init__(self, path: str, rows: int, slots: int = 1024):
+        self.rows = rows
+        self.slots = slots
+        size = rows * slots * 8
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._view = memoryview(self._mmap).cast('q')
+        self.row: Optional[int] = None
+
+    def attach(self, row: int):
+        """占用一行，并清掉上一个使用该行的（已退出的）worker 留下的计数"""
+        self.row = row
+        base = row * self.slots
+        for index in range(base, base + self.slots):
+            self._view[index] = 0
+
+    def _slot(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % self.slots
+
+    def add(self, key: str, delta: int):
+        if self.row is not None:
+            self._view[self.row * self.slots + self._slot(key)] += delta
+
+    def total(self, key: str) -> int:
+        slot = self._slot(key)
+        return sum(self._view[row * self.slots + slot] for row in range(self.rows))
+
+
+class SharedState:
+    """
+    多 worker 模式下的进程间共享状态。
+    - 通过文件锁选出一个 leader worker，由它负责 Consul watch、权限同步和消息消费，
+      并把服务发现、公钥、权限表等快照原子地写入共享目录（默认 /dev/shm），其余 worker 定期读取；
+      leader 退出后文件锁自动释放，其他 worker 接管。
+    - 每个 worker 占用一个编号（同样用文件锁），用于共享计数器的行号。
+    """
+    def __init__(self, directory: str = "", max_workers: int = 32):
+        if not directory:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            directory = os.path.join(directory, "trends-gateway")
+        self.directory = directory
+        self.max_workers = max_workers
+        self.worker_id: Optional[int] = None
+        self.is_leader = False
+        self.counters: Optional[SharedCounters] = None
+        self._worker_fd: Optional[int] = None
+        self._leader_fd: Optional[int] = None
+        self._mtimes = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _try_lock(path: str) -> Optional[int]:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def start(self):
+        """在 worker 进程启动时调用：占用 worker 编号并尝试成为 leader"""
+        os.makedirs(self.directory, exist_ok=True)
+        for worker_id in range(self.max_workers):
+            fd = self._try_lock(self._path(f"worker-{worker_id}.lock"))
+            if fd is not None:
+                self.worker_id, self._worker_fd = worker_id, fd
+                break
+        else:
+            raise RuntimeError(f"More than {self.max_workers} gateway workers are running")
+        self.counters = SharedCounters(self._path("counters.bin"), self.max_workers)
+        self.counters.attach(self.worker_id)
+        self.try_lead()
+
+    def try_lead(self) -> bool:
+        """尝试成为 leader，成功返回 True（已经是 leader 时也返回 True）"""
+        if not self.is_leader:
+            fd = self._try_lock(self._path("leader.lock"))
+            if fd is not None:
+                self._leader_fd = fd
+                self.is_leader = True
+        return self.is_leader
+
+    def stop(self):
+        for fd in (self._leader_fd, self._worker_fd):
+            if fd is not None:
+                os.close(fd)
+        self._leader_fd = self._worker_fd = None
+        self.is_leader = False
+
+    def publish(self, name: str, data: dict):
+        """原子地写入快照（先写临时文件再 rename），读取方不会看到写了一半的文件"""
+        path = self._path(f"{name}.json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def read_if_changed(self, name: str) -> Optional[dict]:
+        """快照文件有更新时返回其内容，否则返回 None"""
+        path = self._path(f"{name}.json")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self._mtimes.get(name) == mtime:
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        self._mtimes[name] = mtime
+        return data
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "worker_id": self.worker_id,
+            "pid": os.getpid(),
+            "leader": self.is_leader
+        }
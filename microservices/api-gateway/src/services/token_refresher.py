@@ -0,0 +1,65 @@
+import hashlib
+import time
+from typing import Optional
+import httpx
+from jose import JWTError, jwt
+from utils.cache import TTLCache
+from utils.singleflight import SingleFlight
+
+
+class TokenRefresher:
+    """
+    网关本地判断 token 是否需要刷新。
+    只读取 exp 声明（签名由鉴权阶段校验），剩余有效期在刷新窗口内才调用 user_management 的 /refresh-token；
+    同一 token 的并发刷新只发起一次请求，换到的新 token 短暂缓存供并行请求复用。
+    """
+    def __init__(self, registry, upstream, refresh_window: float = 300, cache_ttl: float = 60, cache_size: int = 4096):
+        self.registry = registry
+        self.upstream = upstream
+        self.refresh_window = refresh_window
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._flight = SingleFlight()
+
+    def needs_refresh(self, token: str) -> bool:
+        try:
+            exp = jwt.get_unverified_claims(token).get("exp")
+        except JWTError:
+            # 无法解析的 token 交给鉴权阶段拒绝
+            return False
+        return exp is not None and exp - time.time() < self.refresh_window
+
+    async def refresh(self, auth_header: str) -> Optional[str]:
+        """返回新 token；不需要刷新或刷新失败时返回 None"""
+        token = auth_header.split("Bearer ")[-1]
+        if not self.needs_refresh(token):
+            return None
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        new_token = self.cache.get(digest)
+        if new_token is not None:
+            return new_token
+        new_token, _ = await self._flight.do(digest, lambda: self._request_refresh(auth_header))
+        if new_token:
+            self.cache.set(digest, new_token)
+        return new_token
+
+    async def _request_refresh(self, auth_header: str) -> Optional[str]:
+        instances = self.registry.get_healthy_instances("user_management")
+        if not instances:
+            return None
+        target = instances[0]
+        try:
+            response = await self.upstream.get_client("user_management").post(
+                f"http://{target.host}:{target.port}/refresh-token",
+                headers={"Authorization": auth_header}
+            )
+        except httpx.RequestError:
+            return None
+        if response.status_code != 200:
+            return None
+        refresh_data = response.json()
+        if refresh_data.get("refreshed"):
+            return refresh_data.get("new_token")
+        return None
+
+    def stats(self) -> dict:
+        return {"cache": self.cache.stats(), "inflight": self._flight.inflight()}
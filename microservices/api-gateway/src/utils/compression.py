@@ -0,0 +1,167 @@
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+from starlette.types import Message, Send
+
+# brotli、zstandard 为可选依赖，未安装时只协商 gzip
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/javascript", "application/xml", "image/svg+xml", "text/"
+)
+
+
+def _gzip(level: int):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush()
+
+
+def _brotli(level: int):
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+
+
+def _zstd(level: int):
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, compressor.flush
+
+
+class CompressionBudget:
+    """压缩的 CPU 时间预算：每秒最多花费 budget 秒用于压缩，超出后新的响应不再压缩"""
+    def __init__(self, budget: float):
+        self.budget = budget
+        self._window = 0
+        self._spent = 0.0
+        self.skipped = 0
+
+    def _roll(self):
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._spent = 0.0
+
+    def allow(self) -> bool:
+        self._roll()
+        if self._spent < self.budget:
+            return True
+        self.skipped += 1
+        return False
+
+    def spend(self, seconds: float):
+        self._roll()
+        self._spent += seconds
+
+
+class ResponseCompressor:
+    """
+    网关响应压缩。
+    按客户端的 Accept-Encoding 协商 zstd / br / gzip；上游已压缩（带 content-encoding）的响应原样透传，
+    小于 min_size 的响应、不可压缩的类型以及 SSE 流不压缩，CPU 预算用完时暂停压缩。
+    """
+    def __init__(self, min_size: int = 1024, cpu_budget: float = 0.25,
+                 gzip_level: int = 5, brotli_level: int = 4, zstd_level: int = 3):
+        self.min_size = min_size
+        self.budget = CompressionBudget(cpu_budget)
+        self._factories: Dict[str, Callable] = {"gzip": lambda: _gzip(gzip_level)}
+        if brotli is not None:
+            self._factories["br"] = lambda: _brotli(brotli_level)
+        if zstandard is not None:
+            self._factories["zstd"] = lambda: _zstd(zstd_level)
+        self.stats_by_encoding: Dict[str, List[int]] = {}  # 编码 -> [响应数, 原始字节, 压缩后字节]
+        self.passthrough = 0
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        """选择客户端接受且 q 值最高的编码，q 值相同时按 zstd > br > gzip"""
+        preference = ["zstd", "br", "gzip"]
+        best: Optional[Tuple[float, int, str]] = None
+        for item in accept_encoding.lower().split(','):
+            name, _, params = item.strip().partition(';')
+            name = name.strip()
+            if name not in self._factories:
+                continue
+            q = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0.0
+            if q <= 0:
+                continue
+            candidate = (q, -preference.index(name), name)
+            if best is None or candidate > best:
+                best = candidate
+        return best[2] if best else None
+
+    def _should_compress(self, message: Message) -> bool:
+        if message["status"] in (204, 304) or message["status"] < 200:
+            return False
+        headers = {key.lower(): value for key, value in message.get("headers", [])}
+        if b"content-encoding" in headers:
+            self.passthrough += 1
+            return False
+        content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+        if content_type.startswith("text/event-stream") or not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        length = headers.get(b"content-length")
+        if length is not None and int(length) < self.min_size:
+            return False
+        return self.budget.allow()
+
+    def wrap(self, accept_encoding: str, send: Send) -> Send:
+        """包装 ASGI send，按需压缩响应体"""
+        encoding = self.negotiate(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            return send
+        state = {"compress": None, "flush": None}
+
+        async def compressed_send(message: Message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if self._should_compress(message):
+                    state["compress"], state["flush"] = self._factories[encoding]()
+                    stats = self.stats_by_encoding.setdefault(encoding, [0, 0, 0])
+                    stats[0] += 1
+                    state["stats"] = stats
+                    headers = [(key, value) for key, value in headers if key.lower() != b"content-length"]
+                    headers.append((b"content-encoding", encoding.encode()))
+                if not any(key.lower() == b"vary" and b"accept-encoding" in value.lower() for key, value in headers):
+                    headers.append((b"vary", b"Accept-Encoding"))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body" and state["compress"] is not None:
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                start = time.perf_counter()
+                data = state["compress"](body) if body else b""
+                if not more_body:
+                    data += state["flush"]()
+                self.budget.spend(time.perf_counter() - start)
+                state["stats"][1] += len(body)
+                state["stats"][2] += len(data)
+                message = {**message, "body": data}
+            await send(message)
+
+        return compressed_send
+
+    def stats(self) -> dict:
+        return {
+            "encodings": list(self._factories),
+            "passthrough": self.passthrough,
+            "skipped_by_budget": self.budget.skipped,
+            "compressed": {
+                encoding: {
+                    "responses": responses,
+                    "bytes_in": bytes_in,
+                    "bytes_out": bytes_out,
+                    "ratio": round(bytes_out / bytes_in, 4) if bytes_in else None
+                }
+                for encoding, (responses, bytes_in, bytes_out) in self.stats_by_encoding.items()
+            }
+        }
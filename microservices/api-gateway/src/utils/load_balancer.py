@@ -1,14 +1,121 @@
-from typing import List, Dict, Optional
+import bisect
+import hashlib
+import math
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class InstanceStats:
+    """单个实例的负载统计"""
+    __slots__ = ("outstanding", "ewma", "last_update", "requests", "failures")
 
-class RoundRobinBalancer:
     def __init__(self):
-        self.index = 0
+        self.outstanding = 0
+        self.ewma = 0.0  # 峰值EWMA延迟（秒）
+        self.last_update = 0.0
+        self.requests = 0
+        self.failures = 0
+
+
+class OutlierEjector:
+    """
+    被动异常实例摘除。
+    连续失败达到阈值的实例被摘除一段时间；到期后进入探测状态，每次只放行一个探测请求，
+    连续探测成功达到次数后恢复，探测失败则以翻倍的时间再次摘除。
+    """
+    def __init__(self, consecutive_failures: int = 5, base_ejection_time: float = 30,
+                 max_ejection_time: float = 300, probe_successes: int = 3):
+        self.consecutive_failures = consecutive_failures
+        self.base_ejection_time = base_ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.probe_successes = probe_successes
+        self._failures: Dict[str, int] = {}
+        self._ejected_until: Dict[str, float] = {}
+        self._ejections: Dict[str, int] = {}
+        self._probing: Dict[str, int] = {}  # 探测中的实例 -> 已成功次数
+        self._probe_inflight: set = set()
+
+    def filter(self, instances: List) -> List:
+        """过滤掉被摘除的实例；全部被摘除时返回原列表，避免服务完全不可用"""
+        now = time.monotonic()
+        available = []
+        for instance in instances:
+            instance_id = instance.instance_id
+            ejected_until = self._ejected_until.get(instance_id)
+            if ejected_until is not None:
+                if now < ejected_until:
+                    continue
+                # 摘除到期，进入探测状态
+                del self._ejected_until[instance_id]
+                self._probing[instance_id] = 0
+            if instance_id in self._probing and instance_id in self._probe_inflight:
+                continue
+            available.append(instance)
+        return available or instances
+
+    def on_request_start(self, instance):
+        if instance.instance_id in self._probing:
+            self._probe_inflight.add(instance.instance_id)
+
+    def on_request_end(self, instance, success: bool):
+        instance_id = instance.instance_id
+        self._probe_inflight.discard(instance_id)
+        if instance_id in self._probing:
+            if success:
+                self._probing[instance_id] += 1
+                if self._probing[instance_id] >= self.probe_successes:
+                    del self._probing[instance_id]
+                    self._ejections.pop(instance_id, None)
+                    self._failures.pop(instance_id, None)
+            else:
+                del self._probing[instance_id]
+                self._eject(instance_id)
+            return
+        if success:
+            self._failures.pop(instance_id, None)
+            return
+        self._failures[instance_id] = self._failures.get(instance_id, 0) + 1
+        if self._failures[instance_id] >= self.consecutive_failures:
+            self._eject(instance_id)
+
+    def _eject(self, instance_id: str):
+        ejections = self._ejections.get(instance_id, 0)
+        duration = min(self.base_ejection_time * (2 ** ejections), self.max_ejection_time)
+        self._ejected_until[instance_id] = time.monotonic() + duration
+        self._ejections[instance_id] = ejections + 1
+        self._failures.pop(instance_id, None)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "ejected": {
+                instance_id: round(until - now, 1) for instance_id, until in self._ejected_until.items() if until > now
+            },
+            "probing": dict(self._probing),
+            "consecutive_failures": dict(self._failures)
+        }
+
+
+class LoadBalancer:
+    """
+    负载均衡基类。
+    select_instance 选择实例，转发前后分别调用 on_request_start / on_request_end 上报负载和结果。
+    """
+    def __init__(self, ejector: Optional[OutlierEjector] = None):
+        self.ejector = ejector
+        self.stats: Dict[str, InstanceStats] = {}
+        # 多 worker 模式下的共享计数器，未完成请求数按所有 worker 合计
+        self.shared = None
 
-    def select_instance(self, instances: List[Dict], service_id: Optional[str] = None):
+    def attach_shared(self, counters, worker_id: int = 0):
+        self.shared = counters
+
+    def select_instance(self, instances: List, service_id: Optional[str] = None, hash_key: Optional[str] = None):
         """
         选择服务实例。
         如果指定了 service_id，则优先选择匹配的服务实例。
-        如果未指定 service_id，则使用轮询算法选择实例。
+        如果未指定 service_id，则由具体策略选择实例；hash_key 仅一致性哈希策略使用。
         """
         if not instances:
             return None
@@ -20,7 +127,204 @@ class RoundRobinBalancer:
                     return instance
             return None  # 如果未找到匹配的服务号，返回 None
 
-        # 如果未指定服务号，使用轮询算法选择实例
-        instance = instances[self.index % len(instances)]
-        self.index += 1
-        return instance
\ No newline at end of file
+        if self.ejector:
+            instances = self.ejector.filter(instances)
+        return self._select(instances)
+
+    def _select(self, instances: List):
+        raise NotImplementedError
+
+    def _stats(self, instance) -> InstanceStats:
+        stats = self.stats.get(instance.instance_id)
+        if stats is None:
+            stats = self.stats[instance.instance_id] = InstanceStats()
+        return stats
+
+    def _outstanding(self, instance) -> int:
+        if self.shared is not None:
+            return self.shared.total(instance.instance_id)
+        return self._stats(instance).outstanding
+
+    def on_request_start(self, instance):
+        stats = self._stats(instance)
+        stats.outstanding += 1
+        stats.requests += 1
+        if self.shared is not None:
+            self.shared.add(instance.instance_id, 1)
+        if self.ejector:
+            self.ejector.on_request_start(instance)
+
+    def on_request_end(self, instance, latency: float, success: bool):
+        stats = self._stats(instance)
+        stats.outstanding = max(0, stats.outstanding - 1)
+        if self.shared is not None:
+            self.shared.add(instance.instance_id, -1)
+        if not success:
+            stats.failures += 1
+        self._observe(stats, latency, success)
+        if self.ejector:
+            self.ejector.on_request_end(instance, success)
+
+    def _observe(self, stats: InstanceStats, latency: float, success: bool):
+        pass
+
+    def describe(self) -> dict:
+        return {
+            "strategy": type(self).__name__,
+            "instances": {
+                instance_id: {
+                    "outstanding": stats.outstanding,
+                    "outstanding_all_workers": self.shared.total(instance_id) if self.shared is not None else None,
+                    "ewma_ms": round(stats.ewma * 1000, 2),
+                    "requests": stats.requests,
+                    "failures": stats.failures
+                }
+                for instance_id, stats in self.stats.items()
+            },
+            "outliers": self.ejector.stats() if self.ejector else None
+        }
+
+
+class RoundRobinBalancer(LoadBalancer):
+    """按服务分别轮询"""
+    def __init__(self, ejector: Optional[OutlierEjector] = None):
+        super().__init__(ejector)
+        self.index: Dict[str, int] = {}
+        self.offset = 0
+
+    def attach_shared(self, counters, worker_id: int = 0):
+        super().attach_shared(counters, worker_id)
+        # 各 worker 从不同的位置开始轮询，避免同时打到同一个实例
+        self.offset = worker_id
+
+    def _select(self, instances: List):
+        service_name = instances[0].service_name
+        index = self.index.get(service_name, self.offset)
+        instance = instances[index % len(instances)]
+        self.index[service_name] = index + 1
+        return instance
+
+
+class LeastRequestBalancer(LoadBalancer):
+    """选择未完成请求数最少的实例，数量相同时随机选择"""
+    def _select(self, instances: List):
+        outstanding = [self._outstanding(instance) for instance in instances]
+        least = min(outstanding)
+        return random.choice([instance for instance, count in zip(instances, outstanding) if count == least])
+
+
+class PeakEwmaBalancer(LoadBalancer):
+    """
+    峰值EWMA：延迟升高时立即采用新值，下降时按时间衰减平滑，
+    以 延迟 × (未完成请求数 + 1) 作为代价，采用 power-of-two-choices 选择代价较低的实例。
+    失败请求按 failure_penalty 计入延迟，避免快速失败的实例因延迟低而被优先选中。
+    """
+    def __init__(self, ejector: Optional[OutlierEjector] = None, decay_time: float = 10, failure_penalty: float = 1.0):
+        super().__init__(ejector)
+        self.decay_time = decay_time
+        self.failure_penalty = failure_penalty
+
+    def _cost(self, instance) -> float:
+        return self._stats(instance).ewma * (self._outstanding(instance) + 1)
+
+    def _select(self, instances: List):
+        if len(instances) == 1:
+            return instances[0]
+        a, b = random.sample(instances, 2)
+        return a if self._cost(a) <= self._cost(b) else b
+
+    def _observe(self, stats: InstanceStats, latency: float, success: bool):
+        now = time.monotonic()
+        if not success:
+            latency = max(latency, self.failure_penalty)
+        if latency > stats.ewma:
+            stats.ewma = latency
+        else:
+            weight = math.exp(-(now - stats.last_update) / self.decay_time)
+            stats.ewma = stats.ewma * weight + latency * (1 - weight)
+        stats.last_update = now
+
+
+class ConsistentHashBalancer(LoadBalancer):
+    """
+    带负载上限的一致性哈希（consistent hashing with bounded loads）。
+    同一 hash_key 的请求固定落在哈希环上的同一实例，使查询服务的进程内缓存（如 MODEL_STORE）保持命中；
+    实例未完成请求数超过 平均负载 × load_factor 时顺延到环上的下一个实例。
+    没有 hash_key 的请求交给 fallback 策略，两者共用负载统计和异常摘除状态。
+    """
+    def __init__(self, fallback: LoadBalancer, replicas: int = 160, load_factor: float = 1.25):
+        super().__init__(fallback.ejector)
+        self.fallback = fallback
+        self.stats = fallback.stats
+        self.replicas = replicas
+        self.load_factor = load_factor
+        # 服务名 -> (实例ID列表, 环上的哈希点, 哈希点对应的实例下标)
+        self._rings: Dict[str, Tuple[Tuple[str, ...], List[int], List[int]]] = {}
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def _ring(self, instances: List) -> Tuple[List[int], List[int]]:
+        """实例集合不变时复用已构建的哈希环"""
+        service_name = instances[0].service_name
+        ids = tuple(instance.instance_id for instance in instances)
+        ring = self._rings.get(service_name)
+        if ring is None or ring[0] != ids:
+            points = sorted(
+                (self._hash(f"{instance_id}#{replica}"), index)
+                for index, instance_id in enumerate(ids)
+                for replica in range(self.replicas)
+            )
+            ring = (ids, [point for point, _ in points], [index for _, index in points])
+            self._rings[service_name] = ring
+        return ring[1], ring[2]
+
+    def select_instance(self, instances: List, service_id: Optional[str] = None, hash_key: Optional[str] = None):
+        if not instances:
+            return None
+        if service_id or not hash_key:
+            return self.fallback.select_instance(instances, service_id)
+        if self.ejector:
+            instances = self.ejector.filter(instances)
+        if len(instances) == 1:
+            return instances[0]
+        hashes, owners = self._ring(instances)
+        outstanding = {instance.instance_id: self._outstanding(instance) for instance in instances}
+        total = sum(outstanding.values())
+        capacity = math.ceil((total + 1) * self.load_factor / len(instances))
+        start = bisect.bisect(hashes, self._hash(hash_key)) % len(hashes)
+        # 负载上限保证环上至少有一个实例未满
+        for offset in range(len(hashes)):
+            instance = instances[owners[(start + offset) % len(hashes)]]
+            if outstanding[instance.instance_id] < capacity:
+                return instance
+        return instances[owners[start]]
+
+    def attach_shared(self, counters, worker_id: int = 0):
+        super().attach_shared(counters, worker_id)
+        self.fallback.attach_shared(counters, worker_id)
+
+    def _observe(self, stats: InstanceStats, latency: float, success: bool):
+        self.fallback._observe(stats, latency, success)
+
+    def describe(self) -> dict:
+        result = self.fallback.describe()
+        result["strategy"] = f"{type(self).__name__}({result['strategy']})"
+        result["hash_rings"] = {service_name: len(ring[0]) for service_name, ring in self._rings.items()}
+        return result
+
+
+BALANCER_STRATEGIES = {
+    "round_robin": RoundRobinBalancer,
+    "least_request": LeastRequestBalancer,
+    "peak_ewma": PeakEwmaBalancer,
+}
+
+def create_balancer(strategy: str, ejector: Optional[OutlierEjector] = None, ewma_decay_time: float = 10) -> LoadBalancer:
+    """根据配置创建负载均衡器"""
+    if strategy not in BALANCER_STRATEGIES:
+        raise ValueError(f"Unknown load balancer strategy: {strategy}")
+    if strategy == "peak_ewma":
+        return PeakEwmaBalancer(ejector, decay_time=ewma_decay_time)
+    return BALANCER_STRATEGIES[strategy](ejector)
@@ -1,18 +1,16 @@
 # app/utils/middleware.py
-from typing import Dict, List
-from fastapi import Request
-from fastapi.responses import JSONResponse
-import httpx
+import time
+from typing import Dict, List, Optional
 from pydantic import BaseModel
-from starlette.middleware.base import BaseHTTPMiddleware
-from config import get_settings
-# 需要过滤的headers列表
-SENSITIVE_HEADERS = {
-    'host', 'content-length', 
-    'connection', 'keep-alive'
-}
+from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.websockets import WebSocket
+from utils.stages import (
+    AdmissionStage, AuthnStage, AuthzStage, CacheStage, CoalesceStage, ForwardStage, GatewayContext, RouteResolveStage,
+    Stage, StageStats
+)
+
 
-setting=get_settings()
 class RoutePermission(BaseModel):
     # 路径名称或标识
     path: str
@@ -24,173 +22,94 @@ class ServicePermissions(BaseModel):
     service_name: str
     permissions: Dict[str, RoutePermission]
 
-class GatewayMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, registry, balancer):
-        super().__init__(app)
-        self.registry = registry
-        self.balancer = balancer
-    def get_service_url_from_registry(self, service_name: str):
-        """
-        从服务注册表中获取服务实例并返回服务的 URL。
-        如果没有可用实例，返回 503 错误的 JSONResponse。
-        """
-        instances = self.registry.get_healthy_instances(service_name)
-        if not instances:
-            return None  # 返回 None 表示没有可用实例
+class GatewayMiddleware:
+    """
+    网关转发中间件（纯 ASGI 实现）。
+    请求依次经过 路由解析 -> token刷新 -> 权限校验 -> 响应缓存、请求合并、准入控制（可选） -> 转发，任一阶段返回响应即结束；
+    每个阶段的耗时计入 stage_stats，并可通过 Server-Timing 响应头返回给客户端；
+    上游未压缩的响应在发送时按客户端支持的编码压缩。
+    WebSocket 连接在握手时执行一次 路由解析 -> token刷新 -> 权限校验，通过后交给 websocket_proxy 双向转发。
+    """
+    def __init__(self, app: ASGIApp, registry, balancer, upstream, token_refresher, authorizer=None,
+                 route_keys=None, response_cache=None, coalescer=None, admission=None, compressor=None,
+                 stage_stats: Optional[StageStats] = None, server_timing: bool = False,
+                 websocket_proxy=None, stream_idle_timeout: float = 300, identity_signer=None):
+        self.app = app
+        self.stages: List[Stage] = [
+            RouteResolveStage(registry),
+            AuthnStage(token_refresher),
+            AuthzStage(registry, upstream, authorizer, identity_signer),
+        ]
+        self.websocket_stages = list(self.stages)
+        self.websocket_proxy = websocket_proxy
+        forward = ForwardStage(registry, balancer, upstream, route_keys, response_cache, stream_idle_timeout)
+        if response_cache is not None:
+            self.stages.append(CacheStage(response_cache))
+        # 缓存命中的请求和合并请求的等待者不占用上游的并发名额
+        if coalescer is not None:
+            self.stages.append(CoalesceStage(coalescer, forward, admission))
+        if admission is not None:
+            self.stages.append(AdmissionStage(admission))
+        self.stages.append(forward)
+        self.admission = admission
+        self.compressor = compressor
+        self.stage_stats = stage_stats or StageStats()
+        self.server_timing = server_timing
 
-        # 获取第一个健康实例的 URL
-        target = instances[0]
-        return f"http://{target.host}:{target.port}"
-    
-    async def dispatch(self, request: Request, call_next):
-        # 1. 跳过内部接口（如健康检查）
-        if request.url.path.startswith("/_internal"):
-            return await call_next(request)
-        # 路径不对直接返回
-        path_parts = request.url.path.split('/')
-        if len(path_parts) < 2:
-            return JSONResponse(
-                status_code=404,
-                content={"message": "Invalid path format"}
-            )
-            
-        # 2. 获取请求路径的权限要求
-        service_name = path_parts[1] if len(path_parts) > 1 else None
-        
-        # 3. 获取该服务的实例，解析出服务的权限配置
-        service_url = self.get_service_url_from_registry(service_name)
-        if not service_url:
-            return JSONResponse(
-                status_code=503,
-                content={"message": f"No available instances for {service_name}"}
-            )
-        
-        # 4. 调用权限服务进行token和权限校验
-        current_path = '/' + '/'.join(path_parts[2:])
-        auth_header = request.headers.get("Authorization")
-       
-        headers = {"Content-Type": "application/json", "Authorization": auth_header if auth_header else ""}
-        
-        # 先调用user_management服务检查并刷新token
-        user_service_url = self.get_service_url_from_registry("user_management")
-        if user_service_url and auth_header and auth_header.startswith("Bearer "):
-            try:
-                async with httpx.AsyncClient() as client:
-                    refresh_response = await client.post(
-                        f"{user_service_url}/refresh-token",
-                        headers={"Authorization": auth_header}
-                    )
-                    if refresh_response.status_code == 200:
-                        
-                        refresh_data = refresh_response.json()
-                        if refresh_data.get("refreshed"):
-                            # 更新请求头中的token
-                            headers["Authorization"] = f"Bearer {refresh_data.get('new_token')}"
-                        new_token = refresh_data.get("new_token",None)
-                    
-            except httpx.RequestError:
-                pass
-                
-        # 然后调用权限服务验证权限
-        permission_service_url = self.get_service_url_from_registry("permission")
-        if not permission_service_url:
-            return JSONResponse(
-                status_code=503,
-                content={"message": "Permission service unavailable"}
-            )
-            
-        verify_permission_url = f"{permission_service_url}/verify-permission"
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    verify_permission_url,
-                    json={"service_name": service_name, "path": current_path},
-                    headers=headers
-                )
-              
-                user_info = response.json().get("user_info",None)
-                if response.status_code != 200:
-                    return JSONResponse(
-                        status_code=response.status_code,
-                        content={"message": response.json().get("detail", "Permission denied")}
-                    )
-                
-               
-        except httpx.RequestError:
-            return JSONResponse(
-                status_code=503,
-                content={"message": "Permission service unavailable"}
-            )
-        
-        #转发请求
-        return await self._forward_request(request, call_next,user_info,new_token if "new_token" in locals() else None)
-            
-    async def _forward_request(self, request: Request, call_next, user_info=None,new_token=None):
-        """
-        转发请求给服务，并携带用户信息（如果需要）
-        """
-        # 如果需要携带用户信息，添加 X-User-ID 和 X-User-Role
-        new_headers = {
-            key: value for key, value in request.headers.items()
-            if key.lower() not in SENSITIVE_HEADERS
-        }
-        if user_info:
-            new_headers["X-User-ID"] = str(user_info["id"])
-            new_headers["X-User-Role"] = user_info["role"]
-        
-        # 获取目标服务实例
-        path_parts = request.url.path.split('/')
-        service_name = path_parts[1] if len(path_parts) > 1 else None
-        instances = self.registry.get_healthy_instances(service_name)
-        if not instances:
-            return JSONResponse(
-                status_code=503,
-                content={"message": f"No available instances for {service_name}"}
-            )
-        service_id_header = request.headers.get("X-Service-ID",None)
-        # 选择实例并构造新的 URL
-        target = self.balancer.select_instance(instances, service_id_header)
-        if not target and service_id_header:
-            return JSONResponse(
-                status_code=404,
-                content={"message": f"Service instance with ID {service_id_header} not found"}
-            )
-        new_path = '/' + '/'.join(path_parts[2:]) if len(path_parts) > 2 else '/'
-        
-        # 构建新的 headers
-        new_headers["host"] = f"{target.host}:{target.port}"
-        new_headers["x-forwarded-for"] = request.client.host if request.client else "unknown"
-        new_headers["x-forwarded-host"] = str(request.url.hostname)
-        new_headers["x-forwarded-proto"] = request.url.scheme
-        
-        # 转发请求
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # 只处理 HTTP 和 WebSocket 请求，跳过内部接口（如健康检查）
+        if scope["type"] not in ("http", "websocket") or scope["path"].startswith("/_internal"):
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] == "websocket":
+            if self.websocket_proxy is None:
+                await self.app(scope, receive, send)
+                return
+            await self.handle_websocket(scope, receive, send)
+            return
+
+        ctx = GatewayContext(Request(scope, receive))
+        response = None
         try:
-            #print(f"http://{target.host}:{target.port}{new_path}")
-            async with httpx.AsyncClient() as client:
-                response = await client.request(
-                    method=request.method,
-                    url=f"http://{target.host}:{target.port}{new_path}",
-                    headers=new_headers,
-                    params=request.query_params,
-                    content=await request.body()
-                )
-                 # 如果有新token，添加到响应头
-                if new_token:
-                    response.headers["X-New-Token"] = new_token
-                return JSONResponse(
-                    content=response.json(),
-                    status_code=response.status_code,
-                    headers=dict(response.headers)
+            for stage in self.stages:
+                start = time.perf_counter()
+                response = await stage(ctx)
+                elapsed = time.perf_counter() - start
+                ctx.timings[stage.name] = elapsed
+                self.stage_stats.observe(stage.name, elapsed)
+                if response is not None:
+                    break
+
+            if self.server_timing:
+                response.raw_headers.append((
+                    b"server-timing",
+                    ", ".join(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in ctx.timings.items()).encode("latin-1")
+                ))
+            if self.compressor is not None:
+                send = self.compressor.wrap(ctx.request.headers.get("accept-encoding", ""), send)
+            await response(scope, receive, send)
+        finally:
+            # 响应发送完毕（或出错）后归还并发名额，自适应限流使用上游的响应头延迟
+            if ctx.admission:
+                self.admission.release(
+                    ctx.admission,
+                    ctx.timings.get("forward"),
+                    response is not None and response.status_code < 500
                 )
-        except httpx.ConnectError:
-            # 标记实例为不健康
-            target.is_healthy = False
-            return JSONResponse(
-                status_code=503,
-                content={"message": "Service connection failed"}
-             )
-        except Exception as e:
-            return JSONResponse(
-                status_code=500,
-                content={"message": f"Service error: {str(e)}"}
-            )
+
+    async def handle_websocket(self, scope: Scope, receive: Receive, send: Send):
+        websocket = WebSocket(scope, receive, send)
+        ctx = GatewayContext(websocket)
+        # 浏览器的 WebSocket API 无法设置请求头，允许通过 access_token 查询参数携带 token
+        token = websocket.query_params.get("access_token")
+        if token and not ctx.authorization:
+            ctx.authorization = f"Bearer {token}"
+        for stage in self.websocket_stages:
+            start = time.perf_counter()
+            response = await stage(ctx)
+            self.stage_stats.observe(stage.name, time.perf_counter() - start)
+            if response is not None:
+                # 握手阶段被拒绝：服务不可用时提示稍后重试，其余视为违反策略
+                await websocket.close(code=1013 if response.status_code == 503 else 1008)
+                return
+        await self.websocket_proxy(ctx, websocket)
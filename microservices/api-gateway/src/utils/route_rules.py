@@ -0,0 +1,66 @@
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+
+class RouteKeyRule:
+    """
+    路由键规则，格式为 "服务名:路径"：
+      - "query:/subject/{subject_id}"  取路径参数 subject_id
+      - "query:/cfc/predict?id"        取查询参数 id
+    路径中的 {param} 分段匹配任意值；同时包含两者时以查询参数为准。
+    """
+    def __init__(self, spec: str):
+        service_name, _, pattern = spec.partition(':')
+        path, _, query_param = pattern.partition('?')
+        if not service_name or not path.startswith('/'):
+            raise ValueError(f"Invalid route key rule: {spec}")
+        self.spec = spec
+        self.service_name = service_name
+        self.segments: List[str] = path.strip('/').split('/')
+        self.query_param: Optional[str] = query_param or None
+        self.path_param: Optional[str] = None
+        for segment in reversed(self.segments):
+            if segment.startswith('{') and segment.endswith('}'):
+                self.path_param = segment[1:-1]
+                break
+        if not self.query_param and not self.path_param:
+            raise ValueError(f"Route key rule has no key parameter: {spec}")
+
+    def match(self, parts: List[str], query_params: Mapping[str, str]) -> Optional[str]:
+        if len(parts) != len(self.segments):
+            return None
+        params: Dict[str, str] = {}
+        for segment, part in zip(self.segments, parts):
+            if segment.startswith('{') and segment.endswith('}'):
+                params[segment[1:-1]] = part
+            elif segment != part:
+                return None
+        if self.query_param:
+            return query_params.get(self.query_param)
+        return params.get(self.path_param)
+
+
+class RouteKeyExtractor:
+    """从请求中提取路由键，用于一致性哈希；同一路由键的请求落在同一实例上"""
+    def __init__(self, specs: Iterable[str]):
+        self._rules: Dict[str, List[RouteKeyRule]] = {}
+        for spec in specs:
+            rule = RouteKeyRule(spec)
+            self._rules.setdefault(rule.service_name, []).append(rule)
+
+    def __bool__(self) -> bool:
+        return bool(self._rules)
+
+    def key_for(self, service_name: str, path: str, query_params: Mapping[str, str]) -> Optional[str]:
+        rules = self._rules.get(service_name)
+        if not rules:
+            return None
+        parts = path.strip('/').split('/')
+        for rule in rules:
+            key = rule.match(parts, query_params)
+            if key:
+                # 键加上参数名前缀：同一 subject 的不同接口落在同一实例，subject 1 与 model 1 互不影响
+                return f"{rule.query_param or rule.path_param}={key}"
+        return None
+
+    def rules(self) -> List[Tuple[str, str]]:
+        return [(service_name, rule.spec) for service_name, rules in self._rules.items() for rule in rules]
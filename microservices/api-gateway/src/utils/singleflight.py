@@ -0,0 +1,24 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """
+    合并相同 key 的并发调用：同一时刻只有一个调用真正执行，其余调用等待并共享结果（或异常）。
+    实际调用在独立的任务中执行，发起者被取消不会影响其他等待者。
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """执行或加入 key 对应的调用，返回 (结果, 是否共享了其他请求的调用)"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def inflight(self) -> int:
+        return len(self._calls)
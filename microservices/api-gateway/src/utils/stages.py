@@ -0,0 +1,584 @@
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+import httpx
+from starlette.background import BackgroundTask
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from services.admission import AdmissionRejected
+from services.identity import IDENTITY_HEADER, IDENTITY_HEADERS
+from services.response_cache import CachedResponse, ResponseCache
+
+# 需要过滤的headers列表：逐跳(hop-by-hop)头，流式转发时不透传；content-length/content-encoding 原样透传
+HOP_BY_HOP_HEADERS = {
+    'host', 'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'transfer-encoding', 'upgrade'
+}
+
+
+class GatewayContext:
+    """一次请求在各阶段之间传递的状态"""
+    def __init__(self, request: HTTPConnection):
+        # HTTP 请求为 Request，WebSocket 连接为 WebSocket
+        self.request = request
+        self.service_name: Optional[str] = None
+        # 转发到下游服务的路径（去掉服务名前缀）
+        self.path: str = '/'
+        self.authorization: str = request.headers.get("Authorization") or ""
+        self.new_token: Optional[str] = None
+        self.user_info: Optional[dict] = None
+        # 网关签发的身份断言，转发时通过 X-Identity-Assertion 传给下游
+        self.identity: Optional[str] = None
+        self.instances: List = []
+        self.timings: Dict[str, float] = {}
+        # 响应缓存：可缓存请求的缓存键、已过期待验证的条目、写请求成功后需要失效的路径前缀
+        self.cache_key: Optional[tuple] = None
+        self.cache_entry: Optional[CachedResponse] = None
+        self.invalidate_prefix: Optional[str] = None
+        # 准入控制占用的并发限制器，响应发送完毕后归还
+        self.admission: List = []
+        # SSE 长连接：不缓存、不合并、不占用并发名额，读超时改为空闲超时
+        self.streaming: bool = "text/event-stream" in request.headers.get("accept", "")
+
+
+class Stage:
+    """
+    网关处理阶段。
+    返回 Response 表示请求在该阶段结束（出错或已转发），返回 None 则进入下一阶段。
+    """
+    name = "stage"
+
+    async def __call__(self, ctx: GatewayContext) -> Optional[Response]:
+        raise NotImplementedError
+
+
+class RouteResolveStage(Stage):
+    """解析服务名和下游路径，并从服务发现缓存获取实例"""
+    name = "route"
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    async def __call__(self, ctx: GatewayContext) -> Optional[Response]:
+        path_parts = ctx.request.url.path.split('/')
+        if len(path_parts) < 2 or not path_parts[1]:
+            return JSONResponse(status_code=404, content={"message": "Invalid path format"})
+        ctx.service_name = path_parts[1]
+        ctx.path = '/' + '/'.join(path_parts[2:])
+        ctx.instances = self.registry.get_healthy_instances(ctx.service_name)
+        if not ctx.instances:
+            return JSONResponse(
+                status_code=503,
+                content={"message": f"No available instances for {ctx.service_name}"}
+            )
+        return None
+
+
+class AuthnStage(Stage):
+    """token 临近过期时换取新 token，后续阶段使用新 token"""
+    name = "authn"
+
+    def __init__(self, token_refresher):
+        self.token_refresher = token_refresher
+
+    async def __call__(self, ctx: GatewayContext) -> Optional[Response]:
+        if ctx.authorization.startswith("Bearer "):
+            ctx.new_token = await self.token_refresher.refresh(ctx.authorization)
+            if ctx.new_token:
+                ctx.authorization = f"Bearer {ctx.new_token}"
+        return None
+
+
+class AuthzStage(Stage):
+    """
+    权限校验。本地已加载公钥和权限表时直接在网关内判断，否则调用权限服务的 /verify-permission。
+    配置了 identity_signer 时，校验通过后为已登录用户签发身份断言。
+    """
+    name = "authz"
+
+    def __init__(self, registry, upstream, authorizer=None, identity_signer=None):
+        self.registry = registry
+        self.upstream = upstream
+        self.authorizer = authorizer
+        self.identity_signer = identity_signer
+
+    async def __call__(self, ctx: GatewayContext) -> Optional[Response]:
+        if self.authorizer and self.authorizer.ready:
+            result = self.authorizer.authorize(ctx.service_name, ctx.path, ctx.authorization)
+            if result.status_code != 200:
+                return JSONResponse(status_code=result.status_code, content={"message": result.message})
+            ctx.user_info = result.user_info
+        else:
+            response = await self._verify_remote(ctx)
+            if response is not None:
+                return response
+        if self.identity_signer is not None:
+            ctx.identity = self.identity_signer.sign(ctx.user_info)
+        return None
+
+    async def _verify_remote(self, ctx: GatewayContext) -> Optional[Response]:
+        instances = self.registry.get_healthy_instances("permission")
+        if not instances:
+            return JSONResponse(status_code=503, content={"message": "Permission service unavailable"})
+        target = instances[0]
+        try:
+            response = await self.upstream.get_client("permission").post(
+                f"http://{target.host}:{target.port}/verify-permission",
+                json={"service_name": ctx.service_name, "path": ctx.path},
+                headers={"Content-Type": "application/json", "Authorization": ctx.authorization}
+            )
+        except httpx.RequestError:
+            return JSONResponse(status_code=503, content={"message": "Permission service unavailable"})
+        if response.status_code != 200:
+            return JSONResponse(
+                status_code=response.status_code,
+                content={"message": response.json().get("detail", "Permission denied")}
+            )
+        ctx.user_info = response.json().get("user_info", None)
+        return None
+
+
+class CacheStage(Stage):
+    """
+    GET 响应缓存查找。命中且未过期时直接返回（客户端 If-None-Match 匹配时返回 304）；
+    过期条目交给转发阶段带 If-None-Match 向上游验证。写请求记录需要失效的路径前缀。
+    """
+    name = "cache"
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def __call__(self, ctx: GatewayContext) -> Optional[Response]:
+        request = ctx.request
+        if ctx.streaming:
+            return None
+        if request.method != "GET":
+            if request.method not in ("HEAD", "OPTIONS"):
+                ctx.invalidate_prefix = '/' + ctx.path.strip('/').split('/')[0]
+            return None
+        if not self.cache.cacheable(ctx.service_name, ctx.path):
+            return None
+        roles = ctx.user_info["role"] if ctx.user_info else ""
+        ctx.cache_key = self.cache.make_key(
+            ctx.service_name, ctx.path, request.url.query, roles,
+            request.headers.get("accept-encoding", "")
+        )
+        entry = self.cache.get(ctx.cache_key)
+        if entry is not None and entry.fresh:
+            self.cache.hits += 1
+            return cached_response(entry, ctx, "HIT")
+        ctx.cache_entry = entry
+        return None
+
+
+class CoalesceStage(Stage):
+    """
+    合并相同的并发 GET：目标实例（X-Service-ID）、路径、查询串、角色集合和 Accept-Encoding 相同的请求只转发一次，
+    响应体缓冲后分发给所有等待者，每个等待者各自附加新 token 并判断 If-None-Match。
+    该阶段在准入控制之前：只有领头的请求占用并发名额，等待者不排队，也不会因并发上限被拒绝。
+    领头请求被准入控制拒绝，或响应体过大无法共享时，等待者按普通请求继续经过准入控制和转发。
+    """
+    name = "coalesce"
+
+    def __init__(self, coalescer, forward: "ForwardStage", admission=None):
+        self.coalescer = coalescer
+        self.forward = forward
+        self.admission = admission
+
+    async def __call__(self, ctx: GatewayContext) -> Optional[Response]:
+        request = ctx.request
+        if request.method != "GET" or ctx.streaming:
+            return None
+        route = self.coalescer.route_for(ctx.service_name, ctx.path)
+        if route is None:
+            return None
+        key = (request.headers.get("X-Service-ID"), ctx.cache_key or ResponseCache.make_key(
+            ctx.service_name, ctx.path, request.url.query,
+            ctx.user_info["role"] if ctx.user_info else "",
+            request.headers.get("accept-encoding", "")
+        ))
+        result = await self.coalescer.do(route, key, lambda: self.lead(ctx))
+        if isinstance(result, CoalesceRejected):
+            return admission_rejected(result.error) if result.ctx is ctx else None
+        if isinstance(result, OversizedResponse):
+            claimed = result.claim()
+            if claimed is None:
+                return None
+            response, release = claimed
+            return stream_response(response, ctx.new_token, on_close=release)
+        status_code, headers, body, x_cache = result
+        etag = next((value for name, value in headers if name.lower() == "etag"), None)
+        return client_response(status_code, headers, body, etag, ctx, x_cache)
+
+    async def lead(self, ctx: GatewayContext):
+        """领头请求：通过准入控制后转发，名额在响应体读取完毕（过大的响应在流式转发结束）后归还"""
+        limiters = []
+        if self.admission is not None:
+            try:
+                limiters = await self.admission.admit(ctx.service_name, ctx.path, admission_user(ctx), ctx.request.method)
+            except AdmissionRejected as e:
+                return CoalesceRejected(ctx, e)
+        start = time.perf_counter()
+        try:
+            result = await self.forward.fetch_buffered(ctx, self.coalescer.max_body_bytes)
+        except BaseException:
+            self.release(limiters, None, False)
+            raise
+        latency = time.perf_counter() - start
+        if isinstance(result, OversizedResponse):
+            release, success = result.release, result.response.status_code < 500
+
+            def release_all():
+                release()
+                self.release(limiters, latency, success)
+
+            result.release = release_all
+        else:
+            self.release(limiters, latency, result[0] < 500)
+        return result
+
+    def release(self, limiters: List, latency: Optional[float], success: bool):
+        if limiters:
+            self.admission.release(limiters, latency, success)
+
+
+class CoalesceRejected:
+    """领头请求被准入控制拒绝：拒绝响应只返回给领头请求自己"""
+    def __init__(self, ctx: GatewayContext, error: AdmissionRejected):
+        self.ctx = ctx
+        self.error = error
+
+
+def admission_user(ctx: GatewayContext) -> Optional[str]:
+    """令牌桶限流的用户标识：已登录用户的ID，否则为客户端地址"""
+    request = ctx.request
+    return str(ctx.user_info["id"]) if ctx.user_info else (request.client.host if request.client else None)
+
+
+def admission_rejected(error: AdmissionRejected) -> Response:
+    return JSONResponse(
+        status_code=error.status_code,
+        content={"message": error.message},
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+    )
+
+
+class AdmissionStage(Stage):
+    """准入控制：用户令牌桶超限返回 429，服务或路由的并发及等待队列已满返回 503"""
+    name = "admission"
+
+    def __init__(self, admission):
+        self.admission = admission
+
+    async def __call__(self, ctx: GatewayContext) -> Optional[Response]:
+        # SSE 连接持续时间不定，不计入并发上限
+        if ctx.streaming:
+            return None
+        try:
+            ctx.admission = await self.admission.admit(ctx.service_name, ctx.path, admission_user(ctx), ctx.request.method)
+        except AdmissionRejected as e:
+            return admission_rejected(e)
+        return None
+
+
+class ForwardStage(Stage):
+    """
+    选择实例并转发请求。请求体和响应体都按块流式透传，不在网关内缓冲或做JSON解析。
+    SSE 请求的读超时为 stream_idle_timeout（两个事件之间的最长间隔），超时后正常结束响应流。
+    """
+    name = "forward"
+
+    def __init__(self, registry, balancer, upstream, route_keys=None, cache=None,
+                 stream_idle_timeout: float = 300):
+        self.registry = registry
+        self.balancer = balancer
+        self.upstream = upstream
+        self.route_keys = route_keys
+        self.cache = cache
+        self.stream_idle_timeout = stream_idle_timeout
+
+    def select_target(self, ctx: GatewayContext):
+        request = ctx.request
+        service_id = request.headers.get("X-Service-ID", None)
+        if service_id:
+            return self.registry.get_instance(ctx.service_name, service_id)
+        hash_key = self.route_keys.key_for(ctx.service_name, ctx.path, request.query_params) if self.route_keys else None
+        return self.balancer.select_instance(ctx.instances, hash_key=hash_key)
+
+    def build_headers(self, ctx: GatewayContext, target) -> Dict[str, str]:
+        request = ctx.request
+        headers = {
+            key: value for key, value in request.headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() not in IDENTITY_HEADERS
+        }
+        # 如果需要携带用户信息，添加 X-User-ID 和 X-User-Role
+        if ctx.user_info:
+            headers["X-User-ID"] = str(ctx.user_info["id"])
+            headers["X-User-Role"] = ctx.user_info["role"]
+        if ctx.identity:
+            headers[IDENTITY_HEADER] = ctx.identity
+        headers["host"] = f"{target.host}:{target.port}"
+        headers["x-forwarded-for"] = request.client.host if request.client else "unknown"
+        headers["x-forwarded-host"] = str(request.url.hostname)
+        headers["x-forwarded-proto"] = request.url.scheme
+        return headers
+
+    async def send(self, ctx: GatewayContext, coalesced: bool = False):
+        """
+        选择实例并发送请求，返回 (上游响应, 释放回调)；出错时返回错误响应。
+        释放回调在响应体读取完毕后调用，用于向负载均衡器上报结果。
+        """
+        request = ctx.request
+        target = self.select_target(ctx)
+        if not target:
+            return JSONResponse(
+                status_code=404,
+                content={"message": f"Service instance with ID {request.headers.get('X-Service-ID')} not found"}
+            )
+        headers = self.build_headers(ctx, target)
+        if coalesced:
+            # 合并的请求共享同一个上游响应，客户端自己的条件请求头在网关内判断
+            headers.pop("if-none-match", None)
+            headers.pop("if-modified-since", None)
+        # 缓存条目已过期，带上 ETag 让上游判断是否可以返回 304
+        if ctx.cache_entry is not None and ctx.cache_entry.etag:
+            headers["if-none-match"] = ctx.cache_entry.etag
+        # 转发前后向负载均衡器上报，用于统计未完成请求数、延迟以及被动摘除异常实例
+        self.balancer.on_request_start(target)
+        start = time.perf_counter()
+        try:
+            client = self.upstream.get_client(ctx.service_name)
+            has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+            upstream_request = client.build_request(
+                method=request.method,
+                url=f"http://{target.host}:{target.port}{ctx.path}",
+                headers=headers,
+                params=request.query_params,
+                content=request.stream() if has_body else None,
+                timeout=httpx.Timeout(self.stream_idle_timeout, connect=client.timeout.connect)
+                if ctx.streaming else httpx.USE_CLIENT_DEFAULT
+            )
+            response = await client.send(upstream_request, stream=True)
+        except (httpx.ConnectError, httpx.TimeoutException):
+            self.balancer.on_request_end(target, time.perf_counter() - start, False)
+            return JSONResponse(status_code=503, content={"message": "Service connection failed"})
+        except Exception as e:
+            self.balancer.on_request_end(target, time.perf_counter() - start, False)
+            return JSONResponse(status_code=500, content={"message": f"Service error: {str(e)}"})
+        # 延迟按收到响应头计算；未完成请求数在响应体传输结束后才减少
+        latency = time.perf_counter() - start
+        success = response.status_code < 500
+        return response, lambda: self.balancer.on_request_end(target, latency, success)
+
+    async def __call__(self, ctx: GatewayContext) -> Optional[Response]:
+        result = await self.send(ctx)
+        if isinstance(result, Response):
+            return result
+        response, release = result
+        if ctx.streaming:
+            return self.event_stream(ctx, response, release)
+        if self.cache is not None:
+            if ctx.invalidate_prefix and response.status_code < 400:
+                self.cache.invalidate(ctx.service_name, [ctx.invalidate_prefix])
+            if ctx.cache_key is not None:
+                if response.status_code == 304 and ctx.cache_entry is not None:
+                    return await self.revalidated(ctx, response, release)
+                self.cache.misses += ctx.cache_entry is not None
+                ttl = self.cache.ttl_for(response.headers.get("cache-control", ""))
+                length = response.headers.get("content-length")
+                if response.status_code == 200 and ttl is not None and not (length and int(length) > self.cache.max_entry_bytes):
+                    headers, body = await read_response(response, release)
+                    self.cache.set(ctx.cache_key, response.status_code, headers, body, ttl)
+                    return buffered_response(response.status_code, headers, body, ctx.new_token, "MISS")
+        return stream_response(response, ctx.new_token, on_close=release)
+
+    def event_stream(self, ctx: GatewayContext, response: httpx.Response, release) -> Response:
+        """转发 SSE 响应；上游超过空闲超时没有发送数据时结束流，由客户端按 EventSource 规则重连"""
+        streaming_response = stream_response(response, ctx.new_token, on_close=release, idle_timeout_ok=True)
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            # 提示前置的反向代理（如 nginx）不要缓冲事件流
+            streaming_response.raw_headers.append((b"x-accel-buffering", b"no"))
+        return streaming_response
+
+    async def revalidated(self, ctx: GatewayContext, response: httpx.Response, release) -> Response:
+        """上游确认缓存未变化（304），延长有效期并返回缓存内容"""
+        await response.aclose()
+        release()
+        ttl = self.cache.ttl_for(response.headers.get("cache-control", ""))
+        if ttl is None:
+            self.cache.pop(ctx.cache_key)
+        else:
+            self.cache.refresh(ctx.cache_key, ttl)
+        return cached_response(ctx.cache_entry, ctx, "REVALIDATED")
+
+    async def fetch_buffered(self, ctx: GatewayContext, max_body_bytes: int):
+        """
+        转发请求并完整读取响应，结果同时写入响应缓存，返回 (状态码, 响应头, 响应体, X-Cache)。
+        Content-Length 超过 max_body_bytes（及缓存条目上限）的响应不读取响应体，返回 OversizedResponse 交给等待者流式转发。
+        """
+        result = await self.send(ctx, coalesced=True)
+        if isinstance(result, Response):
+            headers = [(key.decode("latin-1"), value.decode("latin-1")) for key, value in result.raw_headers]
+            return result.status_code, headers, result.body, None
+        response, release = result
+        cacheable = self.cache is not None and ctx.cache_key is not None
+        if cacheable and response.status_code == 304 and ctx.cache_entry is not None:
+            await self.revalidated(ctx, response, release)
+            entry = ctx.cache_entry
+            return entry.status_code, entry.headers, entry.body, "REVALIDATED"
+        if cacheable:
+            self.cache.misses += ctx.cache_entry is not None
+        length = response.headers.get("content-length")
+        limit = max_body_bytes
+        if cacheable:
+            limit = min(limit, self.cache.max_entry_bytes)
+        if length and int(length) > limit:
+            return OversizedResponse(response, release)
+        headers, body = await read_response(response, release)
+        if not cacheable:
+            return response.status_code, headers, body, None
+        ttl = self.cache.ttl_for(response.headers.get("cache-control", ""))
+        if response.status_code == 200 and ttl is not None:
+            self.cache.set(ctx.cache_key, response.status_code, headers, body, ttl)
+        return response.status_code, headers, body, "MISS"
+
+
+class OversizedResponse:
+    """合并请求中响应体过大、未缓冲的上游响应，只能交给一个等待者流式转发"""
+    def __init__(self, response: httpx.Response, release):
+        self.response = response
+        self.release = release
+        self.claimed = False
+
+    def claim(self) -> Optional[tuple]:
+        """第一个调用者取得 (响应, 释放回调)，之后的调用者返回 None"""
+        if self.claimed:
+            return None
+        self.claimed = True
+        return self.response, self.release
+
+
+async def read_response(response: httpx.Response, release=None) -> Tuple[List[Tuple[str, str]], bytes]:
+    """完整读取上游响应的原始字节（保留压缩编码），返回 (响应头, 响应体)"""
+    try:
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+        if release:
+            release()
+    headers = [
+        (key, value) for key, value in response.headers.multi_items()
+        if key.lower() not in HOP_BY_HOP_HEADERS
+    ]
+    return headers, body
+
+
+def stream_response(response: httpx.Response, new_token=None, on_close=None,
+                    idle_timeout_ok: bool = False) -> StreamingResponse:
+    """
+    将上游响应按原始字节流转发给客户端。
+    使用 aiter_raw 保留上游的压缩编码，因此 content-encoding 和 content-length 可以原样透传。
+    idle_timeout_ok 为 True 时（SSE），上游读超时视为流正常结束。
+    """
+    headers = [
+        (key, value) for key, value in response.headers.multi_items()
+        if key.lower() not in HOP_BY_HOP_HEADERS
+    ]
+    # 如果有新token，添加到响应头
+    if new_token:
+        headers.append(("X-New-Token", new_token))
+    closed = False
+
+    async def close():
+        # 正常结束时由后台任务调用；客户端中途断开时由生成器的 finally 调用，只执行一次
+        nonlocal closed
+        if closed:
+            return
+        closed = True
+        await response.aclose()
+        if on_close:
+            on_close()
+
+    async def body():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        except httpx.ReadTimeout:
+            if not idle_timeout_ok:
+                raise
+        finally:
+            await close()
+
+    streaming_response = StreamingResponse(
+        body(),
+        status_code=response.status_code,
+        background=BackgroundTask(close)
+    )
+    streaming_response.raw_headers = [
+        (key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers
+    ]
+    return streaming_response
+
+
+def buffered_response(status_code: int, headers: List, body: bytes, new_token=None,
+                      x_cache: Optional[str] = None, age: Optional[int] = None) -> Response:
+    """用已缓冲的响应体构造响应，content-length 按实际长度重新计算"""
+    raw_headers = [
+        (key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers
+        if key.lower() != "content-length"
+    ]
+    if status_code != 304:
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+    if new_token:
+        raw_headers.append((b"x-new-token", new_token.encode("latin-1")))
+    if x_cache:
+        raw_headers.append((b"x-cache", x_cache.encode()))
+    if age is not None:
+        raw_headers.append((b"age", str(age).encode()))
+    response = Response(status_code=status_code)
+    response.body = body
+    response.raw_headers = raw_headers
+    return response
+
+
+def cached_response(entry: CachedResponse, ctx: GatewayContext, x_cache: str) -> Response:
+    """返回缓存的响应"""
+    return client_response(
+        entry.status_code, entry.headers, entry.body, entry.etag, ctx, x_cache, int(time.time() - entry.stored_at)
+    )
+
+
+def client_response(status_code: int, headers: List, body: bytes, etag: Optional[str], ctx: GatewayContext,
+                    x_cache: Optional[str] = None, age: Optional[int] = None) -> Response:
+    """返回网关内已缓冲的响应；客户端的 If-None-Match 与 ETag 一致时返回 304"""
+    if_none_match = ctx.request.headers.get("if-none-match")
+    if status_code == 200 and etag and if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        headers = [(key, value) for key, value in headers if key.lower() in ("etag", "cache-control")]
+        return buffered_response(304, headers, b"", ctx.new_token, x_cache, age)
+    return buffered_response(status_code, headers, body, ctx.new_token, x_cache, age)
+
+
+class StageStats:
+    """各阶段耗时统计（毫秒）"""
+    def __init__(self):
+        self._stats: Dict[str, List[float]] = {}  # 阶段名 -> [次数, 总耗时, 最大耗时]
+
+    def observe(self, name: str, elapsed: float):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = [0, 0.0, 0.0]
+        elapsed *= 1000
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "count": count,
+                "avg_ms": round(total / count, 3) if count else 0.0,
+                "max_ms": round(max_ms, 3)
+            }
+            for name, (count, total, max_ms) in self._stats.items()
+        }
@@ -0,0 +1,175 @@
+import asyncio
+import time
+from typing import Dict, Optional
+from urllib.parse import urlencode
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidURI
+from services.identity import IDENTITY_HEADER, IDENTITY_HEADERS
+from utils.stages import HOP_BY_HOP_HEADERS, GatewayContext
+
+# WebSocket 握手相关的请求头由 websockets 客户端重新生成，不透传
+HANDSHAKE_HEADERS = HOP_BY_HOP_HEADERS | {
+    'sec-websocket-key', 'sec-websocket-version', 'sec-websocket-extensions', 'sec-websocket-protocol'
+}
+
+# 关闭码：1001 空闲超时，1011 上游异常，1013 上游不可用
+CLOSE_GOING_AWAY = 1001
+CLOSE_INTERNAL_ERROR = 1011
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class WebSocketProxy:
+    """
+    WebSocket 转发。鉴权在建立连接时完成一次（由网关中间件执行路由、token刷新和权限阶段），
+    之后在客户端和上游实例之间双向转发消息；任一方向超过 idle_timeout 秒没有消息时关闭两端连接。
+    负载均衡器只统计握手的延迟和结果，长连接本身不计入未完成请求数。
+    """
+    def __init__(self, registry, balancer, route_keys=None, idle_timeout: float = 300,
+                 open_timeout: float = 10, ping_interval: Optional[float] = 20):
+        self.registry = registry
+        self.balancer = balancer
+        self.route_keys = route_keys
+        self.idle_timeout = idle_timeout
+        self.open_timeout = open_timeout
+        self.ping_interval = ping_interval or None
+        self.active = 0
+        self.total = 0
+        self.failed = 0
+        self.idle_closed = 0
+
+    def select_target(self, ctx: GatewayContext):
+        websocket = ctx.request
+        service_id = websocket.headers.get("X-Service-ID", None)
+        if service_id:
+            return self.registry.get_instance(ctx.service_name, service_id)
+        hash_key = self.route_keys.key_for(ctx.service_name, ctx.path, websocket.query_params) if self.route_keys else None
+        return self.balancer.select_instance(ctx.instances, hash_key=hash_key)
+
+    def build_headers(self, ctx: GatewayContext) -> Dict[str, str]:
+        websocket = ctx.request
+        headers = {
+            key: value for key, value in websocket.headers.items()
+            if key.lower() not in HANDSHAKE_HEADERS and key.lower() not in IDENTITY_HEADERS
+        }
+        if ctx.authorization:
+            headers["authorization"] = ctx.authorization
+        if ctx.user_info:
+            headers["X-User-ID"] = str(ctx.user_info["id"])
+            headers["X-User-Role"] = ctx.user_info["role"]
+        if ctx.identity:
+            headers[IDENTITY_HEADER] = ctx.identity
+        headers["x-forwarded-for"] = websocket.client.host if websocket.client else "unknown"
+        headers["x-forwarded-host"] = str(websocket.url.hostname)
+        headers["x-forwarded-proto"] = "https" if websocket.url.scheme == "wss" else "http"
+        return headers
+
+    def build_url(self, ctx: GatewayContext, target) -> str:
+        # access_token 查询参数只用于网关鉴权，不转发给上游
+        query = urlencode([
+            (key, value) for key, value in ctx.request.query_params.multi_items() if key != "access_token"
+        ])
+        return f"ws://{target.host}:{target.port}{ctx.path}" + (f"?{query}" if query else "")
+
+    async def __call__(self, ctx: GatewayContext, websocket: WebSocket):
+        target = self.select_target(ctx)
+        if not target:
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            return
+        self.total += 1
+        self.balancer.on_request_start(target)
+        start = time.perf_counter()
+        try:
+            upstream = await connect(
+                self.build_url(ctx, target),
+                additional_headers=self.build_headers(ctx),
+                subprotocols=websocket.scope.get("subprotocols") or None,
+                open_timeout=self.open_timeout,
+                ping_interval=self.ping_interval,
+                max_size=None
+            )
+        except (OSError, asyncio.TimeoutError, InvalidHandshake, InvalidURI):
+            self.failed += 1
+            self.balancer.on_request_end(target, time.perf_counter() - start, False)
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            return
+        self.balancer.on_request_end(target, time.perf_counter() - start, True)
+
+        self.active += 1
+        try:
+            await websocket.accept(subprotocol=upstream.subprotocol)
+            await self._relay(websocket, upstream)
+        finally:
+            self.active -= 1
+            await upstream.close()
+
+    async def _relay(self, websocket: WebSocket, upstream):
+        loop = asyncio.get_running_loop()
+        last_activity = loop.time()
+
+        async def client_to_upstream():
+            nonlocal last_activity
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    code = message.get("code", 1000)
+                    # 1005/1006 只用于表示没有收到关闭帧，不能在关闭帧中发送
+                    await upstream.close(1000 if code in (1005, 1006) else code)
+                    return
+                last_activity = loop.time()
+                if message.get("text") is not None:
+                    await upstream.send(message["text"])
+                elif message.get("bytes") is not None:
+                    await upstream.send(message["bytes"])
+
+        async def upstream_to_client():
+            nonlocal last_activity
+            try:
+                async for data in upstream:
+                    last_activity = loop.time()
+                    if isinstance(data, str):
+                        await websocket.send_text(data)
+                    else:
+                        await websocket.send_bytes(data)
+            except ConnectionClosed:
+                pass
+            code = upstream.close_code
+            await self._close_client(websocket, code if code and code != 1005 else 1000, upstream.close_reason or "")
+
+        async def idle_watchdog():
+            while True:
+                remaining = last_activity + self.idle_timeout - loop.time()
+                if remaining <= 0:
+                    self.idle_closed += 1
+                    await self._close_client(websocket, CLOSE_GOING_AWAY, "Idle timeout")
+                    return
+                await asyncio.sleep(remaining)
+
+        tasks = [asyncio.create_task(coro()) for coro in (client_to_upstream, upstream_to_client, idle_watchdog)]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None and \
+                        not isinstance(task.exception(), (ConnectionClosed, WebSocketDisconnect)):
+                    await self._close_client(websocket, CLOSE_INTERNAL_ERROR, "Upstream error")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    async def _close_client(websocket: WebSocket, code: int, reason: str = ""):
+        try:
+            await websocket.close(code=code, reason=reason)
+        except (RuntimeError, WebSocketDisconnect):
+            # 客户端已断开或连接已关闭
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "total": self.total,
+            "failed": self.failed,
+            "idle_closed": self.idle_closed,
+            "idle_timeout": self.idle_timeout
+        }
@@ -0,0 +1,112 @@
+"""
+请求合并与准入控制：相同的并发 GET 只有领头请求占用并发名额，等待者不会因路由并发上限被拒绝。
+上游和权限服务用进程内的 FastAPI 应用代替（httpx.ASGITransport），不需要启动其他服务。
+
+    cd microservices/api-gateway
+    python -m unittest discover -s tests
+"""
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+import httpx
+from fastapi import FastAPI, Response
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from services.admission import AdmissionController  # noqa: E402
+from services.coalescer import RequestCoalescer  # noqa: E402
+from services.http_client import UpstreamClientPool  # noqa: E402
+from services.registry import ServiceInstance  # noqa: E402
+from services.token_refresher import TokenRefresher  # noqa: E402
+from utils.load_balancer import create_balancer  # noqa: E402
+from utils.middleware import GatewayMiddleware  # noqa: E402
+
+CONCURRENCY = 20
+
+
+class FakeRegistry:
+    def get_healthy_instances(self, service_name):
+        return [ServiceInstance(service_name=service_name, instance_id=f"{service_name}-1", host="backend", port=80,
+                                is_healthy=True)]
+
+
+def create_backend(calls: dict) -> FastAPI:
+    """上游服务和权限服务：所有路径放行，数据接口等待一段时间，保证并发请求同时在途"""
+    app = FastAPI()
+
+    @app.post("/verify-permission")
+    async def verify_permission():
+        return {"message": "Permission granted"}
+
+    @app.get("/subject/{subject_id}/data")
+    async def subject_data(subject_id: int):
+        calls["data"] = calls.get("data", 0) + 1
+        await asyncio.sleep(0.2)
+        return Response(b'{"id":%d}' % subject_id, media_type="application/json")
+
+    @app.get("/layouts/list")
+    async def layouts():
+        calls["layouts"] = calls.get("layouts", 0) + 1
+        await asyncio.sleep(0.2)
+        return Response(b"[]", media_type="application/json")
+
+    return app
+
+
+class CoalescingAdmissionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = {}
+        backend = create_backend(self.calls)
+        self.upstream = UpstreamClientPool()
+        for service_name in ("query", "permission"):
+            self.upstream._clients[service_name] = httpx.AsyncClient(transport=httpx.ASGITransport(backend))
+        registry = FakeRegistry()
+        # 两个路由的并发上限都是 1，且不排队：超出的请求立即返回 503
+        self.admission = AdmissionController(
+            {}, {"query:/subject/{subject_id}/data": 1, "query:/layouts/list": 1}, queue_size=0
+        )
+        app = FastAPI()
+        app.add_middleware(
+            GatewayMiddleware, registry=registry, balancer=create_balancer("round_robin"), upstream=self.upstream,
+            token_refresher=TokenRefresher(registry, self.upstream), admission=self.admission,
+            coalescer=RequestCoalescer(["query:/subject/{subject_id}/data"])
+        )
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://gateway")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await self.upstream.close()
+
+    async def test_coalesced_followers_skip_admission(self):
+        responses = await asyncio.gather(*(self.client.get("/query/subject/7/data") for _ in range(CONCURRENCY)))
+        self.assertEqual([response.status_code for response in responses], [200] * CONCURRENCY)
+        self.assertTrue(all(response.json() == {"id": 7} for response in responses))
+        self.assertEqual(self.calls["data"], 1)
+        route = self.admission.routes["query:/subject/{subject_id}/data"]
+        # 只有领头请求占用过名额，结束后全部归还
+        self.assertEqual(route.admitted, 1)
+        self.assertEqual(route.rejected, 0)
+        self.assertEqual(route.inflight, 0)
+
+    async def test_uncoalesced_route_is_limited(self):
+        responses = await asyncio.gather(*(self.client.get("/query/layouts/list") for _ in range(CONCURRENCY)))
+        codes = [response.status_code for response in responses]
+        self.assertEqual(codes.count(200), 1)
+        self.assertEqual(codes.count(503), CONCURRENCY - 1)
+        self.assertEqual(self.admission.routes["query:/layouts/list"].inflight, 0)
+
+    async def test_followers_retry_admission_when_leader_rejected(self):
+        route = self.admission.routes["query:/subject/{subject_id}/data"]
+        # 名额被占满：领头请求被拒绝，等待者各自经过准入控制，同样被拒绝
+        self.assertTrue(await route.acquire())
+        responses = await asyncio.gather(*(self.client.get("/query/subject/7/data") for _ in range(3)))
+        self.assertEqual([response.status_code for response in responses], [503] * 3)
+        self.assertEqual(route.rejected, 3)
+        route.release()
+        response = await self.client.get("/query/subject/7/data")
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# src/api/dependencies/migrations.py
+import logging
+from contextlib import contextmanager
+from sqlalchemy import inspect, text, update
+from api.dependencies.database import Base, SessionLocal
+from api.models import interest, rate_budget, tasks  # noqa: F401 注册所有表到 Base.metadata
+from api.models.tasks import RequestHistory
+from core.utils.keyword_hash import keywords_hash
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL advisory lock 的键，所有 collector 进程共用
+MIGRATION_LOCK_ID = 727001
+
+@contextmanager
+def _migration_lock(engine):
+    """多个进程同时启动时串行执行建表和升级；只有 PostgreSQL 加锁，其他数据库（如本地 SQLite）直接执行"""
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            conn.commit()
+
+def migrate(engine):
+    """建表并升级已有的表。由服务启动时（lifespan）调用，也可单独执行：python -m api.dependencies.migrations"""
+    with _migration_lock(engine):
+        Base.metadata.create_all(bind=engine)
+        upgrade_request_history(engine)
+
+def upgrade_request_history(engine, batch_size: int = 1000):
+    """
+    create_all 不会给已存在的表添加列：为 request_history 补充 keywords_hash 列及索引，
+    并分批为旧记录计算哈希。已完成升级时只做一次列检查和一次空查询。
+    应在 migrate 的锁内调用，避免多个进程同时执行 DDL。
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns(RequestHistory.__tablename__)}
+    if "keywords_hash" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {RequestHistory.__tablename__} ADD COLUMN keywords_hash VARCHAR(64)"))
+    for index in RequestHistory.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        total = 0
+        while True:
+            rows = db.query(RequestHistory.id, RequestHistory.keywords).filter(
+                RequestHistory.keywords_hash.is_(None)
+            ).limit(batch_size).all()
+            if not rows:
+                break
+            db.execute(update(RequestHistory), [
+                {"id": row.id, "keywords_hash": keywords_hash(row.keywords)} for row in rows
+            ])
+            db.commit()
+            total += len(rows)
+        if total:
+            logger.info(f"已为 {total} 条请求历史补充 keywords_hash")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    from api.dependencies.database import engine
+    logging.basicConfig(level=logging.INFO)
+    migrate(engine)
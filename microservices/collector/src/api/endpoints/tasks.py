@@ -1,12 +1,16 @@
 #src/api/endpoints/tasks.py
+import logging
 from datetime import datetime
-from typing import List, Optional
+from typing import Annotated, List, Optional
 from fastapi import APIRouter, Body, Depends, HTTPException, Path
 from sqlalchemy.orm import Session
 from core import scheduler_manager,aio_scheduler
+from core.jobs import has_stale_ranges
+from core.trends import rate_budget
 from api.dependencies.database import get_db
 from fastapi_events.dispatcher import dispatch
 from api.models.tasks import HistoricalTask, ScheduledTask
+from services.identity import Identity, get_identity
 from api.schemas.tasks import (
     HistoricalTaskRequest,
     ScheduledTaskRequest,
@@ -16,12 +20,20 @@ from api.schemas.tasks import (
 
 
 router = APIRouter(prefix="/tasks")
+logger = logging.getLogger(__name__)
+# 任务变更记录操作者，只需要身份断言中的用户名，未经网关的内部调用记为 internal
+Operator = Annotated[Optional[Identity], Depends(get_identity)]
+
+
+def operator_name(identity: Optional[Identity]) -> str:
+    return identity.sub if identity is not None else "internal"
 
 
 
 @router.post("/historical")
 async def create_historical_task(
     request: HistoricalTaskRequest, 
+    identity: Operator,
     db: Session = Depends(get_db)
 ):
     """提交历史数据采集任务"""
@@ -31,11 +43,13 @@ async def create_historical_task(
     db.commit()
     db.refresh(task)
     dispatch(event_name="historical_task_create",payload=task)
+    logger.info(f"{operator_name(identity)} 创建历史任务 {task.id}")
     return {"task_id": task.id}
 
 @router.post("/scheduled")
 async def create_scheduled_task(
     request: ScheduledTaskRequest,
+    identity: Operator,
     db: Session = Depends(get_db)
 ):
     """创建定时采集任务"""
@@ -47,7 +61,7 @@ async def create_scheduled_task(
     db.refresh(task)
     # 添加到调度器
     aio_scheduler.add_cron_job(task)
-    
+    logger.info(f"{operator_name(identity)} 创建定时任务 {task.id}")
     return {"task_id": task.id}
 
 @router.get("/historical", response_model=List[HistoricalTaskResponse])
@@ -64,6 +78,7 @@ def list_scheduled_tasks(db: Session = Depends(get_db)):
 @router.post("/historical/{task_id}/terminate",deprecated=True)
 def terminate_historical_task(
     task_id: int, 
+    identity: Operator,
     db: Session = Depends(get_db)
 ):
     task = db.query(HistoricalTask).get(task_id)
@@ -75,27 +90,31 @@ def terminate_historical_task(
         scheduler_manager.remove_job(f"historical_{task_id}")
         task.status = "failed"
         db.commit()
+        logger.info(f"{operator_name(identity)} 终止历史任务 {task_id}")
     
     return {"message": "任务已终止"}
 
 @router.post("/historical/{task_id}/retry")
 async def retry_historical_task(
     task_id: int, 
+    identity: Operator,
     db: Session = Depends(get_db)
 ):
     task = db.query(HistoricalTask).get(task_id)
     if not task:
         raise HTTPException(400, "任务不存在")
     
-    # 如果任务失败
-    if task.status == "failed":
+    # 如果任务失败，或有子任务的 worker 异常退出（心跳超时）
+    if task.status == "failed" or (task.status == "running" and has_stale_ranges(db, task_id)):
        dispatch(event_name="historical_task_create",payload=task)
+       logger.info(f"{operator_name(identity)} 重试历史任务 {task_id}")
     else:
         raise HTTPException(403, "操作不合法")
     return {"message": "任务已重新开始"}
 
 @router.post("/scheduled/{task_id}/toggle")
 def toggle_scheduled_task(
+    identity: Operator,
     task_id: int = Path(...),
     enabled: bool=Body(...),
     db: Session = Depends(get_db)
@@ -119,6 +138,7 @@ def toggle_scheduled_task(
     # 更新数据库状态
     task.enabled = enabled
     db.commit()
+    logger.info(f"{operator_name(identity)} {'启用' if enabled else '停用'}定时任务 {task_id}")
     return {"message": "状态已更新"}
 
 @router.get("/stats")
@@ -146,3 +166,8 @@ def get_task_stats(db: Session = Depends(get_db)):
             "enabled": enabled_scheduled_count
         }
     }
+
+@router.get("/rate-budget")
+def get_rate_budget():
+    """获取集群共享的 Trends 请求令牌桶指标（利用率、等待时间、429 次数）"""
+    return rate_budget.stats()
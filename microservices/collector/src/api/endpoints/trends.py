@@ -20,7 +20,7 @@ async def get_trends_by_region(
 ):
     """获取按地区划分的Google Trends数据"""
     try:
-        interest_ids = get_interest_by_region(
+        interest_ids = await get_interest_by_region(
             keywords=request.keywords,
             geo_code=request.geo_code,
             interval=request.interval,
@@ -59,7 +59,7 @@ async def get_trends_over_time(
 ):
     """获取随时间变化的Google Trends数据"""
     try:
-        interest_ids = get_interest_over_time(
+        interest_ids = await get_interest_over_time(
             keywords=request.keywords,
             geo_code=request.geo_code,
             interval=request.interval,
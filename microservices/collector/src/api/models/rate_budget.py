@@ -0,0 +1,16 @@
+#src/api/models/rate_budget.py
+from sqlalchemy import Column, Float, Integer, String
+from api.dependencies.database import Base
+
+
+class RateBudgetState(Base):
+    """集群共享的请求令牌桶状态，所有 collector worker 通过同一行记录协调请求速率"""
+    __tablename__ = "rate_budgets"
+    name = Column(String(50), primary_key=True)
+    tokens = Column(Float, nullable=False)            # 当前剩余令牌
+    refilled_at = Column(Float, nullable=False)       # 上次补充令牌的时间（Unix 时间戳）
+    paused_until = Column(Float, default=0)           # 收到 429 后整个集群暂停到该时间
+    acquired = Column(Integer, default=0)             # 累计发放的令牌数
+    wait_seconds = Column(Float, default=0)           # 累计等待令牌的时间（秒）
+    throttled = Column(Integer, default=0)            # 累计收到的 429 次数
+    created_at = Column(Float, nullable=False)
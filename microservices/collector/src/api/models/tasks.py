@@ -53,6 +53,7 @@ class RequestHistory(Base):
     id = Column(Integer, primary_key=True)
     job_type = Column(String(10)) # time or region
     keywords = Column(JSONB, nullable=False)       # 关键词
+    keywords_hash = Column(String(64))             # 关键词集合的哈希（core.utils.keyword_hash）
     geo_code = Column(String, nullable=False)      # 地区代码
     timeframe_start = Column(Date, nullable=False) # 时间范围起点
     timeframe_end = Column(Date, nullable=False)   # 时间范围终点
@@ -62,6 +63,26 @@ class RequestHistory(Base):
     # 唯一约束：确保同一请求参数不会重复记录
     __table_args__ = (
         UniqueConstraint("job_type", "geo_code", "timeframe_start", "timeframe_end","keywords"),
-        Index('idx_request_params', 'job_type', 'geo_code', 'timeframe_start')
+        Index('idx_request_params', 'job_type', 'geo_code', 'timeframe_start'),
+        Index('idx_request_keywords_hash', 'job_type', 'geo_code', 'keywords_hash', 'timeframe_start', 'timeframe_end')
     )
-    
\ No newline at end of file
+
+
+class HistoricalTaskRange(Base):
+    """历史任务按时间段拆分后的子任务，每个时间段单独发送一条 Dramatiq 消息，可并行执行、单独重试"""
+    __tablename__ = "historical_task_ranges"
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('historical_tasks.id'), nullable=False)
+    # 与 Trends API 的 timeframe 格式一致（region 任务精确到分钟）
+    timeframe_start = Column(String(20), nullable=False)
+    timeframe_end = Column(String(20), nullable=False)
+    status = Column(String(20), default="pending")  # pending/running/completed/failed
+    interest_id = Column(Integer)
+    attempts = Column(Integer, default=0)
+    error = Column(String)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    __table_args__ = (
+        UniqueConstraint("task_id", "timeframe_start", "timeframe_end"),
+        Index('idx_task_range_status', 'task_id', 'status')
+    )
+
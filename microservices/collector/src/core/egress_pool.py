@@ -0,0 +1,102 @@
+#src/core/egress_pool.py
+import asyncio
+import logging
+import time
+from typing import Callable, List, Optional
+from requests import HTTPError, RequestException
+from trendspy import Trends
+
+logger = logging.getLogger('DramatiqTasks')
+
+
+class EgressEntry:
+    """一个出口（代理或直连），持有独立的 Trends 会话（cookie 状态互不影响）"""
+    def __init__(self, proxy: Optional[str], delay: float):
+        self.proxy = proxy
+        # 请求间隔由连接池控制，trendspy 自身不再限速
+        self.trends = Trends(request_delay=0, proxy=proxy)
+        self.delay = delay
+        self.health = 1.0
+        self.failures = 0
+        self.in_use = False
+        self.next_available = 0.0
+        self.quarantined_until = 0.0
+
+    @property
+    def name(self) -> str:
+        return self.proxy or "direct"
+
+
+class EgressPool:
+    """
+    出口连接池。每个出口各自按 AIMD 调整请求间隔：成功时间隔减少 delay_step（速率加性增加），
+    429 时间隔翻倍（速率乘性减少）；健康度为成功率的指数移动平均。
+    请求调度到当前可用且健康度最高的出口，同一出口同一时间只执行一个请求；
+    连续失败 quarantine_failures 次的出口隔离 quarantine_seconds 秒。
+    clock 为计时函数（默认 time.monotonic），测试中可替换为手动推进的时钟。
+    """
+    def __init__(self, proxies: List[Optional[str]], delay: float, min_delay: float = 1, max_delay: float = 120,
+                 delay_step: float = 1, quarantine_failures: int = 3, quarantine_seconds: float = 600,
+                 clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay_step = delay_step
+        self.quarantine_failures = quarantine_failures
+        self.quarantine_seconds = quarantine_seconds
+        self.entries = [EgressEntry(proxy, min(max(delay, min_delay), max_delay)) for proxy in proxies or [None]]
+        self._released = asyncio.Event()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _select(self, now: float) -> Optional[EgressEntry]:
+        ready = [
+            entry for entry in self.entries
+            if not entry.in_use and entry.quarantined_until <= now and entry.next_available <= now
+        ]
+        return max(ready, key=lambda entry: entry.health) if ready else None
+
+    def _next_ready_at(self, now: float) -> float:
+        idle = [entry for entry in self.entries if not entry.in_use]
+        if not idle:
+            return now + self.max_delay
+        return min(max(entry.next_available, entry.quarantined_until) for entry in idle)
+
+    async def acquire(self) -> EgressEntry:
+        """等待直到有可用的出口"""
+        while True:
+            now = self.clock()
+            entry = self._select(now)
+            if entry:
+                entry.in_use = True
+                return entry
+            # 等到最早可用的出口就绪，或其他请求释放出口
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), timeout=max(self._next_ready_at(now) - now, 0.01))
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, entry: EgressEntry, error: Optional[BaseException] = None, retry_after: float = 0):
+        """
+        请求结束后更新出口状态。只有网络异常和 HTTP 错误计入出口的失败，
+        其他异常（如参数或数据解析错误）与出口无关，不影响健康度。
+        """
+        now = self.clock()
+        if error is None:
+            entry.failures = 0
+            entry.health = entry.health * 0.8 + 0.2
+            entry.delay = max(self.min_delay, entry.delay - self.delay_step)
+        elif isinstance(error, RequestException):
+            entry.failures += 1
+            entry.health = entry.health * 0.8
+            if isinstance(error, HTTPError) and error.response is not None and error.response.status_code == 429:
+                entry.delay = min(self.max_delay, entry.delay * 2)
+            if entry.failures >= self.quarantine_failures:
+                entry.quarantined_until = now + self.quarantine_seconds
+                entry.failures = 0
+                logger.warning(f"出口 {entry.name} 连续失败 {self.quarantine_failures} 次，隔离 {self.quarantine_seconds} 秒")
+        entry.next_available = now + max(entry.delay, retry_after)
+        entry.in_use = False
+        self._released.set()
@@ -1,11 +1,12 @@
 # src/core/jobs.py
+import asyncio
 from datetime import datetime, timedelta
 import json
-from sqlalchemy import inspect
+from sqlalchemy import and_, exists, or_
 import dramatiq
 from api.dependencies.database import get_db
-from api.models.tasks import HistoricalTask, ScheduledTask
-from core.trends import get_interest_by_region, get_interest_over_time
+from api.models.tasks import HistoricalTask, HistoricalTaskRange
+from core.trends import ANCHORED_JOB_TYPE, anchored_keywords, fetch_range, fetch_time_batch, find_completed_ranges, split_task_ranges
 import dramatiq
 from dramatiq.brokers.rabbitmq import RabbitmqBroker
 from config import get_settings
@@ -36,66 +37,286 @@ rabbitmq_broker = RabbitmqBroker(
 dramatiq.set_broker(rabbitmq_broker)
 
 
-def execute_task(job_type, keywords, geo_code, interval, start_date, end_date,task_id):
-    """通用任务执行函数"""
-    # 根据任务类型调用对应的趋势函数
-    logger.info("开始采集数据")
-    if job_type == "region":
-        last_id= get_interest_by_region(keywords, geo_code, interval, start_date, end_date,task_id)
-    elif job_type == "time":
-        last_id= get_interest_over_time(keywords, geo_code, interval, start_date, end_date,task_id)
-    else:
-        raise ValueError(f"无效的任务类型: {job_type}")
-    logger.info("采集数据结束")
-    return last_id
+def _normalize_geo(geo_code):
+    return "" if geo_code == "World" else geo_code
+
 @dramatiq.actor(retry_when=lambda x,y: True)
 async def execute_historical_task(job_type, keywords, geo_code, interval, start_date, end_date,id,**kwargs):
-    """执行历史数据采集任务"""
-   
+    """
+    拆分历史数据采集任务：按时间段创建子任务记录，每个未完成的时间段发送一条 execute_range_task 消息。
+    子任务在多个 worker 上并行执行、单独重试，最后一个完成的子任务负责汇总并通知 query 服务。
+    重新执行失败的任务时，已完成的时间段不会重复采集；心跳超时的 running 时间段（worker 异常退出）重新采集。
+    """
+    db = next(get_db())
     try:
+        db_task = db.query(HistoricalTask).get(id)
+        if not db_task:
+            return
         # 更新状态为running
-        db = next(get_db())
+        db_task.status = "running"
+        ranges = {
+            (task_range.timeframe_start, task_range.timeframe_end): task_range
+            for task_range in db.query(HistoricalTaskRange).filter(HistoricalTaskRange.task_id == id)
+        }
+        split = split_task_ranges(job_type, start_date, end_date, interval)
+        # 一次查询请求历史，其他任务已采集过的时间段直接标记为完成
+        if _packable(db_task):
+            # 打包采集的任务只复用打包采集的结果
+            completed = find_completed_ranges(
+                db, ANCHORED_JOB_TYPE, anchored_keywords(keywords[0], settings.keyword_pack_anchor),
+                _normalize_geo(geo_code), split
+            )
+        else:
+            completed = find_completed_ranges(db, job_type, keywords, _normalize_geo(geo_code), split)
+        for start, end in split:
+            task_range = ranges.get((start, end))
+            if task_range is None:
+                task_range = ranges[(start, end)] = HistoricalTaskRange(
+                    task_id=id, timeframe_start=start, timeframe_end=end, status="pending"
+                )
+                db.add(task_range)
+            elif not _restartable(task_range):
+                continue
+            if (start, end) in completed:
+                task_range.status = "completed"
+                task_range.interest_id = completed[(start, end)]
+            else:
+                task_range.status = "pending"
+        db.commit()
+        pending = [task_range.id for task_range in ranges.values() if task_range.status == "pending"]
+    except Exception as e:
+        db.rollback()
         db_task = db.query(HistoricalTask).get(id)
         if db_task:
-            db_task.status = "running"
+            db_task.status = "failed"
             db.commit()
-            db.close()
-        if geo_code=="World":
-            geo_code=""
-        # 执行任务
-        interest_id=execute_task(
-            job_type, keywords, geo_code, 
-            interval, start_date, end_date,
-            id
+        raise e
+    finally:
+        db.close()
+
+    logger.info(f"任务 {id} 拆分为 {len(ranges)} 个时间段，待采集 {len(pending)} 个")
+    for range_id in pending:
+        execute_range_task.send(range_id)
+    # 没有待采集的时间段（如全部已完成）时直接汇总
+    await finish_historical_task(id)
+
+def _stale_before() -> datetime:
+    """running 子任务的心跳（updated_at）早于该时间视为 worker 已异常退出"""
+    return datetime.now() - timedelta(seconds=settings.range_stale_timeout)
+
+def _restartable(task_range) -> bool:
+    return task_range.status == "failed" or \
+        (task_range.status == "running" and task_range.updated_at < _stale_before())
+
+def has_stale_ranges(db, task_id) -> bool:
+    """任务是否有心跳超时的 running 子任务，供重试接口判断 running 状态的任务是否允许重试"""
+    return db.query(exists().where(
+        HistoricalTaskRange.task_id == task_id,
+        HistoricalTaskRange.status == "running",
+        HistoricalTaskRange.updated_at < _stale_before()
+    )).scalar()
+
+def _claim_range(db, range_id) -> bool:
+    """把子任务标记为 running，已在执行或已完成的子任务返回 False；心跳超时的 running 子任务允许重新领取"""
+    stale = _stale_before()
+    updated = db.query(HistoricalTaskRange).filter(
+        HistoricalTaskRange.id == range_id,
+        or_(
+            HistoricalTaskRange.status.in_(("pending", "failed")),
+            and_(HistoricalTaskRange.status == "running", HistoricalTaskRange.updated_at < stale)
         )
-        
-        # 更新状态为completed
-        db_task = db.query(HistoricalTask).get(id)
-        if db_task:
-            db_task.status = "completed"
-            db.commit()
-            kwargs={
-                        "task_id": db_task.schedule_id if db_task.schedule_id else db_task.id,
-                        "interest_type": db_task.job_type,
-                        "type": "realtime" if db_task.schedule_id else "historical",
-                        "interest_id":interest_id
-                    }
-            db.close()
-            await handle_finish_tasks(kwargs)
-            
-            
+    ).update({
+        "status": "running",
+        "attempts": HistoricalTaskRange.attempts + 1,
+        "updated_at": datetime.now()
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+def _update_range(range_id, **values):
+    db = next(get_db())
+    try:
+        db.query(HistoricalTaskRange).filter(HistoricalTaskRange.id == range_id).update(
+            values, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+async def _heartbeat(range_ids):
+    """采集期间定期更新 running 子任务的 updated_at，避免等待令牌等耗时较长的采集被误判为超时"""
+    while True:
+        await asyncio.sleep(settings.range_stale_timeout / 3)
+        await asyncio.to_thread(_touch_ranges, range_ids)
+
+def _touch_ranges(range_ids):
+    db = next(get_db())
+    try:
+        db.query(HistoricalTaskRange).filter(
+            HistoricalTaskRange.id.in_(range_ids), HistoricalTaskRange.status == "running"
+        ).update({"updated_at": datetime.now()}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def _packable(db_task) -> bool:
+    anchor = settings.keyword_pack_anchor
+    return bool(anchor) and settings.keyword_pack_size > 1 and db_task.job_type == "time" \
+        and len(db_task.keywords) == 1 and db_task.keywords[0] != anchor
+
+def _claim_partners(db, db_task, task_range) -> list:
+    """领取同一地区、同一时间段的其他待执行单关键词 time 子任务，返回 (子任务ID, 任务ID, 关键词) 列表"""
+    keywords = {db_task.keywords[0], settings.keyword_pack_anchor}
+    candidates = db.query(HistoricalTaskRange.id, HistoricalTask.id, HistoricalTask.keywords).join(
+        HistoricalTask, HistoricalTask.id == HistoricalTaskRange.task_id
+    ).filter(
+        HistoricalTask.job_type == "time",
+        HistoricalTask.geo_code == db_task.geo_code,
+        HistoricalTaskRange.timeframe_start == task_range.timeframe_start,
+        HistoricalTaskRange.timeframe_end == task_range.timeframe_end,
+        HistoricalTaskRange.status == "pending",
+        HistoricalTaskRange.id != task_range.id
+    ).limit(settings.keyword_pack_size * 4).all()
+    partners = []
+    for partner_id, partner_task_id, partner_keywords in candidates:
+        # 锚点和当前关键词各占一个位置
+        if len(partners) >= settings.keyword_pack_size - 2:
+            break
+        if len(partner_keywords) != 1 or partner_keywords[0] in keywords:
+            continue
+        if _claim_range(db, partner_id):
+            keywords.add(partner_keywords[0])
+            partners.append((partner_id, partner_task_id, partner_keywords[0]))
+    return partners
+
+@dramatiq.actor(on_retry_exhausted="on_range_task_exhausted")
+async def execute_range_task(range_id):
+    """
+    采集历史任务的一个时间段，失败时只重试该时间段。
+    配置了锚点关键词时，单关键词 time 子任务会领取其他可合并的子任务，用一个请求一起采集。
+    """
+    db = next(get_db())
+    try:
+        claimed = _claim_range(db, range_id)
+        task_range = db.query(HistoricalTaskRange).get(range_id)
+        if task_range is None:
+            return
+        task_id = task_range.task_id
+        if not claimed:
+            logger.info(f"时间段 {range_id} 状态为 {task_range.status}，跳过")
+            if task_range.status == "completed":
+                # 上一次执行已完成采集但汇总失败时，由重试的消息再次尝试汇总
+                await finish_historical_task(task_id)
+            # running 且未被领取说明领取者的心跳未超时（超时的已在 _claim_range 中重新领取），丢弃该消息；
+            # worker 异常退出后心跳超时的时间段由重试接口或重新规划任务时重置，不在这里延迟重发
+            return
+        db_task = db.query(HistoricalTask).get(task_id)
+        geo_code = _normalize_geo(db_task.geo_code)
+        start, end = task_range.timeframe_start, task_range.timeframe_end
+        if _packable(db_task):
+            batch = [(range_id, task_id, db_task.keywords[0])] + _claim_partners(db, db_task, task_range)
+        else:
+            batch = [(range_id, task_id, None)]
+            params = (db_task.job_type, db_task.keywords, geo_code, start, end, task_id)
+    finally:
+        db.close()
+
+    heartbeat = asyncio.create_task(_heartbeat([batch_range_id for batch_range_id, _, _ in batch]))
+    try:
+        if batch[0][2] is not None:
+            if len(batch) > 1:
+                logger.info(f"时间段 {start} ~ {end} 合并采集 {len(batch)} 个关键词")
+            interest_ids = await fetch_time_batch(
+                settings.keyword_pack_anchor, [(keyword, tid) for _, tid, keyword in batch], geo_code, start, end
+            )
+        else:
+            interest_ids = [await fetch_range(*params)]
     except Exception as e:
-        # 更新状态为failed
+        # 放回 pending 等待 Dramatiq 重试，重试次数用尽后由 on_range_task_exhausted 标记失败
+        _update_range(range_id, status="pending", error=str(e)[:500])
+        # 合并领取的子任务自己的消息可能已被跳过，重新发送
+        for partner_id, _, _ in batch[1:]:
+            _update_range(partner_id, status="pending", error=str(e)[:500])
+            execute_range_task.send(partner_id)
+        raise
+    finally:
+        heartbeat.cancel()
+    for (batch_range_id, _, _), interest_id in zip(batch, interest_ids):
+        _update_range(batch_range_id, status="completed", interest_id=interest_id, error=None)
+    for partner_id, partner_task_id, _ in batch[1:]:
+        try:
+            await finish_historical_task(partner_task_id)
+        except Exception as e:
+            # 由该子任务的新消息重试汇总
+            logger.error(f"任务 {partner_task_id} 汇总失败: {str(e)}")
+            execute_range_task.send(partner_id)
+    await finish_historical_task(task_id)
+
+@dramatiq.actor
+def on_range_task_exhausted(message_data, retry_info):
+    """子任务重试次数用尽：时间段和所属任务都标记为 failed，可通过重试接口重新执行未完成的时间段"""
+    range_id = message_data["args"][0]
+    db = next(get_db())
+    try:
+        task_range = db.query(HistoricalTaskRange).get(range_id)
+        if task_range is None:
+            return
+        task_range.status = "failed"
+        db.query(HistoricalTask).filter(HistoricalTask.id == task_range.task_id).update(
+            {"status": "failed"}, synchronize_session=False
+        )
+        db.commit()
+        logger.error(f"任务 {task_range.task_id} 的时间段 {task_range.timeframe_start} ~ {task_range.timeframe_end} 重试 {retry_info.get('retries')} 次后失败")
+    finally:
         db.close()
-        db = next(get_db())
-        db_task = db.query(HistoricalTask).get(id)
-        if db_task:
-            db_task.status = "failed"
-            db.commit()
-        raise e  # 重新抛出异常以便APScheduler记录日志
+
+async def finish_historical_task(task_id):
+    """
+    所有时间段都完成后把任务标记为 completed 并通知 query 服务。
+    使用条件更新（状态为 running 且没有未完成的时间段），并发完成最后几个时间段时只有一个 worker 执行汇总。
+    """
+    db = next(get_db())
+    try:
+        unfinished = exists().where(
+            HistoricalTaskRange.task_id == task_id,
+            HistoricalTaskRange.status != "completed"
+        )
+        updated = db.query(HistoricalTask).filter(
+            HistoricalTask.id == task_id,
+            HistoricalTask.status == "running",
+            ~unfinished
+        ).update({"status": "completed"}, synchronize_session=False)
+        db.commit()
+        if updated != 1:
+            return
+        db_task = db.query(HistoricalTask).get(task_id)
+        interest_id = [
+            row.interest_id for row in db.query(HistoricalTaskRange.interest_id)
+            .filter(HistoricalTaskRange.task_id == task_id)
+            .order_by(HistoricalTaskRange.timeframe_start)
+        ]
+        kwargs={
+                    "task_id": db_task.schedule_id if db_task.schedule_id else db_task.id,
+                    "interest_type": db_task.job_type,
+                    "type": "realtime" if db_task.schedule_id else "historical",
+                    "interest_id":interest_id
+                }
     finally:
         db.close()
-        
+    try:
+        await handle_finish_tasks(kwargs)
+    except Exception:
+        # 通知失败时恢复为 running，重试时重新汇总
+        db = next(get_db())
+        try:
+            db.query(HistoricalTask).filter(HistoricalTask.id == task_id).update(
+                {"status": "running"}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+        raise
+
 @dramatiq.actor(retry_when=lambda x: True)
 def execute_scheduled_task(job_type, keywords, geo_code, interval, start_date, id,**kwargs):
     """执行定时数据采集任务并生成历史任务记录"""
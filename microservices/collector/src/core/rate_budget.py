@@ -0,0 +1,134 @@
+#src/core/rate_budget.py
+import asyncio
+import logging
+import random
+import time
+from sqlalchemy.exc import IntegrityError
+from api.dependencies.database import SessionLocal
+from api.models.rate_budget import RateBudgetState
+
+logger = logging.getLogger('DramatiqTasks')
+
+
+class RateBudget:
+    """
+    集群共享的令牌桶。状态保存在数据库的一行记录中（SELECT ... FOR UPDATE 加锁），
+    所有 collector worker 进程共用同一个请求速率：每秒补充 rate 个令牌，最多积累 burst 个。
+    收到 429 时调用 pause，整个集群在 Retry-After 时间内都不再发放令牌。
+    rate <= 0 时不限速，pause 退化为只在当前协程中等待。
+    """
+    def __init__(self, name: str, rate: float, burst: float = 1, max_wait: float = 5):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        # 单次等待的上限，等待结束后重新检查（暂停可能被延长，也可能被其他 worker 抢到令牌）
+        self.max_wait = max_wait
+
+    def _load(self, db, now: float) -> RateBudgetState:
+        """加锁读取令牌桶状态，不存在时创建，并按经过的时间补充令牌"""
+        state = db.query(RateBudgetState).filter(RateBudgetState.name == self.name).with_for_update().first()
+        if state is None:
+            try:
+                state = RateBudgetState(
+                    name=self.name, tokens=self.burst, refilled_at=now, paused_until=0,
+                    acquired=0, wait_seconds=0, throttled=0, created_at=now
+                )
+                db.add(state)
+                db.flush()
+            except IntegrityError:
+                # 其他 worker 同时创建了该记录
+                db.rollback()
+                state = db.query(RateBudgetState).filter(RateBudgetState.name == self.name).with_for_update().one()
+        # 暂停期间 refilled_at 被推迟到暂停结束，不会积累令牌
+        state.tokens = min(self.burst, state.tokens + max(0, now - state.refilled_at) * self.rate)
+        state.refilled_at = max(state.refilled_at, now)
+        return state
+
+    def _take(self, waited: float) -> float:
+        """尝试取一个令牌，成功返回 0，否则返回建议等待的秒数"""
+        db = SessionLocal()
+        try:
+            now = time.time()
+            state = self._load(db, now)
+            if state.paused_until > now:
+                wait = state.paused_until - now
+            elif state.tokens >= 1:
+                state.tokens -= 1
+                state.acquired += 1
+                state.wait_seconds += waited
+                wait = 0
+            else:
+                wait = (1 - state.tokens) / self.rate
+            db.commit()
+            return wait
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _pause(self, seconds: float):
+        db = SessionLocal()
+        try:
+            now = time.time()
+            state = self._load(db, now)
+            state.paused_until = max(state.paused_until, now + seconds)
+            state.refilled_at = state.paused_until
+            state.tokens = 0
+            state.throttled += 1
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def acquire(self) -> float:
+        """等待直到取得一个令牌，返回等待的秒数"""
+        if self.rate <= 0:
+            return 0
+        waited = 0.0
+        while True:
+            wait = await asyncio.to_thread(self._take, waited)
+            if wait <= 0:
+                if waited:
+                    logger.info(f"等待请求令牌 {waited:.1f} 秒")
+                return waited
+            # 加少量随机抖动，避免多个 worker 同时醒来争抢同一个令牌
+            wait = min(wait, self.max_wait) + random.uniform(0, 0.1)
+            await asyncio.sleep(wait)
+            waited += wait
+
+    async def pause(self, seconds: float):
+        """收到 429 后暂停整个集群的请求"""
+        if self.rate <= 0:
+            await asyncio.sleep(seconds)
+            return
+        await asyncio.to_thread(self._pause, seconds)
+
+    def stats(self) -> dict:
+        """令牌桶指标：利用率为创建以来发放的令牌数占可发放令牌总数的比例"""
+        if self.rate <= 0:
+            return {"enabled": False}
+        db = SessionLocal()
+        try:
+            state = db.query(RateBudgetState).filter(RateBudgetState.name == self.name).first()
+            if state is None:
+                return {"enabled": True, "rate": self.rate, "burst": self.burst, "acquired": 0}
+            now = time.time()
+            tokens = min(self.burst, state.tokens + max(0, now - state.refilled_at) * self.rate)
+            capacity = self.burst + max(0, now - state.created_at) * self.rate
+            return {
+                "enabled": True,
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(tokens, 2),
+                "paused_for": round(max(0, state.paused_until - now), 1),
+                "acquired": state.acquired,
+                "throttled": state.throttled,
+                "utilization": round(state.acquired / capacity, 4),
+                "wait_seconds": round(state.wait_seconds, 1),
+                "avg_wait_seconds": round(state.wait_seconds / state.acquired, 2) if state.acquired else 0
+            }
+        finally:
+            db.close()
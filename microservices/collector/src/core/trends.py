@@ -1,204 +1,379 @@
 #src/core/trends.py
-from datetime import datetime
-import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import partial
 from requests import HTTPError
-from sqlalchemy import JSON, cast
 from sqlalchemy.exc import IntegrityError
-from trendspy import Trends
 from api.dependencies.database import get_db
 from api.models.interest import RegionInterest, TimeInterest
 from config import get_settings
+from core.utils.keyword_hash import keywords_hash
 from core.utils.time_splitter import split_time_ranges
+from core.utils.time_window import canonical_cell, cut_time_window, window_peak
 from api.models.tasks import RequestHistory
 from core.TrendsDataConverter import TrendsDataConverter
-from sqlalchemy.dialects.postgresql import JSONB
+from core.egress_pool import EgressPool
+from core.rate_budget import RateBudget
 
 import logging
 # 创建一个专用的日志记录器
 logger = logging.getLogger('DramatiqTasks')
 
-def _call_trends_api_with_retry(api_call_func, max_retries=3,**kwargs):
-    """封装API调用，包含速率限制处理和重试机制"""
+async def _call_trends_api_with_retry(method: str, max_retries=3,**kwargs):
+    """
+    封装API调用，包含速率限制处理和重试机制。
+    每次调用前从集群共享的令牌桶取令牌，再从出口连接池取一个出口，用该出口的 Trends 会话执行 method。
+    trendspy 是同步客户端，调用放到专用线程池中执行，不阻塞 worker 的事件循环；
+    协程被取消时立即退出，线程中正在进行的请求结束后才释放出口，结果被丢弃。
+    429 时按 Retry-After 暂停该出口；只有一个出口时暂停整个集群。
+    """
+    loop = asyncio.get_running_loop()
     retries = 0
     while retries < max_retries:
+        await rate_budget.acquire()
+        entry = await egress_pool.acquire()
+        future = loop.run_in_executor(_fetch_executor, partial(getattr(entry.trends, method), **kwargs))
+        future.add_done_callback(partial(_release_egress, entry))
         try:    
-            response = api_call_func(**kwargs)
+            response = await asyncio.shield(future)
             logger.info(
-                f"Data fetch successful for API function: {api_call_func.__name__}, "
+                f"Data fetch successful for API function: {method}, "
                 f"with parameters - Keywords: {kwargs.get('keywords')}, "
                 f"Timeframe: {kwargs.get('timeframe')}, "
-                f"Geo: {kwargs.get('geo','World')}"
+                f"Geo: {kwargs.get('geo','World')}, "
+                f"Egress: {entry.name}"
             )
             return response
         except HTTPError as e:
             if e.response.status_code == 429:  # 速率限制错误
-                retry_after = int(e.response.headers.get('Retry-After', 60))  # 默认等待60秒
-                logger.warning(f"Rate limited. Retrying after {retry_after} seconds...")
-                time.sleep(retry_after)
+                retry_after = _retry_after(e)
+                if len(egress_pool) == 1:
+                    logger.warning(f"Rate limited. Pausing all workers for {retry_after:.0f} seconds...")
+                    await rate_budget.pause(retry_after)
+                else:
+                    logger.warning(f"Rate limited on {entry.name}. Pausing it for {retry_after:.0f} seconds...")
                 retries += 1
             else:
                 raise
     
     raise Exception("Max retries exceeded for API call")
 
+def _retry_after(error: HTTPError, default: float = 60) -> float:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），缺失或无法解析时默认等待60秒"""
+    value = error.response.headers.get('Retry-After') if error.response is not None else None
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def _release_egress(entry, future):
+    """线程中的请求结束后释放出口，并按结果调整出口的请求间隔和健康度；无论结果如何都会释放出口"""
+    error, retry_after = None, 0
+    try:
+        error = None if future.cancelled() else future.exception()
+        if isinstance(error, HTTPError) and error.response is not None and error.response.status_code == 429:
+            retry_after = _retry_after(error)
+    finally:
+        egress_pool.release(entry, error, retry_after=retry_after)
+
 settings = get_settings()
-trends=Trends(
-        request_delay=settings.request_delay,
-    )
-# print(settings.proxy)
-# trends.session.proxies.update({
-#             'http': settings.proxy,
-#             'https': settings.proxy
-#         })
-def get_interest_by_region(keywords: list[str], geo_code: str, interval: str, start_date: str, end_date: str,task_id:int):
-    db=next(get_db())
-    time_ranges = split_time_ranges(start_date, end_date, interval,'%Y-%m-%dT%H:%M')
-    
-    interest_id=[]
-    for start, end in time_ranges:
-        # 检查请求历史表判断是否已处理
-        timeframe_start = start
-        timeframe_end = end
-        
-        # 查询请求历史表
-        history = db.query(RequestHistory).filter(
-            RequestHistory.job_type == "region",
-            RequestHistory.keywords == cast(keywords,JSONB),
-            RequestHistory.geo_code == geo_code,
-            RequestHistory.timeframe_start == timeframe_start,
-            RequestHistory.timeframe_end == timeframe_end
-        ).first()
-        
-        if history and history.status=="success":
-            interest_id.append(history.interest_id)
-            continue  # 跳过已处理的请求
-        elif not history:
-            try:
-                history = RequestHistory(
-                        job_type = "region",
-                        keywords=keywords,
-                        geo_code=geo_code,
-                        timeframe_start=timeframe_start,
-                        timeframe_end=timeframe_end,
-                        )
-                db.add(history)
-                db.commit()
-            except IntegrityError as e:
-                db.rollback()
-                logger.error(f"数据已存在或冲突: {str(e)}")
-                raise 
-        try:
-            # 调用API获取数据
-            timeframe = f"{start} {end}"
-            region_data = _call_trends_api_with_retry(
-                trends.interest_by_region, max_retries=3,keywords=keywords,geo=geo_code, 
-                timeframe=timeframe,resolution='COUNTRY', inc_low_vol=True,return_raw=False
+# 出口连接池：proxy 配置为逗号分隔的代理列表，为空时直连
+egress_pool = EgressPool(
+    [proxy.strip() for proxy in settings.proxy.split(",") if proxy.strip()],
+    delay=settings.request_delay,
+    min_delay=settings.egress_min_delay,
+    max_delay=settings.egress_max_delay,
+    quarantine_failures=settings.egress_quarantine_failures,
+    quarantine_seconds=settings.egress_quarantine_seconds
+)
+# 所有 collector worker 共享的 Trends 请求速率，随出口数量等比放大
+rate_budget = RateBudget(
+    "trends", settings.trends_rate_limit * len(egress_pool), settings.trends_rate_burst * len(egress_pool)
+)
+# 执行同步 Trends 请求的线程池，大小即单个 worker 进程同时进行的 Trends 请求数
+_fetch_executor = ThreadPoolExecutor(max_workers=settings.trends_fetch_workers, thread_name_prefix="trends-fetch")
+def split_task_ranges(job_type: str, start_date: str, end_date: str, interval: str) -> list:
+    """按任务类型切分时间段：region 任务的 timeframe 精确到分钟，time 任务按天"""
+    if job_type == "region":
+        return split_time_ranges(start_date, end_date, interval, '%Y-%m-%dT%H:%M')
+    return split_time_ranges(start_date, end_date, interval)
+
+def _get_or_create_history(db, job_type: str, keywords: list[str], geo_code: str, timeframe_start: str, timeframe_end: str):
+    """查询请求历史表，不存在时创建一条记录"""
+    history = db.query(RequestHistory).filter(
+        RequestHistory.job_type == job_type,
+        RequestHistory.geo_code == geo_code,
+        RequestHistory.keywords_hash == keywords_hash(keywords),
+        RequestHistory.timeframe_start == timeframe_start,
+        RequestHistory.timeframe_end == timeframe_end
+    ).first()
+    if history:
+        return history
+    try:
+        history = RequestHistory(
+                job_type=job_type,
+                keywords=keywords,
+                keywords_hash=keywords_hash(keywords),
+                geo_code=geo_code,
+                timeframe_start=timeframe_start,
+                timeframe_end=timeframe_end,
+                )
+        db.add(history)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        logger.error(f"数据已存在或冲突: {str(e)}")
+        raise
+    return history
+
+def _range_key(timeframe_start, timeframe_end) -> tuple:
+    # request_history 的时间段为 Date 列，按日期部分匹配
+    return str(timeframe_start)[:10], str(timeframe_end)[:10]
+
+def find_completed_ranges(db, job_type: str, keywords: list[str], geo_code: str, ranges: list) -> dict:
+    """
+    一次索引查询找出已成功采集过的时间段，返回 {(start, end): interest_id}，
+    调用方只需要采集不在结果中的时间段。
+    """
+    if not ranges:
+        return {}
+    starts = {start for start, _ in ranges}
+    rows = db.query(RequestHistory.timeframe_start, RequestHistory.timeframe_end, RequestHistory.interest_id).filter(
+        RequestHistory.job_type == job_type,
+        RequestHistory.geo_code == geo_code,
+        RequestHistory.keywords_hash == keywords_hash(keywords),
+        RequestHistory.timeframe_start.between(min(starts), max(starts)),
+        RequestHistory.status == "success"
+    ).all()
+    completed = {_range_key(row.timeframe_start, row.timeframe_end): row.interest_id for row in rows}
+    return {
+        (start, end): completed[_range_key(start, end)]
+        for start, end in ranges if _range_key(start, end) in completed
+    }
+
+def _save_interest(db, history, record) -> int:
+    """保存采集结果并标记请求历史为成功，失败时标记为 failed 后重新抛出异常"""
+    try:
+        db.add(record)
+        db.flush()
+        # 记录请求历史
+        history.status = "success"
+        history.interest_id = record.id
+        db.commit()
+        return record.id
+    except Exception as e:
+        db.rollback()
+        logger.error(f"数据已存在或冲突: {str(e)}" if isinstance(e, IntegrityError) else f"Error: {str(e)}")
+        history.status = "failed"
+        db.commit()
+        raise
+
+async def fetch_region_range(db, keywords: list[str], geo_code: str, start: str, end: str, task_id) -> int:
+    """采集一个时间段的地区兴趣数据，已成功采集过的直接返回已有记录ID"""
+    history = _get_or_create_history(db, "region", keywords, geo_code, start, end)
+    if history.status == "success":
+        return history.interest_id  # 跳过已处理的请求
+    try:
+        # 调用API获取数据
+        region_data = await _call_trends_api_with_retry(
+            "interest_by_region", max_retries=3,keywords=keywords,geo=geo_code,
+            timeframe=f"{start} {end}",resolution='COUNTRY', inc_low_vol=True,return_raw=False
+        )
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        history.status = "failed"
+        db.commit()
+        raise
+    record = RegionInterest(
+                keywords=keywords,
+                geo_code=geo_code,
+                timeframe_start=start,
+                timeframe_end=end,
+                data=region_data.to_json(orient="records"),
+                task_id=task_id
             )
+    return _save_interest(db, history, record)
 
-            record = RegionInterest(
-                        keywords=keywords,
-                        geo_code=geo_code,
-                        timeframe_start=timeframe_start,
-                        timeframe_end=timeframe_end,
-                        data=region_data.to_json(orient="records"),
-                        task_id=task_id
-                    )   
-            db.add(record)
-                
-            # 记录请求历史
-            history.status="success"
-            history.interest_id=record.id
-            db.commit()
-            db.refresh(record)
-            interest_id.append(record.id)
-        except IntegrityError as e:
-            db.rollback()
-            logger.error(f"数据已存在或冲突: {str(e)}")
-            history.status="failed"
-            db.commit()
-            raise
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Error: {str(e)}")
-            history.status="failed"
-            db.commit()
-            raise
-    return interest_id
+async def fetch_time_range(db, keywords: list[str], geo_code: str, start: str, end: str, task_id) -> int:
+    """采集一个时间段的时间兴趣数据，已成功采集过的直接返回已有记录ID"""
+    history = _get_or_create_history(db, "time", keywords, geo_code, start, end)
+    if history.status == "success":
+        return history.interest_id  # 跳过已处理的请求
+    try:
+        # 调用API获取数据
+        token,time_data = await _call_trends_api_with_retry(
+            "interest_over_time", max_retries=3, keywords=keywords, geo=geo_code,
+            timeframe=f"{start} {end}",return_raw=True
+        )
+        time_data=TrendsDataConverter.interest_over_time(time_data,keywords=keywords)
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        history.status = "failed"
+        db.commit()
+        raise
+    record = TimeInterest(
+                keywords=keywords,
+                geo_code=geo_code,
+                timeframe_start=start,
+                timeframe_end=end,
+                data=time_data.reset_index().to_json(orient="records"),
+                task_id=task_id
+            )
+    return _save_interest(db, history, record)
+
+# 正在采集的规范时间格，同一进程内对同一时间格的并发请求共享一次采集
+_inflight_cells: dict = {}
 
-def get_interest_over_time(keywords: list[str], geo_code: str, interval: str, start_date: str, end_date: str,task_id: int):
+async def _fetch_time_cell(keywords: list[str], geo_code: str, start: str, end: str) -> int:
     db = next(get_db())
-    time_ranges = split_time_ranges(start_date, end_date, interval)
-    interest_id=[]
-    for start, end in time_ranges:
-        # 检查请求历史表判断是否已处理
-        timeframe_start = start
-        timeframe_end = end
-
-        # 查询请求历史表
-        history = db.query(RequestHistory).filter(
-            RequestHistory.job_type == "time",
-            RequestHistory.keywords == cast(keywords,JSONB),
-            RequestHistory.geo_code == geo_code,
-            RequestHistory.timeframe_start == timeframe_start,
-            RequestHistory.timeframe_end == timeframe_end
-        ).first()
-
-        if history and history.status == "success":
-            interest_id.append(history.interest_id)
-            continue  # 跳过已处理的请求
-        elif not history:
-            try:
-                history = RequestHistory(
-                    job_type="time",
-                    keywords=keywords,
-                    geo_code=geo_code,
-                    timeframe_start=timeframe_start,
-                    timeframe_end=timeframe_end,
-                )
-                db.add(history)
-                db.commit()
-            except IntegrityError as e:
-                db.rollback()
-                logger.error(f"数据已存在或冲突: {str(e)}")
-                raise
+    try:
+        return await fetch_time_range(db, keywords, geo_code, start, end, None)
+    finally:
+        db.close()
+
+async def fetch_time_cell(keywords: list[str], geo_code: str, start: str, end: str) -> int:
+    """采集一个规范时间格，时间格数据不属于某个任务，可被多个任务复用"""
+    key = (keywords_hash(keywords), geo_code, start, end)
+    task = _inflight_cells.get(key)
+    if task is None:
+        task = _inflight_cells[key] = asyncio.ensure_future(_fetch_time_cell(keywords, geo_code, start, end))
+        task.add_done_callback(lambda _: _inflight_cells.pop(key, None))
+    # 某个等待方被取消时不影响其他等待方
+    return await asyncio.shield(task)
 
+async def fetch_time_window(db, keywords: list[str], geo_code: str, start: str, end: str, task_id) -> int:
+    """
+    time 任务的时间段先对齐到规范时间格（core.utils.time_window），从时间格的数据中截取该时间段并重新归一化，
+    边界不同但落在同一时间格内的请求只需要采集一次。无法对齐的时间段，以及尚未结束的时间格
+    （数据还会更新，如定时任务采集的最近数据）按原时间段采集。
+    该时间段在时间格中的峰值低于 canonical_min_peak 时，重新归一化的取整误差过大（见 cut_time_window），也按原时间段采集。
+    """
+    cell = canonical_cell(start, end) if settings.canonical_windows else None
+    if cell is None or cell[1] > date.today().isoformat():
+        return await fetch_time_range(db, keywords, geo_code, start, end, task_id)
+    if cell == (start, end):
+        return await fetch_time_cell(keywords, geo_code, start, end)
+    history = _get_or_create_history(db, "time", keywords, geo_code, start, end)
+    if history.status == "success":
+        return history.interest_id  # 跳过已处理的请求
+    try:
+        cell_id = await fetch_time_cell(keywords, geo_code, *cell)
+        cell_data = db.query(TimeInterest).get(cell_id).data
+        if window_peak(cell_data, start, end) < settings.canonical_min_peak:
+            logger.info(f"时间段 {start} {end} 在时间格 {cell[0]} {cell[1]} 中的峰值过低，按原时间段采集")
+            return await fetch_time_range(db, keywords, geo_code, start, end, task_id)
+        data = cut_time_window(cell_data, start, end)
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        history.status = "failed"
+        db.commit()
+        raise
+    record = TimeInterest(
+                keywords=keywords,
+                geo_code=geo_code,
+                timeframe_start=start,
+                timeframe_end=end,
+                data=data,
+                task_id=task_id
+            )
+    return _save_interest(db, history, record)
+
+RANGE_FETCHERS = {"region": fetch_region_range, "time": fetch_time_window}
+
+async def fetch_range(job_type: str, keywords: list[str], geo_code: str, start: str, end: str, task_id) -> int:
+    """采集单个时间段（Dramatiq 子任务使用），返回兴趣数据记录ID"""
+    if job_type not in RANGE_FETCHERS:
+        raise ValueError(f"无效的任务类型: {job_type}")
+    db = next(get_db())
+    try:
+        return await RANGE_FETCHERS[job_type](db, keywords, geo_code, start, end, task_id)
+    finally:
+        db.close()
+
+# 打包采集的请求历史使用单独的任务类型，与自身归一化的 time 数据互不复用
+ANCHORED_JOB_TYPE = "anchored"
+
+def anchored_keywords(keyword: str, anchor: str) -> list[str]:
+    """打包采集结果的关键词：任务关键词在前，锚点在后"""
+    return [keyword, anchor]
+
+async def fetch_time_batch(anchor: str, items: list, geo_code: str, start: str, end: str) -> list[int]:
+    """
+    打包采集同一地区、同一时间段的多个单关键词 time 子任务：一个请求比较锚点关键词和 items 中的关键词，
+    结果按关键词拆分为各任务自己的 TimeInterest 记录（包含该关键词和锚点两列）。
+    数值按锚点的峰值换算（锚点峰值为 100，其他关键词可能超过 100），因此不同批次的结果可以直接比较。
+    这些记录的关键词为 [关键词, 锚点]，请求历史的任务类型为 ANCHORED_JOB_TYPE，不会与未打包的 time 数据混用。
+    items 为 (关键词, 任务ID) 列表，返回与 items 顺序一致的兴趣数据记录ID。
+    """
+    db = next(get_db())
+    try:
+        histories = [
+            _get_or_create_history(db, ANCHORED_JOB_TYPE, anchored_keywords(keyword, anchor), geo_code, start, end)
+            for keyword, _ in items
+        ]
+        interest_ids = [history.interest_id if history.status == "success" else None for history in histories]
+        pending = [index for index, history in enumerate(histories) if history.status != "success"]
+        if not pending:
+            return interest_ids
+        keywords = [anchor] + [items[index][0] for index in pending]
         try:
-            # 调用API获取数据
-            timeframe = f"{start} {end}"
-            token,time_data = _call_trends_api_with_retry(
-                trends.interest_over_time, max_retries=3, keywords=keywords, geo=geo_code, timeframe=timeframe,return_raw=True
-            )   
-            
-			
+            token,time_data = await _call_trends_api_with_retry(
+                "interest_over_time", max_retries=3, keywords=keywords, geo=geo_code,
+                timeframe=f"{start} {end}",return_raw=True
+            )
             time_data=TrendsDataConverter.interest_over_time(time_data,keywords=keywords)
-            record = TimeInterest(
-                        keywords=keywords,
-                        geo_code=geo_code,
-                        timeframe_start=timeframe_start,
-                        timeframe_end=timeframe_end,
-                        data=time_data.reset_index().to_json(orient="records"),
-                        task_id=task_id
-                    )
-            db.add(record)
-            db.commit()
-            db.refresh(record)
-             # 记录请求历史
-            history.status = "success"
-            history.interest_id = record.id
-            db.commit()
-            interest_id.append(record.id)
-        except IntegrityError as e:
-            db.rollback()
-            logger.error(f"数据已存在或冲突: {str(e)}")
-            history.status = "failed"
-            db.commit()
-            raise
         except Exception as e:
-            db.rollback()
             logger.error(f"Error: {str(e)}")
-            history.status = "failed"
+            for index in pending:
+                histories[index].status = "failed"
             db.commit()
             raise
-        finally:
-            db.close()
-    return interest_id
\ No newline at end of file
+        anchor_peak = time_data[anchor].max() if len(time_data) else 0
+        scale = 100 / anchor_peak if anchor_peak else 1
+        for index in pending:
+            keyword, task_id = items[index]
+            data = time_data[[column for column in (keyword, anchor, "isPartial") if column in time_data]].copy()
+            data[keyword] = (data[keyword] * scale).round(2)
+            data[anchor] = (data[anchor] * scale).round(2)
+            record = TimeInterest(
+                        keywords=anchored_keywords(keyword, anchor),
+                        geo_code=geo_code,
+                        timeframe_start=start,
+                        timeframe_end=end,
+                        data=data.reset_index().to_json(orient="records"),
+                        task_id=task_id
+                    )
+            interest_ids[index] = _save_interest(db, histories[index], record)
+        return interest_ids
+    finally:
+        db.close()
+
+async def _get_interest(job_type: str, keywords: list[str], geo_code: str, interval: str, start_date: str, end_date: str, task_id):
+    db = next(get_db())
+    try:
+        ranges = split_task_ranges(job_type, start_date, end_date, interval)
+        completed = find_completed_ranges(db, job_type, keywords, geo_code, ranges)
+        return [
+            completed[(start, end)] if (start, end) in completed
+            else await RANGE_FETCHERS[job_type](db, keywords, geo_code, start, end, task_id)
+            for start, end in ranges
+        ]
+    finally:
+        db.close()
+
+async def get_interest_by_region(keywords: list[str], geo_code: str, interval: str, start_date: str, end_date: str,task_id:int):
+    return await _get_interest("region", keywords, geo_code, interval, start_date, end_date, task_id)
+
+async def get_interest_over_time(keywords: list[str], geo_code: str, interval: str, start_date: str, end_date: str,task_id: int):
+    return await _get_interest("time", keywords, geo_code, interval, start_date, end_date, task_id)
@@ -0,0 +1,11 @@
+# src/core/utils/keyword_hash.py
+import hashlib
+import json
+
+def keywords_hash(keywords: list) -> str:
+    """
+    关键词集合的哈希：去重、排序后再计算 SHA-256，关键词顺序不同的请求视为同一个请求。
+    用于 request_history 的索引查询，代替对 JSONB 列的等值比较。
+    """
+    normalized = sorted({keyword.strip() for keyword in keywords})
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf-8")).hexdigest()
@@ -0,0 +1,52 @@
+# src/core/utils/time_window.py
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+def canonical_cell(start: str, end: str) -> Optional[Tuple[str, str]]:
+    """
+    把 time 任务的时间段对齐到规范时间格（起止日期均包含在内，与 Trends 的 timeframe 一致）：
+    落在某个自然月内时取该月（月初到下月初），否则落在某个自然周内时取该周（周一到下周一），
+    都不满足时返回 None，按原时间段采集。时间格不超过一个月，Trends 返回的都是按天的数据。
+    """
+    start_date, end_date = date.fromisoformat(start), date.fromisoformat(end)
+    month_start = start_date.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1)
+    if end_date <= month_end:
+        return month_start.isoformat(), month_end.isoformat()
+    week_start = start_date - timedelta(days=start_date.weekday())
+    week_end = week_start + timedelta(days=7)
+    if end_date <= week_end:
+        return week_start.isoformat(), week_end.isoformat()
+    return None
+
+def _epoch_ms(day: date) -> int:
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+def _window_records(data: str, start: str, end: str) -> Tuple[list, set, float]:
+    """截取 [start, end] 的数据点，返回 (数据点, 关键词列, 截取范围内的最大值)"""
+    lower = _epoch_ms(date.fromisoformat(start))
+    upper = _epoch_ms(date.fromisoformat(end) + timedelta(days=1))
+    records = [record for record in json.loads(data) if lower <= record["time [UTC]"] < upper]
+    columns = {key for record in records for key in record} - {"time [UTC]", "isPartial"}
+    peak = max((record[column] for record in records for column in columns), default=0)
+    return records, columns, peak
+
+def window_peak(data: str, start: str, end: str) -> float:
+    """[start, end] 在时间格数据中的最大值（按时间格归一化，0-100）"""
+    return _window_records(data, start, end)[2]
+
+def cut_time_window(data: str, start: str, end: str) -> str:
+    """
+    从时间格的数据（TimeInterest.data）中截取 [start, end] 的数据点，并重新归一化使截取范围内的最大值为 100，
+    与直接请求该时间段时 Trends 的归一化方式一致。
+    注意误差会被放大：Trends 返回的时间格数据是 0-100 的整数，截取范围的峰值为 peak 时每个值乘以 100/peak，
+    取整误差（±0.5）随之放大为 ±50/peak，峰值越低结果越粗（peak 为 5 时只剩 0、20、40…… 几档）。
+    调用方应先用 window_peak 检查峰值，过低时按原时间段直接采集。
+    """
+    records, columns, peak = _window_records(data, start, end)
+    if peak:
+        for record in records:
+            for column in columns:
+                record[column] = round(record[column] * 100 / peak, 2)
+    return json.dumps(records, ensure_ascii=False)
@@ -4,7 +4,8 @@ import socket
 from fastapi import FastAPI
 from services.rabbitmq import RabbitMQClient
 from services import registry
-from api.dependencies.database import engine,Base
+from api.dependencies.database import engine
+from api.dependencies.migrations import migrate
 from core import aio_scheduler
 from fastapi_events.middleware import EventHandlerASGIMiddleware
 from fastapi_events.handlers.local import local_handler
@@ -39,6 +40,8 @@ instance = ServiceInstance(
             
           
 async def lifespan_handler(app: FastAPI):
+    # 建表和升级放在启动时执行（多进程时由数据库锁串行化），导入 main 不会触发 DDL
+    migrate(engine)
     await RabbitMQClient.start_consumers(app)
     aio_scheduler.start()
     aio_scheduler.sync_job_status()
@@ -52,7 +55,6 @@ async def lifespan_handler(app: FastAPI):
     
     
     
-Base.metadata.create_all(bind=engine)
 # 新增状态同步
 # scheduler_manager.sync_job_status()
 app = FastAPI(title="Trends Collector API",lifespan=lifespan_handler)
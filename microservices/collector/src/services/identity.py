@@ -0,0 +1,58 @@
+"""
+校验网关签发的身份断言（X-Identity-Assertion），各后端服务共用，与 api-gateway/src/services/identity.py 的签发格式对应：
+base64url(载荷).base64url(HMAC-SHA256)，密钥为各服务配置的 identity_secret。
+只需要用户名或角色的路由直接依赖 get_identity，不必查询用户。
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import time
+from typing import List, Optional
+from fastapi import Header
+from pydantic import BaseModel
+
+from config import get_settings
+
+settings = get_settings()
+_key = settings.identity_secret.encode()
+
+
+class Identity(BaseModel):
+    """网关签发的身份断言：用户名、角色及过期时间"""
+    sub: str
+    roles: List[str] = []
+    exp: int
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def verify_identity(assertion: str) -> Optional[Identity]:
+    """校验断言的 HMAC 签名和有效期，无效时返回 None"""
+    payload, _, signature = assertion.partition(".")
+    if not payload or not signature:
+        return None
+    expected = hmac.new(_key, payload.encode("ascii", "ignore"), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        identity = Identity(**json.loads(_b64decode(payload)))
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if identity.exp < time.time():
+        return None
+    return identity
+
+
+async def get_identity(x_identity_assertion: Optional[str] = Header(None)) -> Optional[Identity]:
+    """
+    读取网关转发的 X-Identity-Assertion。
+    未配置 identity_secret、请求未经过网关或断言无效时返回 None，由调用方回退到 JWT 校验。
+    """
+    if not _key or not x_identity_assertion:
+        return None
+    return verify_identity(x_identity_assertion)
+
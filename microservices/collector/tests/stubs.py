@@ -0,0 +1,128 @@
+"""
+出口连接池测试用的本地替身 Trends 服务，运行在测试进程的后台线程中，每个替身监听一个本地端口，代表一个出口。
+Trends 会话把替身地址配置为代理，trendspy 的接口地址改为 http 后，请求以绝对 URL 发送给替身，
+替身实现 interest_over_time 用到的两个接口（嵌入页取 token、按 token 取时间序列），
+并可预设失败响应（如带 Retry-After 的 429），按顺序依次返回。
+"""
+import json
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+HOST = "127.0.0.1"
+TRENDS_URL = "http://trends.google.com"
+# 替换 trendspy.client 中的接口地址（https 请求经代理时走 CONNECT 隧道，替身无法处理）
+TRENDS_URLS = {
+    "EMBED_TIMESERIES_URL": f"{TRENDS_URL}/trends/embed/explore/TIMESERIES",
+    "API_TIMELINE_URL": f"{TRENDS_URL}/trends/api/widgetdata/multiline",
+}
+# trendspy 对非 200 响应最多请求 3 次后才抛出 HTTPError
+TRENDSPY_ATTEMPTS = 3
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def _escape(text: str) -> str:
+    """与 Trends 嵌入页相同，JSON 中的引号写成 \\x22"""
+    return text.replace('"', r'\x22')
+
+
+class FakeTrends:
+    """替身 Trends 服务：预设的失败响应用完后正常返回；记录收到的请求路径"""
+    def __init__(self, values: Tuple[int, ...] = (10, 40, 100)):
+        self.port = free_port()
+        self.url = f"http://{HOST}:{self.port}"
+        self.values = values
+        self.failures: List[Tuple[int, Dict[str, str]]] = []
+        self.requests: List[str] = []
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def fail(self, status_code: int, headers: Optional[Dict[str, str]] = None, times: int = 1):
+        """接下来的请求返回 status_code；一次 API 调用失败需要 TRENDSPY_ATTEMPTS 个失败响应"""
+        self.failures.extend([(status_code, headers or {})] * times)
+
+    def throttle(self, retry_after: str, calls: int = 1):
+        """接下来 calls 次 API 调用返回 429，Retry-After 可以是秒数或 HTTP 日期"""
+        self.fail(429, {"Retry-After": retry_after}, times=TRENDSPY_ATTEMPTS * calls)
+
+    def reset(self):
+        self.failures.clear()
+        self.requests.clear()
+
+    def embed(self, request: Request) -> Response:
+        items = json.loads(request.query_params["req"])["comparisonItem"]
+        token = {
+            "type": "fe_line_chart",
+            "token": "fake-token",
+            "request": {
+                "time": items[0]["time"],
+                "comparisonItem": [
+                    {"complexKeywordsRestriction": {"keyword": [{"type": "BROAD", "value": item["keyword"]}]}}
+                    for item in items
+                ]
+            }
+        }
+        html = f"<script>var widget = JSON.parse('{_escape(json.dumps(token))}');</script>"
+        return Response(html, media_type="text/html")
+
+    def timeline(self, request: Request) -> Response:
+        token = json.loads(request.query_params["req"])
+        keywords = len(token["comparisonItem"])
+        start = int(time.mktime(time.strptime("2020-01-01", "%Y-%m-%d")))
+        data = {"default": {"timelineData": [
+            {
+                "time": str(start + day * 86400),
+                "formattedTime": f"Jan {day + 1}, 2020",
+                "value": [value] * keywords,
+                "formattedValue": [str(value)] * keywords,
+                "hasData": [True] * keywords
+            }
+            for day, value in enumerate(self.values)
+        ]}}
+        return Response(")]}'\n" + json.dumps(data), media_type="application/json")
+
+    def create_app(self) -> FastAPI:
+        app = FastAPI()
+
+        # 代理请求的请求行是绝对 URL，不经过路由匹配，所有请求都在中间件中处理
+        @app.middleware("http")
+        async def trends(request: Request, call_next):
+            path = request.url.path
+            if path.startswith("//"):
+                # 绝对 URL 的请求行被解析为 //host/path
+                path = "/" + path[2:].partition("/")[2]
+            self.requests.append(path)
+            if self.failures:
+                status_code, headers = self.failures.pop(0)
+                return Response(b"", status_code=status_code, headers=headers)
+            if path.endswith("/TIMESERIES"):
+                return self.embed(request)
+            if path.endswith("/multiline"):
+                return self.timeline(request)
+            return Response(b"", status_code=404)
+
+        return app
+
+    def start(self):
+        config = uvicorn.Config(self.create_app(), host=HOST, port=self.port, log_level="warning", access_log=False)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 5
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"替身 Trends 服务 {self.url} 启动超时")
+            time.sleep(0.01)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
@@ -0,0 +1,230 @@
+"""
+出口连接池测试：通过 core.trends._call_trends_api_with_retry 调用 trendspy，每个出口的 Trends 会话以
+本地替身 Trends 服务（stubs.py）为代理，覆盖出口选择、AIMD 请求间隔、Retry-After（秒数和 HTTP 日期）、
+健康度 EWMA、隔离与恢复。连接池使用手动推进的时钟，trendspy 内部的重试等待被替换为空操作，测试不依赖真实时间。
+
+    cd microservices/collector
+    python -m unittest discover -s tests
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from email.utils import formatdate
+from pathlib import Path
+from time import time
+from unittest import mock
+from requests import HTTPError
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+# core 包导入时会创建数据库引擎和日志文件，放到临时目录；令牌桶关闭，不访问数据库
+os.chdir(tempfile.mkdtemp(prefix="collector-tests-"))
+os.environ.update(
+    DATABASE_URL="sqlite:///test.db", PROXY="", REQUEST_DELAY="0", PORT="0", TRENDS_RATE_LIMIT="0"
+)
+
+import core.trends as ct  # noqa: E402
+from core.egress_pool import EgressPool  # noqa: E402
+from core.rate_budget import RateBudget  # noqa: E402
+from stubs import TRENDS_URLS, FakeTrends  # noqa: E402
+
+
+class FakeClock:
+    """手动推进的时钟"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+def fetch():
+    return ct._call_trends_api_with_retry(
+        "interest_over_time", max_retries=3, keywords=["python"], geo="US",
+        timeframe="2020-01-01 2020-01-03", return_raw=True
+    )
+
+
+class EgressPoolTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = [FakeTrends(), FakeTrends()]
+        for server in cls.servers:
+            server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.stop()
+
+    def setUp(self):
+        for server in self.servers:
+            server.reset()
+        self.clock = FakeClock()
+        patches = [
+            mock.patch.multiple("trendspy.client", sleep=lambda seconds: None, **TRENDS_URLS),
+            # trendspy 多次 429 后会打印提示
+            mock.patch("trendspy.client.print", lambda *args, **kwargs: None, create=True),
+            mock.patch.object(ct, "rate_budget", RateBudget("test", 0)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def make_pool(self, servers, **kwargs) -> EgressPool:
+        options = dict(delay=10, min_delay=2, max_delay=120, delay_step=1,
+                       quarantine_failures=3, quarantine_seconds=600, clock=self.clock)
+        options.update(kwargs)
+        pool = EgressPool([server.url for server in servers], **options)
+        patch = mock.patch.object(ct, "egress_pool", pool)
+        patch.start()
+        self.addCleanup(patch.stop)
+        return pool
+
+    def entry_for(self, pool: EgressPool, server: FakeTrends):
+        return next(entry for entry in pool.entries if entry.proxy == server.url)
+
+    async def test_fetches_through_entry_proxy(self):
+        server = self.servers[0]
+        pool = self.make_pool([server])
+        token, data = await fetch()
+        self.assertEqual(token["type"], "fe_line_chart")
+        self.assertEqual(
+            [point["formattedValue"] for point in data["default"]["timelineData"]], [["10"], ["40"], ["100"]]
+        )
+        self.assertEqual(server.requests, ["/trends/embed/explore/TIMESERIES", "/trends/api/widgetdata/multiline"])
+        self.assertFalse(pool.entries[0].in_use)
+
+    async def test_select_prefers_healthiest_ready_entry(self):
+        first, second = self.servers
+        pool = self.make_pool([first, second])
+        self.entry_for(pool, first).health = 0.5
+        await fetch()
+        self.assertEqual((len(first.requests), len(second.requests)), (0, 2))
+        # 健康度更高的出口还在请求间隔内，改用另一个出口
+        await fetch()
+        self.assertEqual((len(first.requests), len(second.requests)), (2, 2))
+
+    async def test_select_skips_busy_entries(self):
+        first, second = self.servers
+        pool = self.make_pool([first, second])
+        busy = await pool.acquire()
+        await fetch()
+        self.assertEqual(len(next(s for s in self.servers if s.url == busy.proxy).requests), 0)
+        # 两个出口都不可用时等待
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.acquire(), timeout=0.05)
+        pool.release(busy)
+
+    async def test_success_steps_delay_down(self):
+        server = self.servers[0]
+        pool = self.make_pool([server], delay=4)
+        entry = pool.entries[0]
+        await fetch()
+        self.assertEqual(entry.delay, 3)
+        self.assertEqual(entry.next_available, self.clock() + 3)
+        for _ in range(3):
+            self.clock.advance(entry.delay)
+            await fetch()
+        self.assertEqual(entry.delay, pool.min_delay)
+
+    async def assert_throttled(self, retry_after: str, expected: float):
+        throttled, healthy = self.servers
+        throttled.throttle(retry_after)
+        pool = self.make_pool([throttled, healthy])
+        self.entry_for(pool, healthy).health = 0.9
+        token, _ = await fetch()
+        self.assertEqual(token["type"], "fe_line_chart")
+        entry = self.entry_for(pool, throttled)
+        # 429 后请求间隔翻倍，按 Retry-After 暂停该出口，请求改由另一个出口完成
+        self.assertFalse(entry.in_use)
+        self.assertEqual(entry.delay, 20)
+        self.assertAlmostEqual(entry.next_available - self.clock(), expected, delta=2)
+        self.assertEqual(len(healthy.requests), 2)
+
+    async def test_throttle_honors_retry_after_seconds(self):
+        await self.assert_throttled("90", 90)
+
+    async def test_throttle_honors_retry_after_http_date(self):
+        await self.assert_throttled(formatdate(time() + 45, usegmt=True), 45)
+
+    async def test_throttle_defaults_on_invalid_retry_after(self):
+        await self.assert_throttled("soon", 60)
+
+    async def test_throttle_doubles_delay_up_to_max(self):
+        throttled, healthy = self.servers
+        throttled.throttle("0", calls=4)
+        pool = self.make_pool([throttled, healthy], max_delay=60)
+        entry = self.entry_for(pool, throttled)
+        self.entry_for(pool, healthy).health = 0.1
+        for expected in (20, 40, 60):
+            await fetch()
+            self.assertEqual(entry.delay, expected)
+            # 两个出口都回到可用状态，下一次仍选健康度更高的限流出口
+            self.clock.advance(pool.max_delay)
+
+    async def test_health_is_ewma_of_success(self):
+        server = self.servers[0]
+        server.fail(500, times=2 * 3)
+        pool = self.make_pool([server])
+        entry = pool.entries[0]
+        for expected in (0.8, 0.64):
+            with self.assertRaises(HTTPError):
+                await fetch()
+            self.assertAlmostEqual(entry.health, expected)
+            self.clock.advance(entry.delay)
+        await fetch()
+        self.assertAlmostEqual(entry.health, 0.712)
+        self.assertEqual(entry.failures, 0)
+
+    async def test_unrelated_errors_do_not_count(self):
+        pool = self.make_pool([self.servers[0]])
+        entry = await pool.acquire()
+        pool.release(entry, ValueError("bad response"))
+        self.assertEqual((entry.health, entry.failures), (1.0, 0))
+
+    async def test_quarantine_and_recovery(self):
+        failing, healthy = self.servers
+        failing.fail(503, times=3 * 3)
+        pool = self.make_pool([failing, healthy])
+        failing_entry, healthy_entry = self.entry_for(pool, failing), self.entry_for(pool, healthy)
+        healthy_entry.health = 0.3
+        for _ in range(3):
+            with self.assertRaises(HTTPError):
+                await fetch()
+            self.clock.advance(failing_entry.delay)
+        self.assertEqual(failing_entry.quarantined_until, self.clock() - failing_entry.delay + 600)
+        self.assertEqual(failing_entry.failures, 0)
+        # 隔离期间请求调度到另一个出口，即使它的健康度更低
+        await fetch()
+        self.assertEqual(len(healthy.requests), 2)
+        # 隔离结束后恢复调度，成功后健康度回升
+        self.clock.advance(600)
+        await fetch()
+        self.assertEqual(len(failing.requests), 3 * 3 + 2)
+        self.assertAlmostEqual(failing_entry.health, 0.8 ** 3 * 0.8 + 0.2)
+
+    async def test_single_entry_waits_out_quarantine(self):
+        server = self.servers[0]
+        server.fail(503, times=3 * 3)
+        pool = self.make_pool([server])
+        entry = pool.entries[0]
+        for _ in range(3):
+            with self.assertRaises(HTTPError):
+                await fetch()
+            self.clock.advance(entry.delay)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.acquire(), timeout=0.05)
+        self.clock.advance(600)
+        await fetch()
+        self.assertFalse(entry.in_use)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,6 +10,7 @@ class Settings(BaseSettings):
     consul_host: str = "localhost"
     consul_port: int = 8500
     service_tags: List[str] = ["permission"]
+    token_cache_size: int = 4096  # 已验证token缓存的最大条目数
     rabbitmq_host: str =  "localhost"
     rabbitmq_port: int = 5672
     rabbitmq_username: str = "admin"
@@ -1,14 +1,17 @@
 import asyncio
+import json
 import socket
 import aio_pika
 from fastapi import Body, Depends, FastAPI, HTTPException, Header, Path, Query
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from jose import JWTError, jwt
+from typing import List, Optional
 from pydantic import BaseModel
 from config import get_settings
 from services.rabbitmq import RabbitMQClient
 from services.jwt_validator import JWTValidator
+from services.permission_matcher import PermissionMatcher
 from services.registry import ServiceInstance,ConsulRegistry
 from dependencies.database import engine, Base,get_db
 from sqlalchemy.orm import Session
@@ -16,7 +19,8 @@ from models.permission import Permission
 
 setting = get_settings()
 registry = ConsulRegistry(host=setting.consul_host, port=setting.consul_port)
-jwt_validatort = JWTValidator()
+jwt_validatort = JWTValidator(cache_size=setting.token_cache_size)
+permission_matcher = PermissionMatcher()
 
 hostname=socket.gethostname()
 # 注册服务到Consul
@@ -27,22 +31,35 @@ instance = ServiceInstance(
         port=setting.port,
        
     )
-@RabbitMQClient.consumer(queue="public_key_queue")
+@RabbitMQClient.consumer(queue="public_key_queue", broadcast=True)
 async def on_message(message: aio_pika.IncomingMessage):
     async with message.process():
         aio_pika.logger.info("已收到公钥")
         public_key = message.body.decode()
         jwt_validatort.public_key=public_key
+
+@RabbitMQClient.consumer(queue="permission_update_queue", broadcast=True)
+async def on_permission_update(message: aio_pika.IncomingMessage):
+    async with message.process():
+        # 任一权限服务实例修改权限表后推送全量快照，所有实例（包括发送方）据此重建匹配树
+        build_matcher(json.loads(message.body.decode()))
         
 @asynccontextmanager
 async def lifespan(app: FastAPI):
    
+    # 启动时编译权限匹配树
+    db = next(get_db())
+    try:
+        build_matcher(permissions_snapshot(db))
+    finally:
+        db.close()
     await RabbitMQClient.start_consumers(app)
     registry.register(instance)
     yield
     # 注销服务
     registry.deregister(instance.service_name, instance.instance_id)
     await RabbitMQClient.close_consumers(app)
+    await RabbitMQClient.close_publishers()
     
 Base.metadata.create_all(bind=engine)    
 app = FastAPI(lifespan=lifespan)
@@ -53,6 +70,11 @@ app = FastAPI(lifespan=lifespan)
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """token 缓存命中统计"""
+    return {"token_cache": jwt_validatort.cache.stats()}
+
 class PermissionCreate(BaseModel):
     service_name: str
     path: str
@@ -65,9 +87,11 @@ class PermissionUpdate(BaseModel):
 class VerifyPermission(BaseModel):
     service_name:str
     path:str
+
+class BatchVerifyPermission(BaseModel):
+    items: List[VerifyPermission]
     
-@app.get("/permissions/list")
-async def list_permissions(db: Session = Depends(get_db)):
+def permissions_snapshot(db: Session):
     permissions = db.query(Permission).order_by(Permission.service_name).all()
     return [{
         "service_name": p.service_name,
@@ -75,6 +99,23 @@ async def list_permissions(db: Session = Depends(get_db)):
         "required_permission": p.required_permission.split(',')
     } for p in permissions]
 
+def build_matcher(snapshot: List[dict]):
+    permission_matcher.build((p["service_name"], p["path"], p["required_permission"]) for p in snapshot)
+
+async def reload_permissions(db: Session):
+    """权限表变更后重建本实例的匹配树，并向网关和其他权限服务实例广播全量快照"""
+    snapshot = permissions_snapshot(db)
+    build_matcher(snapshot)
+    try:
+        client = await RabbitMQClient.publisher("permission_update_queue", broadcast=True)
+        await client.publish(json.dumps(snapshot))
+    except Exception as e:
+        aio_pika.logger.error(f"推送权限表失败: {e}")
+
+@app.get("/permissions/list")
+async def list_permissions(db: Session = Depends(get_db)):
+    return permissions_snapshot(db)
+
 @app.post("/permissions/create")
 async def create_permission(
     permission: PermissionCreate,
@@ -95,6 +136,7 @@ async def create_permission(
     )
     db.add(new_permission)
     db.commit()
+    await reload_permissions(db)
     return {"message": "Permission created successfully"}
 
 @app.delete("/permissions/{service_name}/delete")
@@ -112,6 +154,7 @@ async def delete_permission(
 
     db.delete(db_permission)
     db.commit()
+    await reload_permissions(db)
     return {"message": "Permission deleted successfully"}
 
 @app.put("/permissions/{service_name}/update")
@@ -129,43 +172,15 @@ async def update_permission(
 
     db_permission.required_permission = permission.required_permission
     db.commit()
+    await reload_permissions(db)
     return {"message": "Permission updated successfully"}
 
 
-@app.post("/verify-permission")
-async def verify_permission(req: VerifyPermission, authorization: str = Header(None), db: Session = Depends(get_db)):
-    # Check if the path is public
-    permissions = db.query(Permission).filter(
-        Permission.service_name == req.service_name
-    ).all()
-
-    permission = None
-   
-    for perm in permissions:
-        perm_path_parts = perm.path.split('/')
-        req_path_parts = req.path.split('/')
-        if len(perm_path_parts) == len(req_path_parts):
-            match = True
-            for perm_part, req_part in zip(perm_path_parts, req_path_parts):
-                if perm_part.startswith('{') and perm_part.endswith('}'):
-                    continue
-                if perm_part != req_part:
-                    match = False
-                    break
-            if match:
-                permission = perm
-                break
-   
-    if permission and "public" in permission.required_permission.split(','):
-        return {"message": "Permission granted"}
-   
+async def decode_authorization(authorization: Optional[str]) -> dict:
+    """校验 Authorization 头中的JWT，失败时抛出 HTTPException"""
     if not authorization or "Bearer " not in authorization:
-            return JSONResponse(
-            status_code=401,
-            content={"message": "Missing or invalid Authorization head·er"}
-            )
+        raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
     token = authorization.split("Bearer ")[-1]
-    
     try:
         # 验证JWT令牌
         payload =await jwt_validatort.verify_token(token)
@@ -174,22 +189,65 @@ async def verify_permission(req: VerifyPermission, authorization: str = Header(N
             username: str = payload.get("sub")
             if not username:
                 raise HTTPException(status_code=401, detail="Invalid token")
-            token_roles:list[str] = payload.get("roles")
-            # print(token_roles)
+            return payload
         elif payload is False:
             raise HTTPException(status_code=401, detail="No public key")
         else:
             raise HTTPException(status_code=401, detail="Invalid token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Token validation failed")
-    if permission:
-        required_permission = permission.required_permission.split(',')
-        if set(token_roles) & set(required_permission):
-            return {"message": "Permission granted"}
-        else:
-            raise HTTPException(status_code=403, detail="Permission denied")
-    else:
+
+def check_roles(required_permission: Optional[List[str]], token_roles: List[str]):
+    if required_permission is None:
         raise HTTPException(status_code=404, detail="Path not found")
+    if not set(token_roles or []) & set(required_permission):
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+@app.post("/verify-permission")
+async def verify_permission(req: VerifyPermission, authorization: str = Header(None)):
+    # 从内存匹配树查找路径的权限要求
+    required_permission = permission_matcher.match(req.service_name, req.path)
+   
+    if required_permission and "public" in required_permission:
+        return {"message": "Permission granted"}
+   
+    if not authorization or "Bearer " not in authorization:
+            return JSONResponse(
+            status_code=401,
+            content={"message": "Missing or invalid Authorization header"}
+            )
+    payload = await decode_authorization(authorization)
+    check_roles(required_permission, payload.get("roles"))
+    # 网关据此向下游转发用户信息并签发身份断言，格式与网关本地鉴权一致
+    return {
+        "message": "Permission granted",
+        "user_info": {"id": payload.get("sub"), "role": ",".join(payload.get("roles") or [])}
+    }
+
+@app.post("/verify-permission/batch")
+async def verify_permission_batch(req: BatchVerifyPermission, authorization: str = Header(None)):
+    """一次校验多个 (service_name, path)，token 只解析一次"""
+    payload = None
+    token_error = None
+    results = []
+    for item in req.items:
+        required_permission = permission_matcher.match(item.service_name, item.path)
+        try:
+            if not (required_permission and "public" in required_permission):
+                if payload is None and token_error is None:
+                    try:
+                        payload = await decode_authorization(authorization)
+                    except HTTPException as e:
+                        token_error = e
+                if token_error is not None:
+                    raise token_error
+                check_roles(required_permission, payload.get("roles"))
+            results.append({"service_name": item.service_name, "path": item.path,
+                            "status_code": 200, "message": "Permission granted"})
+        except HTTPException as e:
+            results.append({"service_name": item.service_name, "path": item.path,
+                            "status_code": e.status_code, "message": e.detail})
+    return {"results": results}
     
     
     
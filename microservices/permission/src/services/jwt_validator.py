@@ -1,16 +1,37 @@
+import hashlib
 from jose import JWTError, jwt
+from services.token_cache import TTLCache
 
 class JWTValidator:
-    def __init__(self,  refresh_interval=3600):
-        self.public_key = None
+    def __init__(self,  refresh_interval=3600, cache_size=4096):
+        self._public_key = None
         self.refresh_interval = refresh_interval
-        
+        # 已验证的 token 载荷，按 token 摘要缓存，过期时间与 token 的 exp 一致
+        self.cache = TTLCache(maxsize=cache_size)
+
+    @property
+    def public_key(self):
+        return self._public_key
+
+    @public_key.setter
+    def public_key(self, public_key):
+        # 公钥轮换后，用旧公钥验证过的结果全部作废
+        if public_key != self._public_key:
+            self.cache.clear()
+        self._public_key = public_key
+
     async def verify_token(self, token: str):
         public_key = self.public_key
         if not public_key:
             return False
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        payload = self.cache.get(digest)
+        if payload is not None:
+            return payload
         try:
             payload = jwt.decode(token, public_key, algorithms=["RS256"])
-            return payload
         except JWTError:
             return False
+        if payload.get("exp") is not None:
+            self.cache.set(digest, payload, expires_at=payload["exp"])
+        return payload
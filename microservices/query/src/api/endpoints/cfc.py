@@ -4,6 +4,7 @@ import os
 from typing import List
 import uuid
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 import torch
 from core.fit.cfc import CfcFit, CfcPredictor, TrainingProgressCallback
 from api.utils.create_dataset import create_sliding_window
@@ -221,3 +222,49 @@ async def get_task_status(
         result=task.result,
         progress=task.progress
     )
+
+
+@router.get("/fit/{task_id}/events")
+async def stream_task_status(task_id: str, interval: float = 1.0):
+    """
+    以 SSE 推送训练任务进度，状态变化时发送一条事件，任务结束（或不存在）后关闭连接。
+    数据库查询是同步的，放到线程池中执行，不阻塞事件循环。
+    """
+    interval = min(max(interval, 0.2), 10.0)
+
+    def read_status(task_store: TaskStore) -> FitResponse:
+        # 结束上一次查询的事务，才能读到训练任务写入的最新进度
+        task_store.db.rollback()
+        task = task_store.get_task(task_id)
+        if not task:
+            return FitResponse(task_id=task_id, status="not_found")
+        return FitResponse(task_id=task_id, status=task.status, result=task.result, progress=task.progress)
+
+    async def events():
+        task_store = TaskStore(await asyncio.to_thread(get_independent_db))
+        last_data = None
+        idle = 0.0
+        try:
+            while True:
+                status = await asyncio.to_thread(read_status, task_store)
+                data = status.model_dump_json()
+                if data != last_data:
+                    yield f"data: {data}\n\n"
+                    last_data = data
+                    idle = 0.0
+                elif idle >= 15:
+                    # 注释行作为心跳，避免网关或其他代理按空闲超时断开
+                    yield ": keep-alive\n\n"
+                    idle = 0.0
+                if status.status in ("completed", "failed", "not_found"):
+                    break
+                await asyncio.sleep(interval)
+                idle += interval
+        finally:
+            await asyncio.to_thread(task_store.close)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
@@ -3,9 +3,10 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from api.dependencies.database import get_db
 from api.models.subject import Subject,SubjectData
-from typing import List, Union
+from typing import Annotated, List, Optional, Union
 from api.schemas.subject import NotifyRequest, SubjectCreate, SubjectDataRegionResponse, SubjectDataResponse, SubjectDataTimeResponse, SubjectListResponse, SubjectResponse
 from fastapi_events.dispatcher import dispatch
+from services.identity import Identity, get_identity
 
 from api.schemas.interest import TimeInterest,RegionInterest,InterestMetaData
 
@@ -13,8 +14,14 @@ from api.schemas.interest import TimeInterest,RegionInterest,InterestMetaData
 router = APIRouter(prefix="/subject",tags=['subject'])
 #创建 subject
 @router.post("/create", response_model=SubjectResponse)
-def create_subject(subject: SubjectCreate, db: Session = Depends(get_db)):
-    db_subject= Subject(description=subject.description,name=subject.name,user_id=subject.user_id, status="pending", parameters=[i.model_dump_json()for i in subject.parameters])
+def create_subject(
+    subject: SubjectCreate,
+    identity: Annotated[Optional[Identity], Depends(get_identity)],
+    db: Session = Depends(get_db)
+):
+    # 经网关转发的请求以身份断言中的用户为创建者，不信任请求体中的 user_id
+    user_id = identity.sub if identity is not None else subject.user_id
+    db_subject= Subject(description=subject.description,name=subject.name,user_id=user_id, status="pending", parameters=[i.model_dump_json()for i in subject.parameters])
     db.add(db_subject)
     db.commit()
     db.refresh(db_subject)
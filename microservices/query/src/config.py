@@ -8,6 +8,8 @@ class Settings(BaseSettings):
     consul_host: str = "localhost"
     consul_port: int = 8500
     service_tags: List[str] = ["query"]
+    # 与网关共享的身份断言密钥，为空则不信任 X-Identity-Assertion
+    identity_secret: str = ""
     rabbitmq_host: str =  "localhost"
     rabbitmq_port: int = 5672
     rabbitmq_username: str = "admin"
@@ -9,6 +9,7 @@ from api.models.interest import InterestCollection
 from api.schemas.subject import NotifyTimeRequest,NotifyRegionRequest
 from api.models.subject import Subject, SubjectData
 from services.rabbitmq import RabbitMQClient
+from services.data_change import notify_data_changed
 
 
 @RabbitMQClient.consumer("interest_data")
@@ -70,6 +71,8 @@ async def handle_interest_data(message: IncomingMessage):
                 )
             logger.info(f"Subject {subject.subject_id} has been completed")
         db.commit()
+        # 新数据入库后通知网关失效相关的响应缓存
+        await notify_data_changed("/subject", "/subjectData", "/interests")
         
         await message.ack()
     except Exception as e:
@@ -4,6 +4,7 @@ from sqlalchemy import update
 from api.dependencies.database import get_db
 from api.models.subject import Subject, SubjectData
 from services.rabbitmq import RabbitMQClient
+from services.data_change import notify_data_changed
 from services.collector import HistoricalTaskRequest, ScheduledTaskRequest
 from fastapi_events.handlers.local import local_handler
 from fastapi_events.typing import Event
@@ -75,6 +76,7 @@ async def process_collector_respone(message: IncomingMessage):
             db.add(subjectData)
         
             db.commit()
+            await notify_data_changed("/subject")
             logger.info(f"Successfully submitted task {headers.get('subject_id')} to collector")
         else:
             logger.error(f"Failed to submit task {headers.get('subject_id')},error:{result.get('error')}")
@@ -38,6 +38,7 @@ async def lifespan_handler(app: FastAPI):
     # 注销服务
     registry.deregister(instance.service_name, instance.instance_id)
     await RabbitMQClient.close_consumers(app)
+    await RabbitMQClient.close_publishers()
             
 Base.metadata.create_all(bind=engine)          
 app = FastAPI(title="Query API",lifespan=lifespan_handler)
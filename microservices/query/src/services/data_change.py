@@ -0,0 +1,15 @@
+import json
+from fastapi.logger import logger
+from services.rabbitmq import RabbitMQClient
+
+
+async def notify_data_changed(*prefixes: str):
+    """
+    通知网关失效查询服务的响应缓存，prefixes 为发生变化的路径前缀，为空时失效全部。
+    通过 fanout 交换机广播给所有网关实例，复用长连接发布者。
+    """
+    try:
+        client = await RabbitMQClient.publisher("query_data_changed", broadcast=True)
+        await client.publish(json.dumps({"service_name": "query", "prefixes": list(prefixes)}))
+    except Exception as e:
+        logger.error(f"发送数据变更通知失败: {e}")
@@ -1,15 +1,16 @@
 
 from datetime import datetime, timedelta
 from typing import Annotated, List,Optional
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from sqlalchemy.orm import Session
 from api.models.user import User, UserRole, Role, user_role
 from api.dependencies.database import get_db
-from api.utils.auth import create_access_token, decode_token, get_current_active_admin, get_current_user, get_password_hash, verify_password
+from api.utils.auth import create_access_token, decode_token, evict_user, get_current_admin_identity, get_current_user, get_password_hash, invalidate_user, verify_password
 from config import get_settings
 from jose import JWTError, jwt
+from services.identity import Identity
 
 router = APIRouter()
 setting = get_settings()
@@ -97,7 +98,11 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     }
 
 @router.post("/token", response_model=Token)
-def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Session = Depends(get_db)):
+def login(
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
     if form_data.username == "guest":
         guestRole = Role(id=0, name="guest", description="guest", is_default=False)
         user = User(
@@ -135,6 +140,9 @@ def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Sessio
     # 更新最后登录时间
     user.last_login = datetime.now()
     db.commit()
+    # 登录接口是同步函数，先清除本实例缓存，广播放到响应后执行
+    evict_user(user.username)
+    background_tasks.add_task(invalidate_user, user.username)
     
     access_token_expires = timedelta(minutes=setting.access_token_expire_minutes)
     access_token = create_access_token(
@@ -160,7 +168,7 @@ async def read_users_me(current_user: Annotated[User, Depends(get_current_user)]
 
 @router.get("/users/list", response_model=list[UserResponse])
 async def read_all_users(
-    current_user: Annotated[User, Depends(get_current_active_admin)],
+    admin: Annotated[Identity, Depends(get_current_admin_identity)],
     db: Session = Depends(get_db)
 ):
     users = db.query(User).all()
@@ -212,7 +220,7 @@ async def get_public_key():
 @router.post("/roles/create", response_model=RoleResponse)
 async def create_role(
     role: RoleCreate,
-    current_user: Annotated[User, Depends(get_current_active_admin)],
+    admin: Annotated[Identity, Depends(get_current_admin_identity)],
     db: Session = Depends(get_db)
 ):
     db_role = db.query(Role).filter(Role.name == role.name).first()
@@ -231,7 +239,7 @@ async def create_role(
 
 @router.get("/roles/list", response_model=list[RoleResponse])
 async def get_roles(
-    current_user: Annotated[User, Depends(get_current_active_admin)],
+    admin: Annotated[Identity, Depends(get_current_admin_identity)],
     db: Session = Depends(get_db)
 ):
     return db.query(Role).all()
@@ -240,7 +248,7 @@ async def get_roles(
 async def assign_roles_to_user(
     user_id: int,
     roles: UserRoleAssign,
-    current_user: Annotated[User, Depends(get_current_active_admin)],
+    admin: Annotated[Identity, Depends(get_current_admin_identity)],
     db: Session = Depends(get_db)
 ):
     user = db.query(User).filter(User.id == user_id).first()
@@ -257,6 +265,7 @@ async def assign_roles_to_user(
             user.roles.append(role)
     
     db.commit()
+    await invalidate_user(user.username)
     db.refresh(user)
     return {
         "id": user.id,
@@ -274,7 +283,7 @@ async def assign_roles_to_user(
 @router.get("/users/{user_id}/roles/list", response_model=list[RoleResponse])
 async def get_user_roles(
     user_id: int,
-    current_user: Annotated[User, Depends(get_current_active_admin)],
+    admin: Annotated[Identity, Depends(get_current_admin_identity)],
     db: Session = Depends(get_db)
 ):
     user = db.query(User).filter(User.id == user_id).first()
@@ -302,6 +311,7 @@ async def change_password(
     # 更新为新密码
     current_user.hashed_password = get_password_hash(request.new_password)
     db.commit()
+    await invalidate_user(current_user.username)
     
     return {"message": "Password updated successfully"}
 
@@ -357,7 +367,7 @@ async def refresh_token(
 async def update_user_by_id(
     user_id: int,
     user_update: UserUpdate,
-    current_user: Annotated[User, Depends(get_current_active_admin)],
+    admin: Annotated[Identity, Depends(get_current_admin_identity)],
     db: Session = Depends(get_db)
 ):
     """
@@ -388,6 +398,7 @@ async def update_user_by_id(
     if user_update.is_active is not None:
         db_user.is_active = user_update.is_active
     db.commit()
+    await invalidate_user(db_user.username)
     db.refresh(db_user)
     
     return {
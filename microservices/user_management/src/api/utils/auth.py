@@ -1,6 +1,9 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
-from typing import Annotated
-from sqlalchemy.orm import Session
+from typing import Annotated, Optional
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from fastapi import Depends, HTTPException, status
 from jose import JWTError, jwt
 from api.models.user import Role, User, UserRole
@@ -9,9 +12,16 @@ from fastapi.security import OAuth2PasswordBearer
 
 from config import get_settings
 from api.dependencies.database import get_db
+from api.utils.cache import TTLCache
+from services.identity import Identity, get_identity
+from services.rabbitmq import RabbitMQClient
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 settings = get_settings()
+# 已验证的 token 载荷，过期时间与 token 的 exp 一致
+token_cache = TTLCache(maxsize=settings.token_cache_size)
+# 用户及其角色的短期缓存
+user_cache = TTLCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
 
 with open(settings.private_key_path, "rb") as key_file:
     private_key = key_file.read()
@@ -36,19 +46,89 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 def decode_token(token: Annotated[str, Depends(oauth2_scheme)]):
     return jwt.decode(token, public_key, algorithms=["RS256"], options={"verify_exp": False})
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def verify_token_cached(token: str) -> dict:
+    """校验token，验证过的载荷按 token 摘要缓存到其过期时间"""
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    payload = token_cache.get(digest)
+    if payload is None:
+        payload = jwt.decode(token, public_key, algorithms=["RS256"])
+        if payload.get("exp") is not None:
+            token_cache.set(digest, payload, expires_at=payload["exp"])
+    return payload
+
+def _columns(obj) -> dict:
+    return {column.name: getattr(obj, column.name) for column in obj.__table__.columns}
+
+def get_user_cached(db: Session, username: str) -> Optional[User]:
+    """
+    按用户名查询用户及角色，结果缓存 user_cache_ttl 秒。
+    缓存的是列值快照，每次重新构造对象并以 load=False 合并进当前会话，
+    返回的对象与查询结果一样可以被修改和提交，且不会发出 SELECT。
+    """
+    snapshot = user_cache.get(username)
+    if snapshot is None:
+        user = db.query(User).filter(User.username == username).first()
+        if user is None:
+            return None
+        snapshot = (_columns(user), [_columns(role) for role in user.roles])
+        user_cache.set(username, snapshot)
+    user_columns, role_columns = snapshot
+    roles = []
+    for columns in role_columns:
+        role = Role(**columns)
+        make_transient_to_detached(role)
+        roles.append(role)
+    user = User(**user_columns)
+    make_transient_to_detached(user)
+    set_committed_value(user, "roles", roles)
+    return db.merge(user, load=False)
+
+def evict_user(username: str):
+    """清除本实例缓存的用户"""
+    user_cache.pop(username)
+
+async def invalidate_user(username: str):
+    """
+    用户信息或角色变更后清除缓存：先清除本实例，再经 user_invalidate_queue 广播给所有实例。
+    广播失败时其他实例的缓存最多保留 user_cache_ttl 秒。
+    """
+    evict_user(username)
+    try:
+        client = await RabbitMQClient.publisher("user_invalidate_queue", broadcast=True)
+        await client.publish(username)
+    except Exception as e:
+        print(f"Error broadcasting user invalidation: {e}")
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+async def get_current_identity(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    identity: Annotated[Optional[Identity], Depends(get_identity)]
+) -> Identity:
+    """
+    当前用户的用户名和角色。经网关转发的请求直接使用已验证签名的身份断言，
+    不做 RSA 校验也不查询数据库；没有有效断言时回退到校验 JWT。
+    """
+    if identity is not None:
+        return identity
     try:
-        payload = jwt.decode(token, public_key, algorithms=["RS256"])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
+        payload = verify_token_cached(token)
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return Identity(sub=payload["sub"], roles=payload.get("roles") or [], exp=int(payload.get("exp") or 0))
+
+async def get_current_user(
+    identity: Annotated[Identity, Depends(get_current_identity)],
+    db: Session = Depends(get_db)
+):
+    username: str = identity.sub
     if username=="guest": 
         guestRole=Role(id=0,name="guest",description="guest",is_default=False)
         current_time = datetime.now()
@@ -65,15 +145,15 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Se
             roles=[guestRole]
         )
         return user
-    user = db.query(User).filter(User.username == username).first()
+    user = get_user_cached(db, username)
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
 
-async def get_current_active_admin(
-    current_user: Annotated[User, Depends(get_current_user)]
-):
-    #print(current_user.roles[0].name)
-    if all(role.name != "admin" for role in current_user.roles):
+async def get_current_admin_identity(
+    identity: Annotated[Identity, Depends(get_current_identity)]
+) -> Identity:
+    """只需确认管理员角色的路由使用，角色取自身份断言或 JWT，不查询用户"""
+    if "admin" not in identity.roles:
         raise HTTPException(status_code=400, detail="Insufficient permissions")
-    return current_user
+    return identity
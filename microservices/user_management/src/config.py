@@ -10,6 +10,12 @@ class Settings(BaseSettings):
     access_token_expire_minutes: int
     consul_host: str = "localhost"
     consul_port: int = 8500
+    # 已验证token缓存和用户缓存
+    token_cache_size: int = 4096
+    user_cache_size: int = 1024
+    user_cache_ttl: float = 30
+    # 与网关共享的身份断言密钥，为空则不信任 X-Identity-Assertion，始终校验 JWT
+    identity_secret: str = ""
     
     rabbitmq_host: str =  "localhost"
     rabbitmq_port: int = 5672
@@ -9,6 +9,8 @@ from api.dependencies.database import engine, Base
 from config import get_settings
 
 from services.registry import ConsulRegistry, ServiceInstance
+from api.utils.auth import evict_user, token_cache, user_cache
+import aio_pika
 
 # 配置信息
 settings = get_settings()
@@ -29,23 +31,32 @@ async def publish_public_key_periodically():
             with open(settings.public_key_path, "r") as key_file:
                 public_key = key_file.read()
             
-            async with RabbitMQClient("public_key_queue") as client:
-                await client.publish(public_key)
-               
+            # 广播给所有网关和权限服务实例
+            client = await RabbitMQClient.publisher("public_key_queue", broadcast=True)
+            await client.publish(public_key)
             
             # 每隔60秒发布一次
             await asyncio.sleep(60)
         except Exception as e:
             print(f"Error publishing public key: {e}")
             await asyncio.sleep(10)  # 出错后等待10秒重试
-            
+
+@RabbitMQClient.consumer(queue="user_invalidate_queue", broadcast=True)
+async def on_user_invalidate(message: aio_pika.IncomingMessage):
+    async with message.process():
+        # 任一实例修改用户信息或角色后广播用户名，所有实例（包括发送方）清除该用户的缓存
+        evict_user(message.body.decode())
+
 async def lifespan_handler(app: FastAPI):
     # 启动后台任务定期发布公钥
     asyncio.create_task(publish_public_key_periodically())
     
+    await RabbitMQClient.start_consumers(app)
     registry.register(instance)
     yield
     registry.deregister(instance.service_name, instance.instance_id)
+    await RabbitMQClient.close_consumers(app)
+    await RabbitMQClient.close_publishers()
 
 # -------------------- 应用初始化 --------------------
 Base.metadata.create_all(bind=engine)
@@ -56,6 +67,11 @@ app.include_router(user.router)
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """token 及用户缓存命中统计"""
+    return {"token_cache": token_cache.stats(), "user_cache": user_cache.stats()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=settings.port)